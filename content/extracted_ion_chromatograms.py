@@ -163,7 +163,9 @@ if save_button:
         edited.to_csv(input_table_path, index=False)
     save_params(params)
 
-if submitted:
+if submitted and extraction_running(results_dir):
+    st.warning("Chromatograms are being extracted, cancel the extraction to start a new one.")
+elif submitted:
     if not use_mz_calculator_table:
         edited.to_csv(input_table_path, index=False)
     save_params(params)
@@ -204,10 +206,24 @@ if submitted:
                 st.session_state["eic_time_unit"],
                 st.session_state["eic_peak_width"],
                 st.session_state["eic_baseline"],
+                Path(st.session_state.workspace, "mzML-cache"),
             )
         else:
             st.error("No input m/z values provided.")
 
+# Show the progress of a running extraction, which can be cancelled at any time
+if extraction_running(results_dir):
+    if st.button("Cancel extraction", type="primary"):
+        stop_extraction(results_dir)
+        st.rerun()
+    extraction_progress(results_dir)
+else:
+    progress = read_progress(results_dir)
+    if progress is not None and progress["state"] == "error":
+        st.error(progress["message"])
+    elif progress is not None and progress["state"] == "cancelled":
+        st.warning("Extraction cancelled.")
+
 path = Path(results_dir, "summary.tsv")
 if path.exists():
     st.checkbox(
@@ -28,7 +28,10 @@ selected_file = cols[0].selectbox(
     key="view_selected_file"
 )
 if selected_file:
-    view.get_df(Path(st.session_state.workspace, "mzML-files", selected_file))
+    view.get_df(
+        Path(st.session_state.workspace, "mzML-files", selected_file),
+        Path(st.session_state.workspace, "mzML-cache"),
+    )
 
     tabs = st.tabs(
         ["📈 Peak map (MS1)", "📈 Spectra (MS1 + MS2)", "📈 Chromatograms (MS1)"]
@@ -1,6 +1,7 @@
 import streamlit as st
 from pathlib import Path
 from .workflow.WorkflowManager import WorkflowManager
+from .workflow.StepGraph import StepGraph
 
 import pandas as pd
 
@@ -519,6 +520,16 @@ class Workflow(WorkflowManager):
                             ],
                             help="Search formulas in the given database. If no database is given all possible molecular formulas will be respected (no database is used).",
                         )
+                    with cols[3]:
+                        self.ui.input_widget(
+                            "sirius-parallel-jobs",
+                            2,
+                            "parallel jobs",
+                            min_value=1,
+                            max_value=32,
+                            step_size=1,
+                            help="Maximum number of SIRIUS projects (one per mzML file) processed at the same time. Available CPU cores are split across the jobs. Each job needs several GB of memory.",
+                        )
                     cols = st.columns(4)
                     with cols[0]:
                         self.ui.input_widget(
@@ -803,14 +814,13 @@ class Workflow(WorkflowManager):
         # Feature Detection
         self.logger.log("Detecting features.")
         ffm = self.file_manager.get_files(mzML, "featureXML", "ffm-featureXML")
+        ffm_chroms = self.file_manager.get_files(mzML, set_results_dir="ffm-chroms")
         self.executor.run_topp(
             "FeatureFinderMetabo",
             input_output={
                 "in": mzML,
                 "out": ffm,
-                "out_chrom": self.file_manager.get_files(
-                    mzML, set_results_dir="ffm-chroms"
-                ),
+                "out_chrom": ffm_chroms,
             },
         )
 
@@ -850,7 +860,15 @@ class Workflow(WorkflowManager):
             )
 
         # Export FFM feature maps to dataframes (including chromatograms)
-        self.executor.run_python("export_ffm_df", {"in": ffm})
+        ffm_df = self.file_manager.get_files(ffm, "parquet", "ffm-df")
+        self.executor.run_python(
+            "export_ffm_df",
+            {
+                "in": ffm,
+                "in_chrom": ffm_chroms,
+                "out": ffm_df,
+            },
+        )
 
         # Feature Linking and Export to pd.DataFrame
         self.logger.log("Linking features.")
@@ -907,7 +925,14 @@ class Workflow(WorkflowManager):
                 )
 
             # Export re-quantified feature maps to dataframes (including chromatograms)
-            self.executor.run_python("export_ffmid_df", {"in": ffmid})
+            ffmid_df = self.file_manager.get_files(ffmid, "parquet", "ffmid-df")
+            self.executor.run_python(
+                "export_ffmid_df",
+                {
+                    "in": ffmid,
+                    "out": ffmid_df,
+                },
+            )
 
             # Link re-quantified features
             consensusXML_ffmid = self.file_manager.get_files(
@@ -940,29 +965,22 @@ class Workflow(WorkflowManager):
             )
 
             # Merge feature maps from FFM and FFMID from merged consensus table
+            # and re-create the feature maps directly from the merged features
+            ffm_recreated = self.file_manager.get_files(
+                ffm, "featureXML", "feature-maps-recreated"
+            )
             self.executor.run_python(
                 "merge_ffm_ffmid_df",
                 {
                     "in": consensus_df,
+                    "in_ffm": ffm_df,
+                    "in_ffmid": ffmid_df,
+                    "out_featureXML": ffm_recreated,
                 },
             )
 
-            # Re-create feature maps from consensus df
-            self.executor.run_python(
-                "recreate_feature_maps",
-                {"in": str(Path(self.file_manager.workflow_dir, "results"))},
-            )
-
             # Ensure mzML and featureXML file paths are ordered the same for SiriusExport and GNPSExport
-            ffm = sorted(
-                [
-                    str(p)
-                    for p in Path(
-                        Path(consensus_df[0]).parent.parent,
-                        "feature-maps-recreated",
-                    ).glob("*.featureXML")
-                ]
-            )
+            ffm = sorted(ffm_recreated)
             mzML = sorted(mzML)
 
         self.add_sirius_path_to_session_state()
@@ -982,8 +1000,15 @@ class Workflow(WorkflowManager):
                     st.session_state["sirius-path"] = ""
             else:
                 st.session_state["sirius-path"] = ""
+        # Steps run in separate threads, resolve session state here
+        sirius_path = st.session_state["sirius-path"]
+
+        # The remaining steps only depend on the feature maps and mzML files, independent
+        # branches (SIRIUS and GNPS/MS2 annotation) are executed at the same time.
+        # Steps which update the consensus table in place depend on each other.
+        graph = StepGraph()
 
-        if self.params["export-sirius"] or st.session_state["sirius-path"]:
+        def sirius():
             self.logger.log("Exporting input files for SIRIUS.")
             sirius_ms_files = self.file_manager.get_files(mzML, "ms", "sirius-export")
             self.executor.run_topp(
@@ -994,11 +1019,11 @@ class Workflow(WorkflowManager):
                     "out": sirius_ms_files,
                 },
             )
-            if st.session_state["sirius-path"]:
+            if sirius_path:
                 self.logger.log("Logging in to SIRIUS...")
-                self.executor.run_command(
+                self.executor.run_scheduled_command(
                     [
-                        st.session_state["sirius-path"],
+                        sirius_path,
                         "login",
                         f"--email={self.params['sirius-user-email']}",
                         f"--password={self.params['sirius-user-password']}",
@@ -1011,11 +1036,22 @@ class Workflow(WorkflowManager):
                     for file in sirius_ms_files
                 ]
                 commands = []
+                input_sizes = []
                 for ms, project in zip(sirius_ms_files, sirius_projects):
                     if Path(ms).stat().st_size > 0:
+                        # Skip projects which have been completed after the input file was exported
+                        summary = Path(project, "formula_identifications.tsv")
+                        if (
+                            summary.exists()
+                            and summary.stat().st_mtime > Path(ms).stat().st_mtime
+                        ):
+                            self.logger.log(f"SIRIUS results for {project.name} are up to date.")
+                            continue
+                        # Remove incomplete projects from interrupted runs
+                        shutil.rmtree(project, ignore_errors=True)
                         project.mkdir(parents=True)
                         command = [
-                            st.session_state["sirius-path"],
+                            sirius_path,
                             "--input",
                             ms,
                             "--project",
@@ -1053,27 +1089,34 @@ class Workflow(WorkflowManager):
                             command.append("canopus")
                         command.append("write-summaries")
                         commands.append(command)
+                        input_sizes.append(Path(ms).stat().st_size)
                 if commands:
                     self.logger.log("Running SIRIUS... (might take a VERY long time)")
-                    for command in commands:
-                        self.logger.log(f"Running file {Path(command[2]).stem}...")
-                        self.executor.run_command(command)
+                    # Process projects in parallel, the scheduler splits the available cores across the jobs
+                    self.executor.run_multiple_commands(
+                        commands,
+                        input_sizes,
+                        self.params.get("sirius-parallel-jobs", 2),
+                        threads_option="--cores",
+                    )
+                elif any(Path(ms).stat().st_size > 0 for ms in sirius_ms_files):
+                    self.logger.log("SIRIUS results are up to date.")
                 else:
                     self.logger.log("No MS2 data for SIRIUS to process.")
 
-        if (
-            self.params["export-gnps"]
-            or self.params["annotate-ms2"]
-            or self.params["run-ms2query"]
-        ):
+        if self.params["export-sirius"] or sirius_path:
+            graph.add("sirius", sirius)
+
+        def gnps():
             self.logger.log("Exporting input files for GNPS.")
-            # Map MS2 specs to features
+            # Map MS2 specs to features (to a new directory, feature maps are read by SiriusExport at the same time)
+            ffm_ms2 = self.file_manager.get_files(ffm, "featureXML", "ffm-idmapped")
             self.executor.run_topp(
                 "IDMapper",
                 {
                     "in": ffm,
                     "spectra:in": mzML,
-                    "out": ffm,
+                    "out": ffm_ms2,
                     "id": self.file_manager.get_files(
                         str(Path("assets", "empty.idXML"))
                     ),
@@ -1086,7 +1129,7 @@ class Workflow(WorkflowManager):
             self.executor.run_topp(
                 "FeatureLinkerUnlabeledKD",
                 {
-                    "in": self.file_manager.get_files(ffm, collect=True),
+                    "in": self.file_manager.get_files(ffm_ms2, collect=True),
                     "out": gnps_consensus,
                 },
             )
@@ -1128,61 +1171,77 @@ class Workflow(WorkflowManager):
                 },
             )
 
-        if self.params["annotate-ms2"]:
+        if (
+            self.params["export-gnps"]
+            or self.params["annotate-ms2"]
+            or self.params["run-ms2query"]
+        ):
+            graph.add("gnps", gnps)
+
+        def annotate_ms2():
             dir_path = Path(self.workflow_dir, "input-files", "ms2-library")
             if dir_path.exists():
-                dir_path = Path(self.workflow_dir, "input-files", "ms2-library")
-                if dir_path.exists():
-                    files = [p for p in dir_path.iterdir()]
-                    if files:
-                        self.logger.log("Annotating consensus features on MS2 level.")
-                        self.executor.run_topp(
-                            "FileConverter",
-                            {
-                                "in": self.file_manager.get_files(
-                                    "MS2", "mgf", "gnps-export"
-                                ),
-                                "out": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                            },
-                        )
-                        self.executor.run_topp(
-                            "MetaboliteSpectralMatcher",
-                            {
-                                "in": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                                "database": self.file_manager.get_files(str(files[0])),
-                                "out": self.file_manager.get_files(
-                                    "MS2-matches", "mzTab", "spectral-matcher"
-                                ),
-                            },
-                            custom_params={"algorithm:merge_spectra": "false"},
-                        )
-                        self.executor.run_python(
-                            "annotate-ms2",
-                            {
-                                "in_mzTab": self.file_manager.get_files(
-                                    "MS2-matches", "mzTab", "spectral-matcher"
-                                ),
-                                "in_mzML": self.file_manager.get_files(
-                                    "MS2", "mzML", "spectral-matcher"
-                                ),
-                                "in_mgf": self.file_manager.get_files(
-                                    "MS2", "mgf", "gnps-export"
-                                ),
-                                "in_gnps_consensus": self.file_manager.get_files(
-                                    "feature-matrix-gnps", "parquet", "consensus-dfs"
-                                ),
-                                "out": consensus_df,
-                            },
-                        )
+                files = [p for p in dir_path.iterdir()]
+                if files:
+                    self.logger.log("Annotating consensus features on MS2 level.")
+                    self.executor.run_topp(
+                        "FileConverter",
+                        {
+                            "in": self.file_manager.get_files(
+                                "MS2", "mgf", "gnps-export"
+                            ),
+                            "out": self.file_manager.get_files(
+                                "MS2", "mzML", "spectral-matcher"
+                            ),
+                        },
+                    )
+                    self.executor.run_topp(
+                        "MetaboliteSpectralMatcher",
+                        {
+                            "in": self.file_manager.get_files(
+                                "MS2", "mzML", "spectral-matcher"
+                            ),
+                            "database": self.file_manager.get_files(str(files[0])),
+                            "out": self.file_manager.get_files(
+                                "MS2-matches", "mzTab", "spectral-matcher"
+                            ),
+                        },
+                        custom_params={"algorithm:merge_spectra": "false"},
+                    )
+                    self.executor.run_python(
+                        "annotate-ms2",
+                        {
+                            "in_mzTab": self.file_manager.get_files(
+                                "MS2-matches", "mzTab", "spectral-matcher"
+                            ),
+                            "in_mzML": self.file_manager.get_files(
+                                "MS2", "mzML", "spectral-matcher"
+                            ),
+                            "in_mgf": self.file_manager.get_files(
+                                "MS2", "mgf", "gnps-export"
+                            ),
+                            "in_gnps_consensus": self.file_manager.get_files(
+                                "feature-matrix-gnps", "parquet", "consensus-dfs"
+                            ),
+                            "out": consensus_df,
+                        },
+                    )
 
-        if st.session_state["sirius-path"]:
+        # MS2 matching uses the MS2 spectra exported for GNPS
+        if self.params["annotate-ms2"]:
+            graph.add("annotate-ms2", annotate_ms2, ["gnps"])
+
+        def annotate_sirius():
             self.executor.run_python("annotate-sirius", {"in": consensus_df})
 
-        if self.params["run-ms2query"]:
+        if sirius_path:
+            graph.add(
+                "annotate-sirius",
+                annotate_sirius,
+                [s for s in ["sirius", "annotate-ms2"] if s in graph],
+            )
+
+        def ms2query():
             self.logger.log(
                 "Detecting chemical analogues and compound classes with MS2Query. This will take a while..."
             )
@@ -1191,6 +1250,10 @@ class Workflow(WorkflowManager):
                 {
                     "in": consensus_df,
                     "in_mgf": self.file_manager.get_files("MS2", "mgf", "gnps-export"),
+                    "in_gnps": self.file_manager.get_files(
+                        "feature-matrix-gnps", "parquet", "consensus-dfs"
+                    ),
+                    "out": consensus_df,
                     "out_ms2query_csv": self.file_manager.get_files(
                         "MS2", "csv", "ms2query"
                     ),
@@ -1198,6 +1261,15 @@ class Workflow(WorkflowManager):
                 },
             )
 
+        if self.params["run-ms2query"]:
+            graph.add(
+                "ms2query",
+                ms2query,
+                [s for s in ["gnps", "annotate-ms2", "annotate-sirius"] if s in graph],
+            )
+
+        graph.run()
+
         # ZIP all relevant files for Download
         self.executor.run_python("zip-result-files", {"in": consensus_df})
 
@@ -2,10 +2,37 @@ import pyopenms as oms
 import pandas as pd
 import numpy as np
 import os
+import importlib.util
 from pathlib import Path
 from src.common.common import reset_directory
 from pyteomics import mztab, mgf
 
+# MS1 annotations are shared with the annotate-ms1 script (src/python-tools is not a package)
+_spec = importlib.util.spec_from_file_location(
+    "ms1_annotation", Path(Path(__file__).parent, "python-tools", "ms1_annotation.py")
+)
+_ms1_annotation = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_ms1_annotation)
+ms1_annotations = _ms1_annotation.ms1_annotations
+
+
+def combine_variants(df):
+    """
+    Sums the values of metabolite variants (e.g. adducts), named "metabolite#variant",
+    per metabolite. Metabolites without variants are kept as they are.
+
+    Args:
+        df (pd.DataFrame): Values (e.g. AUCs) with metabolite names as index.
+
+    Returns:
+        pd.DataFrame: Summed values with the metabolite names (without variant) as index,
+        NaN if a value of any variant is missing.
+    """
+    values = df.astype(float)
+    names = pd.Index([str(name).split("#")[0] for name in values.index])
+    combined = values.groupby(names, sort=False).sum()
+    return combined.mask(values.isna().groupby(names, sort=False).any())
+
 
 class DataFrames():
     def create_consensus_table(self, consensusXML_file, table_file, sirius_ms_dir=""):
@@ -137,16 +164,7 @@ class DataFrames():
             df = pd.read_csv(df_auc_file, sep="\t")
         elif df_auc_file.endswith("ftr"):
             df = pd.read_feather(df_auc_file).drop(columns=["index"])
-        aucs_condensed = {}
-        for a in set([c.split("#")[0] for c in df.columns]):
-            aucs_condensed[a] = 0
-            for b in [
-                b for b in df.columns if ((a + "#" in b and b.startswith(a)) or a == b)
-            ]:
-                aucs_condensed[a] += df[b][0]
-        df_combined = pd.DataFrame(
-            {key: pd.Series(value) for key, value in aucs_condensed.items()}
-        )
+        df_combined = combine_variants(df.iloc[[0]].T).T
         if table_file.endswith("tsv"):
             df_combined.reset_index().to_csv(table_file, sep="\t")
         elif table_file.endswith("ftr"):
@@ -195,24 +213,9 @@ class DataFrames():
 
         df["mz"] = df["mz"].astype(float)
 
-        for _, std in library.iterrows():
-            delta_Da = abs(mz_window * std["mz"] / 1000000)
-            mz_lower = std["mz"] - delta_Da
-            mz_upper = std["mz"] + delta_Da
-            rt_lower = std["RT"] - rt_window / 2
-            rt_upper = std["RT"] + rt_window / 2
-            match = df.query(
-                "mz > @mz_lower and mz < @mz_upper and RT > @rt_lower and RT < @rt_upper"
-            )
-            if not match.empty:
-                for _, row in match.iterrows():
-                    if len(df.loc[df["id"] == row["id"], "MS1 annotation"]) > 1:
-                        df.loc[df["id"] == row["id"], "MS1 annotation"] += (
-                            ";" + std["name"]
-                        )
-                    else:
-                        df.loc[df["id"] == row["id"],
-                               "MS1 annotation"] += std["name"]
+        df["MS1 annotation"] = ms1_annotations(
+            df["mz"], df["RT"], df["id"], library, mz_window, rt_window
+        )
 
         # replace generic metabolite name with actual MS1 annotation
         metabolites = []
@@ -3,11 +3,15 @@ import streamlit as st
 from src.common.common import *
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 
-import pyopenms as oms
+from src.mzml import cache_peaks, remove_orphaned_caches
+from src.dataframes import combine_variants
 
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -47,143 +51,256 @@ This page allows you to extract chromatograms from mzML files and perform variou
 Feel free to explore the different features and options on this page to extract and analyze your chromatogram data efficiently.
 """
 
-def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz_da, time_unit, default_peak_width, baseline):
-    with st.status("Extracting chromatograms...") as status:
-        # Check for unique index
-        if not df_input["name"].is_unique:
-            st.error("Metabolite names need to be unique.")
-            status.update(label="Error!", state="error", expanded=True)
-            return
-        
-        if any(df_input["name"].isna()):
-            st.error("Enter a name for each metabolite.")
-            status.update(label="Error!", state="error", expanded=True)
-            return
-
-        # Drop all rows without mz value
-        df_input = df_input[df_input['mz'].notna()]
-
-        # Get RT times in seconds for extraction
-        if time_unit == "minutes":
-            df_input["RT"] = df_input["RT"]*60
-            df_input["peak width"] = df_input["peak width"]*60
-
-        # Delete and re-create results directory
-        reset_directory(Path(results_dir))
-
-        # To make a zip file with tables in tsv format later, create a directory
-        tsv_dir = Path(results_dir, "tsv-tables")
-        reset_directory(tsv_dir)
+def highest_in_windows(mz, intensity, mz_min, mz_max, baseline):
+    """
+    Finds the highest peak of a spectrum within many m/z windows at once with binary
+    searches in the sorted peaks.
+
+    Args:
+        mz (np.ndarray): m/z values of the peaks, sorted.
+        intensity (np.ndarray): Intensity values of the peaks.
+        mz_min (np.ndarray): Lower m/z bound per window (inclusive).
+        mz_max (np.ndarray): Upper m/z bound per window (inclusive).
+        baseline (float): Intensities up to the baseline are set to 0.
+
+    Returns:
+        np.ndarray: Highest intensity within each window truncated to int, 0 if there is no peak above the baseline.
+    """
+    if not mz.size:
+        return np.zeros(len(mz_min), dtype=np.int64)
+    starts = np.searchsorted(mz, mz_min, side="left")
+    ends = np.searchsorted(mz, mz_max, side="right")
+    # highest intensity between start and end of each window, a trailing value keeps all indices valid
+    bounds = np.empty(2 * len(mz_min), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends
+    highest = np.maximum.reduceat(np.append(intensity, 0), bounds)[0::2].astype(np.int64)
+    return np.where((starts < ends) & (highest > baseline), highest, 0)
+
+
+def read_ion_chromatograms(file, cache_dir, mz_min, mz_max, rt_min, rt_max, baseline):
+    """
+    Extracts the chromatograms of many targets from the peak cache of an mzML file. Peaks
+    are only read for the row groups which contain MS1 spectra within the RT window of any
+    target and searched only for the targets whose RT window contains the spectrum.
+
+    Args:
+        file (str | Path): Path to the mzML file.
+        cache_dir (str | Path): The cache directory of the workspace (mzML-cache).
+        mz_min (np.ndarray): Lower m/z bound per target (inclusive).
+        mz_max (np.ndarray): Upper m/z bound per target (inclusive).
+        rt_min (np.ndarray): Lower RT bound per target (inclusive, -inf for no limit).
+        rt_max (np.ndarray): Upper RT bound per target (inclusive, inf for no limit).
+        baseline (float): Intensities up to the baseline are set to 0.
+
+    Returns:
+        tuple: Retention times (seconds) and base peak intensities of the MS1 spectra (all
+        spectra except MS2) and the chromatograms of the targets (columns) in each spectrum (rows).
+    """
+    cache = pq.ParquetFile(cache_peaks(file, cache_dir))
+    index = cache.read(columns=["RT", "MS level", "base peak intensity"])
+    ms1 = np.flatnonzero(index["MS level"].to_numpy() != 2)
+    rts = index["RT"].to_numpy()[ms1]
+    bpc = index["base peak intensity"].to_numpy()[ms1].astype(np.int64)
+    eics = np.zeros((len(ms1), len(mz_min)), dtype=np.int64)
+
+    # Targets to search in each MS1 spectrum, grouped by the row group holding its peaks
+    group_ends = np.cumsum([cache.metadata.row_group(g).num_rows for g in range(cache.num_row_groups)])
+    searches = {}
+    for row, (spectrum, rt) in enumerate(zip(ms1, rts)):
+        targets = np.flatnonzero(~((rt_min > rt) | (rt_max < rt)))
+        if targets.size:
+            group = int(np.searchsorted(group_ends, spectrum, side="right"))
+            searches.setdefault(group, []).append((row, spectrum, targets))
+
+    for group, spectra in searches.items():
+        peaks = cache.read_row_group(group, columns=["mzarray", "intarray"])
+        first = group_ends[group] - peaks.num_rows
+        mzarray = peaks["mzarray"].combine_chunks()
+        intarray = peaks["intarray"].combine_chunks()
+        offsets = mzarray.offsets.to_numpy()
+        mz = mzarray.values.to_numpy()
+        intensity = intarray.values.to_numpy()
+        for row, spectrum, targets in spectra:
+            begin, end = offsets[spectrum - first], offsets[spectrum - first + 1]
+            eics[row, targets] = highest_in_windows(
+                mz[begin:end], intensity[begin:end], mz_min[targets], mz_max[targets], baseline
+            )
+    return rts, bpc, eics
+
+
+def eic_windows(df_input, mz_unit, mz_ppm, mz_da, default_peak_width):
+    """
+    Determines the names and the m/z and RT windows of the metabolites for EIC extraction.
+
+    Args:
+        df_input (pd.DataFrame): Metabolite table with name, mz, RT and peak width (seconds).
+        mz_unit (str): Unit of the mass tolerance, "Da" or "ppm".
+        mz_ppm (float): Mass tolerance in ppm.
+        mz_da (float): Mass tolerance in Da.
+        default_peak_width (float): Peak width used for metabolites with RT but without peak width.
+
+    Returns:
+        tuple: Metabolite names (list), lower and upper m/z and RT bounds (np.ndarray).
+    """
+    names, mz_min, mz_max, rt_min, rt_max = [], [], [], [], []
+    for mass, name, rt, peak_width in zip(df_input["mz"],
+                                          df_input["name"],
+                                          df_input["RT"],
+                                          df_input["peak width"]):
+        if name:
+            names.append(name)
+        else:
+            names.append(str(mass))
+
+        # m/z window (Da or ppm)
+        if mz_unit == "Da":
+            mz_tolerance = mz_da
+        else:
+            mz_tolerance = float((mz_ppm / 1000000) * mass)
+        mz_min.append(mass - mz_tolerance)
+        mz_max.append(mass + mz_tolerance)
+
+        # Without RT information all spectra are used
+        if np.isnan(rt):
+            rt_min.append(-np.inf)
+            rt_max.append(np.inf)
+        # Custom peak width per metabolite
+        elif rt and not np.isnan(peak_width):
+            rt_min.append(rt-(peak_width/2))
+            rt_max.append(rt+(peak_width/2))
+        elif rt:
+            rt_min.append(rt - default_peak_width/2)
+            rt_max.append(rt + default_peak_width/2)
+        else:
+            rt_min.append(rt-5)
+            rt_max.append(rt+5)
+    return (names, *(np.array(a, dtype=np.float64) for a in (mz_min, mz_max, rt_min, rt_max)))
+
+
+def extract_file(file, cache_dir, results_dir, names, mz_min, mz_max, rt_min, rt_max, time_unit, baseline):
+    """
+    Extracts the chromatograms of one mzML file and saves them as feather and tsv file.
+
+    Args:
+        file (Path): The mzML file.
+        cache_dir (Path): The cache directory of the workspace (mzML-cache).
+        results_dir (Path): The results directory.
+        names (list): Metabolite names.
+        mz_min, mz_max, rt_min, rt_max (np.ndarray): m/z and RT windows of the metabolites.
+        time_unit (str): Time unit of the chromatograms, "seconds" or "minutes".
+        baseline (float): Intensities up to the baseline are set to 0.
+
+    Returns:
+        dict: AUC of each metabolite.
+    """
+    # Read the peaks from the cache (converted once per mzML file) and extract all chromatograms at once
+    rts, bpc, eics = read_ion_chromatograms(file, cache_dir, mz_min, mz_max, rt_min, rt_max, baseline)
+
+    # get BPC and time always for each file
+    time = rts / 60 if time_unit == "minutes" else rts
+    columns = {"time": time, "BPC": bpc}
+    aucs = {}
+    for i, name in enumerate(names):
+        columns[name] = eics[:, i]
+        aucs[name] = np.trapz(eics[:, i], time)
+    df = pd.DataFrame(columns)
+
+    # Save to feather dataframe for quick access
+    df.to_feather(Path(results_dir, Path(file).stem + ".ftr"))
+    # Save as tsv for download option
+    df.to_csv(
+        Path(results_dir, "tsv-tables", Path(file).stem + ".tsv"), sep="\t", index=False
+    )
+    return aucs
+
+
+def _write_progress(results_dir, progress):
+    # Replace the file at once, the page reads it while the job is running
+    path = Path(results_dir, "progress.json")
+    with open(path.with_suffix(".tmp"), "w") as f:
+        json.dump(progress, f)
+    os.replace(path.with_suffix(".tmp"), path)
+
+
+def read_progress(results_dir):
+    """
+    Reads the progress of the extraction job.
+
+    Args:
+        results_dir (Path): The results directory.
+
+    Returns:
+        dict: State of the job ("running", "finished", "error" or "cancelled"), error message and state of each file ("waiting", "done" or "failed"), None if no job has been started.
+    """
+    try:
+        with open(Path(results_dir, "progress.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _register_worker(pid_dir):
+    # Worker processes are killed together with the job when it is cancelled
+    Path(pid_dir, str(os.getpid())).touch()
+
+
+def extraction_job(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz_da, time_unit, default_peak_width, baseline, cache_dir, workers):
+    """
+    Extracts the chromatograms from all mzML files in a pool of worker processes and
+    writes the AUC summary tables. Runs in a separate process started by extract_chromatograms,
+    the progress is written to progress.json in the results directory.
+    """
+    pid_dir = Path(results_dir, "pids")
+    progress = {
+        "state": "running",
+        "message": "",
+        "files": {Path(file).name: "waiting" for file in mzML_files},
+    }
+    _write_progress(results_dir, progress)
+    try:
+        remove_orphaned_caches(cache_dir)
+        names, mz_min, mz_max, rt_min, rt_max = eic_windows(
+            df_input, mz_unit, mz_ppm, mz_da, default_peak_width
+        )
 
         # Create an empty df for AUCs with filenames as columns and mass names as indexes
         df_auc = pd.DataFrame(
             columns=[Path(file).name for file in mzML_files], index=df_input["name"]
         )
+        # Add rows for metabolites named by their mass
+        df_auc = df_auc.reindex(
+            list(df_auc.index) + [n for n in dict.fromkeys(names) if n not in df_auc.index]
+        )
 
-        # Iterate over the files and extract chromatograms in a single dataframe per file
-        for file in mzML_files:
-            st.write(f"Extracting chromatograms from {Path(file).name} ...")
-            # Load mzML file into exp
-            exp = oms.MSExperiment()
-            oms.MzMLFile().load(str(file), exp)
-
-            # Create an empty dataframe to collect chromatogram data in
-            df = pd.DataFrame()
-
-            # get BPC and time always for each file
-            time = []
-            ints = []
-            for spec in exp:
-                if spec.getMSLevel() == 2:
-                    continue
-                _, intensities = spec.get_peaks()
-                rt = spec.getRT()
-                if time_unit == "minutes":
-                    rt = rt / 60
-                time.append(rt)
-                i = int(max(intensities))
-                ints.append(i)
-            df["time"] = time
-            df["BPC"] = ints
-
-            # get EICs
-            for mass, name, rt, peak_width in zip(df_input["mz"],
-                                                  df_input["name"],
-                                                  df_input["RT"],
-                                                  df_input["peak width"]):
-                if name:
-                    metabolite_name = name
-                else:
-                    metabolite_name = str(mass)
-
-                # Initialize rt_min and rt_max to None
-                rt_min = rt-5
-                rt_max = rt+5
-
-                # If RT information is given, determine RT borders
-                if rt:
-                    # Custom peak width per metabolite
-                    if not np.isnan(peak_width):
-                        rt_min = rt-(peak_width/2)
-                        rt_max = rt+(peak_width/2)
-                    else:
-                        rt_min = rt - default_peak_width/2
-                        rt_max = rt + default_peak_width/2
-
-                # List with intensity values (len = number of MS1 spectra)
-                ints = []
-                for spec in exp:
-                    # Skip MS2 spectra
-                    if spec.getMSLevel() == 2:
-                        continue
-                    # Skip Spectra which are not within RT range
-                    if not np.isnan(rt):
-                        if rt_min > spec.getRT() or rt_max < spec.getRT():
-                            ints.append(0)
-                            continue
-                    # Find the highest peak in spec within mz window (Da)
-                    if mz_unit == "Da":
-                        index_highest_peak_within_window = (
-                            spec.findHighestInWindow(
-                                mass, mz_da, mz_da
-                            )
-                        )
-                    else:
-                        # Find the highest peak in spec within mz window (ppm)
-                        ppm_window = float((mz_ppm / 1000000) * mass)
-                        index_highest_peak_within_window = (
-                            spec.findHighestInWindow(
-                                mass, ppm_window, ppm_window)
-                        )
-                    # Get intensity at highest peak index if hit was found
-                    if index_highest_peak_within_window > -1:
-                        i = int(
-                            spec[
-                                index_highest_peak_within_window
-                            ].getIntensity()
-                        )
-                        # Check if higher then baseline and
-                        if i > baseline:
-                            ints.append(i)
-                        else:
-                            ints.append(0)
-                    # If nothing was found, XIC intensity for this spec is zero
-                    else:
-                        ints.append(0)
-
-                # Add intensity values to df
-                df[metabolite_name] = ints
-                # also insert the AUC in the auc dataframe
-                df_auc.loc[metabolite_name, Path(file).name] = np.trapz(ints, df["time"])
-
-            # Save to feather dataframe for quick access
-            df.to_feather(Path(results_dir, Path(file).stem + ".ftr"))
-            # Save as tsv for download option
-            df.to_csv(
-                Path(tsv_dir, Path(file).stem + ".tsv"), sep="\t", index=False
-            )
+        # Extract chromatograms from the files in parallel, results are saved as soon as a file is done
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(mzML_files)),
+            initializer=_register_worker,
+            initargs=(pid_dir,),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    extract_file, file, cache_dir, results_dir, names, mz_min, mz_max, rt_min, rt_max, time_unit, baseline
+                ): Path(file).name
+                for file in mzML_files
+            }
+            errors = []
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    # also insert the AUCs in the auc dataframe
+                    df_auc[file_name] = pd.Series(future.result(), dtype=object)
+                    progress["files"][file_name] = "done"
+                except Exception as e:
+                    errors.append(f"{file_name}: {e}")
+                    progress["files"][file_name] = "failed"
+                _write_progress(results_dir, progress)
+        if errors:
+            raise RuntimeError("Extraction failed for " + "; ".join(errors))
 
         # once all files are processed, zip the tsv files and delete their directory
+        tsv_dir = Path(results_dir, "tsv-tables")
         shutil.make_archive(os.path.join(
             results_dir, "chromatograms"), "zip", tsv_dir)
         shutil.rmtree(tsv_dir)
@@ -193,29 +310,11 @@ def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz
         df_auc = df_auc.reindex(sorted(df_auc.columns), axis=1)
         df_auc = df_auc[~(df_auc == 0).all(axis=1)]
         if df_auc.empty:
-            st.error("No metabolites detected from given input.")
-            status.update(label="Error", state="error", expanded=True)
-            return
+            raise RuntimeError("No metabolites detected from given input.")
         df_auc.to_csv(Path(results_dir, "summary.tsv"), sep="\t")
 
         # sum intensities of variants of the same metabolite
-        combined = {}
-        metabolite_names = list(
-            set([c.split("#")[0] for c in df_auc.index]))
-        for filename in df_auc.columns:
-            aucs = []
-            for a in metabolite_names:
-                auc = 0
-                for b in [
-                    b
-                    for b in df_auc.index
-                    if ((a + "#" in b and b.startswith(a)) or a == b)
-                ]:
-                    auc += df_auc.loc[b, filename]
-                aucs.append(auc)
-            combined[filename] = aucs
-        df_auc_combined = pd.DataFrame(combined)
-        df_auc_combined.set_index(pd.Index(metabolite_names), inplace=True)
+        df_auc_combined = combine_variants(df_auc)
         df_auc_combined.index.name = "metabolite"
         df_auc_combined = df_auc_combined.reindex(sorted(df_auc_combined.columns), axis=1)
         df_auc_combined.to_csv(Path(results_dir, "summary-combined.tsv"), sep="\t")
@@ -223,10 +322,130 @@ def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz
         # Save AUC to text file
         with open(Path(results_dir, "run-params.txt"), "w") as f:
             f.write(f"{baseline}\n{time_unit}")
-    # # Re-run to prevent tab jumping back to first tab upon first widget change (streamlit bug)
+        progress["state"] = "finished"
+    except Exception as e:
+        progress["state"] = "error"
+        progress["message"] = str(e)
+    _write_progress(results_dir, progress)
+    # Delete pid dir path to indicate the job is done
+    shutil.rmtree(pid_dir, ignore_errors=True)
+
+
+def extract_chromatograms(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz_da, time_unit, default_peak_width, baseline, cache_dir):
+    """
+    Starts the extraction of chromatograms from the mzML files in a background process.
+    The extraction has to be a process, otherwise streamlit will wait for it to finish
+    before updating the UI again. Progress is shown with extraction_progress.
+    """
+    # Check for unique index
+    if not df_input["name"].is_unique:
+        st.error("Metabolite names need to be unique.")
+        return
+
+    if any(df_input["name"].isna()):
+        st.error("Enter a name for each metabolite.")
+        return
+
+    # Drop all rows without mz value
+    df_input = df_input[df_input['mz'].notna()].copy()
+
+    # Get RT times in seconds for extraction
+    if time_unit == "minutes":
+        df_input["RT"] = df_input["RT"]*60
+        df_input["peak width"] = df_input["peak width"]*60
+
+    # Delete and re-create results directory
+    reset_directory(Path(results_dir))
+
+    # To make a zip file with tables in tsv format later, create a directory
+    reset_directory(Path(results_dir, "tsv-tables"))
+
+    # Max. number of parallel processes can be set in settings.json (defaults to number of CPU cores)
+    workers = st.session_state.get("settings", {}).get("max-parallel-jobs", None) or os.cpu_count()
+
+    # Start extraction process and add its process id to the pid directory
+    pid_dir = Path(results_dir, "pids")
+    pid_dir.mkdir()
+    process = multiprocessing.Process(
+        target=extraction_job,
+        args=(results_dir, mzML_files, df_input, mz_unit, mz_ppm, mz_da, time_unit, default_peak_width, baseline, cache_dir, workers),
+    )
+    process.start()
+    Path(pid_dir, str(process.pid)).touch()
     st.rerun()
 
 
+def extraction_running(results_dir):
+    """
+    Checks if an extraction job is running. Removes the pid directory if none of the
+    recorded processes is alive anymore, e.g. after the server has been restarted.
+
+    Args:
+        results_dir (Path): The results directory.
+
+    Returns:
+        bool: True if the extraction is still running.
+    """
+    pid_dir = Path(results_dir, "pids")
+    if not pid_dir.exists():
+        return False
+    for f in pid_dir.iterdir():
+        try:
+            os.kill(int(f.stem), 0)
+            return True
+        except (OSError, ValueError):
+            continue
+    shutil.rmtree(pid_dir, ignore_errors=True)
+    return False
+
+
+def stop_extraction(results_dir):
+    """
+    Cancels the extraction job by killing the job and its worker processes based on stored PIDs.
+
+    Args:
+        results_dir (Path): The results directory.
+    """
+    pid_dir = Path(results_dir, "pids")
+    if not pid_dir.exists():
+        return
+    for f in pid_dir.iterdir():
+        try:
+            os.kill(int(f.stem), 9)
+        except (OSError, ValueError):
+            pass
+    shutil.rmtree(pid_dir, ignore_errors=True)
+    progress = read_progress(results_dir)
+    if progress is not None:
+        progress["state"] = "cancelled"
+        _write_progress(results_dir, progress)
+
+
+@st.fragment(run_every=2)
+def extraction_progress(results_dir):
+    """
+    Shows the progress of the running extraction job per file, updated every 2 seconds
+    without re-running the whole page.
+
+    Args:
+        results_dir (Path): The results directory.
+    """
+    if not extraction_running(results_dir):
+        # Extraction finished, show results and controls
+        st.rerun()
+    progress = read_progress(results_dir)
+    if progress is None:
+        st.markdown("**Extracting chromatograms...**")
+        return
+    files = pd.Series(progress["files"], name="state")
+    done = int((files != "waiting").sum())
+    st.progress(
+        done / len(files),
+        text=f"Extracting chromatograms... {done} of {len(files)} files done",
+    )
+    st.dataframe(files.rename_axis("file"), use_container_width=True)
+
+
 @st.cache_resource
 def get_auc_fig(df_auc):
     for col in df_auc.columns:
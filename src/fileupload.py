@@ -105,6 +105,8 @@ def remove_selected_mzML_files(to_remove: list[str], params: dict) -> dict:
     # remove all given files from mzML workspace directory and selected files
     for f in to_remove:
         Path(mzML_dir, f + ".mzML").unlink()
+        # also remove the cached peaks of the file
+        Path(st.session_state.workspace, "mzML-cache", f + ".parquet").unlink(missing_ok=True)
     for k, v in params.items():
         if isinstance(v, list):
             if f in v:
@@ -126,6 +128,8 @@ def remove_all_mzML_files(params: dict) -> dict:
     mzML_dir = Path(st.session_state.workspace, "mzML-files")
     # reset (delete and re-create) mzML directory in workspace
     reset_directory(mzML_dir)
+    # also remove the cached peaks of all files
+    shutil.rmtree(Path(st.session_state.workspace, "mzML-cache"), ignore_errors=True)
     # reset all parameter items which have mzML in key and are list
     for k, v in params.items():
         if "mzML" in k and isinstance(v, list):
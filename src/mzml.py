@@ -0,0 +1,188 @@
+import os
+from pathlib import Path
+from typing import Callable, List, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyopenms as oms
+
+# Per-file peak cache: one row per spectrum, peaks as list columns. RT, MS level and precursor
+# columns can be read without the peaks; row groups are the unit in which peaks are read.
+PEAK_CACHE_SCHEMA = pa.schema(
+    [
+        ("RT", pa.float64()),
+        ("MS level", pa.int32()),
+        ("precursor m/z", pa.float64()),
+        ("base peak m/z", pa.float64()),
+        ("base peak intensity", pa.float32()),
+        ("mzarray", pa.list_(pa.float64())),
+        ("intarray", pa.list_(pa.float32())),
+    ]
+)
+# Number of spectra per row group of the peak cache
+ROW_GROUP_SIZE = 256
+
+
+class _SpectrumConsumer:
+    """Consumer for MzMLFile().transform, passes each spectrum to a function as soon as it is read."""
+
+    def __init__(self, function: Callable[[oms.MSSpectrum], None]) -> None:
+        self.function = function
+
+    def setExpectedSize(self, n_spectra: int, n_chromatograms: int) -> None:
+        pass
+
+    def setExperimentalSettings(self, settings: oms.ExperimentalSettings) -> None:
+        pass
+
+    def consumeSpectrum(self, spectrum: oms.MSSpectrum) -> None:
+        self.function(spectrum)
+
+    def consumeChromatogram(self, chromatogram: oms.MSChromatogram) -> None:
+        pass
+
+
+def stream_spectra(file: Union[str, Path], function: Callable[[oms.MSSpectrum], None]) -> None:
+    """
+    Reads an mzML file spectrum by spectrum without loading the whole experiment into
+    memory. Only the spectrum which is currently processed is kept in memory, so memory
+    usage does not depend on the file size.
+
+    Args:
+        file (Union[str, Path]): The path to the mzML file.
+        function (Callable[[oms.MSSpectrum], None]): Called with each spectrum in the order of the file.
+    """
+    oms.MzMLFile().transform(str(file), _SpectrumConsumer(function))
+
+
+def peak_cache_file(file: Union[str, Path], cache_dir: Union[str, Path]) -> Path:
+    """
+    Returns the path of the peak cache of an mzML file.
+
+    Args:
+        file (Union[str, Path]): The path to the mzML file.
+        cache_dir (Union[str, Path]): The cache directory of the workspace (mzML-cache).
+
+    Returns:
+        Path: The parquet file with the peaks of the mzML file.
+    """
+    return Path(cache_dir, Path(file).stem + ".parquet")
+
+
+def _source_info(file: Union[str, Path]) -> dict:
+    # The cache is valid as long as the mzML file has not been replaced or modified
+    stat = os.stat(file)
+    return {
+        b"source": str(Path(file).resolve()).encode(),
+        b"size": str(stat.st_size).encode(),
+        b"mtime": str(stat.st_mtime_ns).encode(),
+    }
+
+
+def _spectra_table(spectra: List[tuple]) -> pa.Table:
+    # spectra: (RT, MS level, precursor m/z, m/z array, intensity array)
+    rts, ms_levels, precursors, mzs, intensities = zip(*spectra)
+    offsets = np.zeros(len(mzs) + 1, dtype=np.int32)
+    np.cumsum([len(mz) for mz in mzs], out=offsets[1:])
+    base_peaks = [i.argmax() if len(i) else -1 for i in intensities]
+    return pa.table(
+        [
+            pa.array(rts, pa.float64()),
+            pa.array(ms_levels, pa.int32()),
+            pa.array(precursors, pa.float64()),
+            pa.array([mz[b] if b >= 0 else np.nan for mz, b in zip(mzs, base_peaks)], pa.float64()),
+            pa.array([i[b] if b >= 0 else 0 for i, b in zip(intensities, base_peaks)], pa.float32()),
+            pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate(mzs), pa.float64())),
+            pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate(intensities), pa.float32())),
+        ],
+        schema=PEAK_CACHE_SCHEMA,
+    )
+
+
+def cache_peaks(file: Union[str, Path], cache_dir: Union[str, Path]) -> Path:
+    """
+    Converts an mzML file into the peak cache, unless the cache is up to date. The cache
+    is rebuilt if the size or modification time of the mzML file changed. The mzML file is
+    read spectrum by spectrum and written in row groups, so memory usage does not depend
+    on the file size.
+
+    Args:
+        file (Union[str, Path]): The path to the mzML file.
+        cache_dir (Union[str, Path]): The cache directory of the workspace (mzML-cache).
+
+    Returns:
+        Path: The parquet file with the peaks of the mzML file.
+    """
+    path = peak_cache_file(file, cache_dir)
+    info = _source_info(file)
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if all(metadata.get(key) == value for key, value in info.items()):
+            return path
+    except (OSError, pa.ArrowException):
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written to a temporary file first, other processes might read the cache at the same time
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    spectra = []
+    try:
+        with pq.ParquetWriter(tmp, PEAK_CACHE_SCHEMA.with_metadata(info)) as writer:
+
+            def add(spec):
+                precursors = spec.getPrecursors()
+                spectra.append(
+                    (
+                        spec.getRT(),
+                        spec.getMSLevel(),
+                        precursors[0].getMZ() if precursors else np.nan,
+                        *spec.get_peaks(),
+                    )
+                )
+                if len(spectra) == ROW_GROUP_SIZE:
+                    writer.write_table(_spectra_table(spectra))
+                    spectra.clear()
+
+            stream_spectra(file, add)
+            if spectra:
+                writer.write_table(_spectra_table(spectra))
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
+
+
+def remove_orphaned_caches(cache_dir: Union[str, Path]) -> None:
+    """
+    Removes peak caches of mzML files which do not exist anymore, e.g. files deleted
+    from the workspace outside of the app. Caches which can not be read are removed as
+    well, they are rebuilt when needed.
+
+    Args:
+        cache_dir (Union[str, Path]): The cache directory of the workspace (mzML-cache).
+    """
+    for path in Path(cache_dir).glob("*.parquet"):
+        try:
+            source = (pq.read_schema(path).metadata or {}).get(b"source")
+        except (OSError, pa.ArrowException):
+            source = None
+        if source is None or not Path(source.decode()).exists():
+            path.unlink(missing_ok=True)
+
+
+def read_spectra(
+    file: Union[str, Path], cache_dir: Union[str, Path], columns: List[str] = None
+) -> pa.Table:
+    """
+    Reads the spectra of an mzML file from the peak cache, converting the file first if
+    needed.
+
+    Args:
+        file (Union[str, Path]): The path to the mzML file.
+        cache_dir (Union[str, Path]): The cache directory of the workspace (mzML-cache).
+        columns (List[str], optional): Columns to read, e.g. only RT and MS level without peaks. Defaults to all columns.
+
+    Returns:
+        pa.Table: One row per spectrum with the columns of PEAK_CACHE_SCHEMA.
+    """
+    return pq.read_table(cache_peaks(file, cache_dir), columns=columns)
@@ -3,6 +3,7 @@ import sys
 from pathlib import Path
 import zipfile
 import pandas as pd
+from ms1_annotation import ms1_annotations
 
 ############################
 # default paramter values #
@@ -46,25 +47,14 @@ if __name__ == "__main__":
 
     df["mz"] = df["mz"].astype(float)
 
-    for _, std in library.iterrows():
-        delta_Da = abs(params["ms1-annotation-mz-tolerance"] * std["mz"] / 1000000)
-        mz_lower = std["mz"] - delta_Da
-        mz_upper = std["mz"] + delta_Da
-        rt_lower = std["RT"] - params["ms1-annotation-rt-window"] / 2
-        rt_upper = std["RT"] + params["ms1-annotation-rt-window"] / 2
-        match = df.query(
-            "mz > @mz_lower and mz < @mz_upper and RT > @rt_lower and RT < @rt_upper"
-        )
-        if not match.empty:
-            for _, row in match.iterrows():
-                if len(df.loc[df["metabolite"] == row["metabolite"], "MS1 annotation"]) > 1:
-                    df.loc[df["metabolite"] == row["metabolite"], "MS1 annotation"] += (
-                        ";" + std["name"]
-                    )
-                else:
-                    df.loc[df["metabolite"] == row["metabolite"],
-                            "MS1 annotation"] += std["name"]
-
+    df["MS1 annotation"] = ms1_annotations(
+        df["mz"],
+        df["RT"],
+        df["metabolite"],
+        library,
+        params["ms1-annotation-mz-tolerance"],
+        params["ms1-annotation-rt-window"],
+    )
 
     df.to_parquet(params["in"][0])
     df.to_csv(Path(params["in"][0]).with_suffix(".tsv"), sep="\t")
\ No newline at end of file
@@ -58,15 +58,71 @@ def get_params():
         }
 
 
+def ms2_annotations(features, gnps_features, mgf_params, spectra, spectral_matches):
+    """
+    Annotates the features with all spectral matches of their MS2 spectrum.
+
+    Each metabolite gets a single scan: the last MGF entry of the last consensus feature
+    with an MGF entry. Spectral matches are assigned to the scan numbers of all spectra
+    with their native ID, matches of more than one scan are not assigned to a feature.
+
+    Args:
+        features (pd.DataFrame): Feature matrix with metabolites as index.
+        gnps_features (pd.DataFrame): GNPS feature matrix with metabolites as index and consensus feature IDs.
+        mgf_params (pd.DataFrame): Parameters of the MGF spectra (feature_id without "e_" and scans).
+        spectra (pd.DataFrame): Native ID (index, without "index=") and scan number (SCANS) of the MS2 spectra.
+        spectral_matches (pd.DataFrame): Small molecule table of the mzTab file, native IDs without "index=".
+
+    Returns:
+        pd.DataFrame: The features with the columns SpectralMatch, SpectralMatch_smiles,
+                      SpectralMatch_ppm_error and SpectralMatch_score (matches joined by " ## ").
+    """
+    features = features.copy()
+    # Add Scan numbers to spectral match DF (unique scan numbers of all spectra with the native ID)
+    native_id_scans = (
+        spectra[["index", "SCANS"]].drop_duplicates().groupby("index", sort=False)["SCANS"].agg(" ## ".join)
+    )
+    match_scans = spectral_matches["opt_spec_native_id"].map(native_id_scans).fillna("")
+
+    # Add Scan numbers to feature DF
+    # (a single scan per metabolite: the last MGF entry of the last consensus feature with an MGF entry)
+    feature_id_scan = dict(zip(mgf_params["feature_id"], mgf_params["scans"]))
+    scan_map = pd.Series(
+        gnps_features["consensus_feature_id"].astype(str).map(feature_id_scan).to_numpy(),
+        index=gnps_features.index,
+    ).dropna()
+    scan_map = scan_map[~scan_map.index.duplicated(keep="last")]
+
+    # All spectral matches per scan number, in order of the mzTab file
+    columns = {
+        "SpectralMatch": "description",
+        "SpectralMatch_smiles": "smiles",
+        "SpectralMatch_ppm_error": "opt_ppm_error",
+        "SpectralMatch_score": "opt_match_score",
+    }
+    matches = pd.DataFrame(
+        {column: spectral_matches[source].map(str) for column, source in columns.items()}
+    )
+    matches = matches.groupby(match_scans.to_numpy(), sort=False).agg(" ## ".join)
+
+    scans = features.index.map(scan_map)
+    for column in columns:
+        features[column] = scans.map(matches[column]).fillna("").to_numpy()
+    return features
+
+
 if __name__ == "__main__":
     params = get_params()
 
-    # MzML file with MS2 spectra
+    # MzML file with MS2 spectra: native ID and scan number of each spectrum
     exp = MSExperiment()
     MzMLFile().load(params["in_mzML"][0], exp)
-    df = exp.get_df()
-    df["index"] = [spec.getNativeID() for spec in exp]
-    df["SCANS"] = [spec.getMetaValue("Scan_ID") for spec in exp]
+    df = pd.DataFrame(
+        {
+            "index": [spec.getNativeID() for spec in exp],
+            "SCANS": [str(spec.getMetaValue("Scan_ID")) for spec in exp],
+        }
+    )
     df["index"] = df["index"].str.replace(r"index=", "")
 
     # MGF File
@@ -92,79 +148,15 @@ if __name__ == "__main__":
     spectralmatch = pyteomics.mztab.MzTab(
         params["in_mzTab"][0], encoding="UTF8", table_format="df"
     )
-    spectralmatch.metadata
     spectralmatch_DF = spectralmatch.small_molecule_table
     spectralmatch_DF["opt_spec_native_id"] = spectralmatch_DF[
         "opt_spec_native_id"
     ].str.replace(r"index=", "")
-    
-    # Add Scan numbers to spectral match DF
-    spectralmatch_DF["SCANS"] = ""
-    for i, idx in zip(spectralmatch_DF.index, spectralmatch_DF["opt_spec_native_id"]):
-        hits = []
-        for (
-            index,
-            scan_number,
-        ) in zip(df["index"], df["SCANS"]):
-            if idx == index:
-                hit = f"{scan_number}"
-                if hit not in hits:
-                    hits.append(hit)
-        spectralmatch_DF.loc[i, "SCANS"] = " ## ".join(hits)
 
-    # Add Scan numbers to feature DF
-    scan_map = {}
-    for metabolite, consensus_id in zip(DF_features.index, DF_features["consensus_feature_id"].astype(str)):
-        hits = []
-        for scan, mgf_id in zip(mgf_file["scans"], mgf_file["feature_id"]):
-            if consensus_id == mgf_id:
-                if metabolite in scan_map.keys():
-                    scan_map[metabolite].append(scan)
-                scan_map[metabolite] = [scan]
-    
     # Output Feature Matrix
-    DF_features = pd.read_parquet(params["out"][0])
-
-    scans = []
-    for metabolite in DF_features.index:
-        if metabolite in scan_map:
-            scans.append(scan_map[metabolite])
-        else:
-            scans.append([])
-    DF_features["SCANS"] = scans
-
-    DF_features["SpectralMatch"] = ""
-    DF_features["SpectralMatch_smiles"] = ""
-
-    for i, scans in zip(DF_features.index, DF_features["SCANS"]):
-        hits_name = []
-        hits_smiles = []
-        hits_ppm_error = []
-        hits_score = []
-        for (
-            name,
-            smiles,
-            scan_number,
-            ppm_error,
-            score
-        ) in zip(
-            spectralmatch_DF["description"],
-            spectralmatch_DF["smiles"],
-            spectralmatch_DF["SCANS"],
-            spectralmatch_DF["opt_ppm_error"],
-            spectralmatch_DF["opt_match_score"]
-        ):
-            if scan_number in scans:
-                hits_name.append(str(name))
-                hits_smiles.append(str(smiles))
-                hits_ppm_error.append(str(ppm_error))
-                hits_score.append(str(score))
-        DF_features.loc[i, "SpectralMatch"] = " ## ".join(hits_name)
-        DF_features.loc[i, "SpectralMatch_smiles"] = " ## ".join(hits_smiles)
-        DF_features.loc[i, "SpectralMatch_ppm_error"] = " ## ".join(hits_ppm_error)
-        DF_features.loc[i, "SpectralMatch_score"] = " ## ".join(hits_score)
-    
-    DF_features = DF_features.drop(columns=["SCANS"])
+    DF_features = ms2_annotations(
+        pd.read_parquet(params["out"][0]), DF_features, mgf_file, df, spectralmatch_DF
+    )
 
     DF_features.to_csv(
         Path(params["out"][0]).with_suffix(".tsv"), sep="\t", index=False
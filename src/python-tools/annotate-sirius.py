@@ -1,5 +1,6 @@
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 
@@ -33,44 +34,101 @@ def get_params():
     else:
         return {}
 
+# SIRIUS summary files per tool and the columns taken from them
+SUMMARIES = {
+    "CSI:FingerID": (
+        "compound_identifications.tsv",
+        ["molecularFormula", "name", "InChI", "smiles"],
+    ),
+    "SIRIUS": ("formula_identifications.tsv", ["molecularFormula"]),
+    "CANOPUS": (
+        "canopus_compound_summary.tsv",
+        [
+            "NPC#pathway",
+            "NPC#superclass",
+            "NPC#class",
+            "ClassyFire#most specific class",
+        ],
+    ),
+}
+
+def column_name(tool, col):
+    return f"{tool}_{col.replace('NPC#', '').replace('ClassyFire#', '')}"
+
+def read_summary(project, tool):
+    """Reads the SIRIUS summary file of a tool in a project in long format (project, id, column, value)."""
+    annotation_file, cols = SUMMARIES[tool]
+    df = pd.read_csv(Path(project, annotation_file), sep="\t", usecols=["id"] + cols)
+    df["id"] = df["id"].str.split("_0_").str[1].str.split("-").str[0]
+    df = df.dropna(subset=["id"])
+    df = df.rename(columns={col: column_name(tool, col) for col in cols})
+    df = df.melt(id_vars="id", var_name="column", value_name="value")
+    df.insert(0, "project", project.name)
+    return df
+
+def sirius_annotations(df, sirius_projects_dir):
+    """
+    Adds the SIRIUS, CSI:FingerID and CANOPUS results of all SIRIUS projects to the feature matrix.
+
+    Each project is named like a sample and its results are joined on the feature IDs of
+    this sample (<project>.mzML_IDs), the last entry of a feature ID wins. Columns which
+    exist already are updated in place, new columns are added at the end.
+
+    Args:
+        df (pd.DataFrame): The feature matrix.
+        sirius_projects_dir (Path): Directory with one SIRIUS project directory per sample.
+
+    Returns:
+        pd.DataFrame: The feature matrix with a <tool>_<project>_<column> column per result column.
+    """
+    # summary files of all projects
+    summaries = [
+        (project, tool)
+        for project in sorted(p for p in sirius_projects_dir.iterdir() if p.is_dir())
+        for tool, (annotation_file, _) in SUMMARIES.items()
+        if Path(project, annotation_file).exists()
+    ]
+    if not summaries:
+        return df
+    # read in parallel, concatenate and pivot to one row per project and feature ID
+    with ThreadPoolExecutor() as pool:
+        summary = pd.concat(pool.map(lambda s: read_summary(*s), summaries))
+    # the last entry of a feature ID wins
+    summary = summary.drop_duplicates(["project", "id", "column"], keep="last")
+    summary = summary.pivot(index=["project", "id"], columns="column", values="value")
+    annotated_projects = set(summary.index.get_level_values("project"))
+
+    # columns for each project, in order of the tools
+    project_columns = {}
+    for project, tool in summaries:
+        project_columns.setdefault(project.name, {}).update(
+            (column_name(tool, col), column_name(f"{tool}_{project.name}", col))
+            for col in SUMMARIES[tool][1]
+        )
+    # look up the feature IDs of each sample and join all columns at once
+    blocks = []
+    for project, columns in project_columns.items():
+        ids = df[f"{project}.mzML_IDs"].to_numpy()
+        if project in annotated_projects:
+            block = summary.loc[project].reindex(index=ids, columns=list(columns))
+        else:
+            block = pd.DataFrame(index=ids, columns=list(columns), dtype=object)
+        block.index = df.index
+        blocks.append(block.rename(columns=columns).infer_objects())
+    block = pd.concat(blocks, axis=1)
+    existing = [col for col in block.columns if col in df.columns]
+    df = pd.concat([df, block.drop(columns=existing)], axis=1)
+    for col in existing:
+        df[col] = block[col]
+    return df
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
     df = pd.read_parquet(params["in"][0])
     sirius_projects_dir = Path(Path(params["in"][0]).parent.parent, "sirius-projects")
     if sirius_projects_dir.exists():
-        for result_directory in sirius_projects_dir.iterdir():
-            if result_directory.is_dir():
-                for tool, annotation_file, cols in zip(
-                    ["CSI:FingerID", "SIRIUS", "CANOPUS"],
-                    [
-                        "compound_identifications.tsv",
-                        "formula_identifications.tsv",
-                        "canopus_compound_summary.tsv",
-                    ],
-                    [
-                        ["molecularFormula", "name", "InChI", "smiles"],
-                        ["molecularFormula"],
-                        [
-                            "NPC#pathway",
-                            "NPC#superclass",
-                            "NPC#class",
-                            "ClassyFire#most specific class",
-                        ],
-                    ],
-                ):
-                    file = Path(result_directory, annotation_file)
-                    if file.exists():
-                        df_tmp = pd.read_csv(file, sep="\t")
-                        df_tmp["id"] = df_tmp["id"].apply(
-                            lambda x: x.split("_0_")[1].split("-")[0]
-                        )
-                        for col in cols:
-                            df[
-                                f"{tool}_{result_directory.name}_{col.replace('NPC#', '').replace('ClassyFire#', '')}"
-                            ] = df[f"{result_directory.name}.mzML_IDs"].map(
-                                df_tmp.set_index("id")[col].to_dict()
-                            )
+        df = sirius_annotations(df, sirius_projects_dir)
 
         df.to_parquet(params["in"][0])
-        df.to_csv(Path(params["in"][0]).with_suffix(".tsv"), sep="\t")
\ No newline at end of file
+        df.to_csv(Path(params["in"][0]).with_suffix(".tsv"), sep="\t")
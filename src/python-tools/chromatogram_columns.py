@@ -0,0 +1,46 @@
+"""
+Arrow list columns for the feature chromatograms exported by the python-tools scripts.
+
+Chromatograms are stored in the parquet files as the list columns "chrom_RT" (float)
+and "chrom_intensity" (int, truncated like int()). The columns are built from one numpy
+array per feature without converting the values to Python objects.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def list_array(arrays, dtype) -> pa.ListArray:
+    """
+    Builds an Arrow list array from one numpy array per row.
+
+    Args:
+        arrays (list): Arrays with the values of each row.
+        dtype: NumPy dtype of the values.
+
+    Returns:
+        pa.ListArray: The list array.
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int32)
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    values = np.concatenate(arrays).astype(dtype) if arrays else np.array([], dtype=dtype)
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(values))
+
+
+def chromatogram_table(df: pd.DataFrame, rts: list, intensities: list) -> pa.Table:
+    """
+    Converts a feature DataFrame to an Arrow table with the chromatogram columns inserted
+    before the "re-quantified" column (at the end if the column does not exist).
+
+    Args:
+        df (pd.DataFrame): The features.
+        rts (list): Retention times of the chromatogram of each feature, in the row order of df.
+        intensities (list): Intensities of the chromatogram of each feature, in the row order of df.
+
+    Returns:
+        pa.Table: The features with chromatograms.
+    """
+    table = pa.Table.from_pandas(df)
+    position = df.columns.get_loc("re-quantified") if "re-quantified" in df.columns else len(df.columns)
+    table = table.add_column(position, "chrom_RT", list_array(rts, np.float64))
+    return table.add_column(position + 1, "chrom_intensity", list_array(intensities, np.int64))
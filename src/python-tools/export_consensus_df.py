@@ -4,6 +4,7 @@ import pyopenms as poms
 from pathlib import Path
 import pandas as pd
 import numpy as np
+from metabolite_labels import metabolite_labels
 
 ############################
 # default paramter values #
@@ -36,68 +37,83 @@ def get_params():
     else:
         return {}
 
+def consensus_df(consensus_map: poms.ConsensusMap) -> pd.DataFrame:
+    """
+    Extracts the consensus features with their meta data, intensities and original
+    feature IDs per map in a single pass over the consensus map.
+
+    Args:
+        consensus_map (poms.ConsensusMap): A label-free consensus map.
+
+    Returns:
+        pd.DataFrame: One row per consensus feature.
+    """
+    headers = consensus_map.getColumnHeaders()
+    map_indices = sorted(headers.keys())
+    map_column = {m: i for i, m in enumerate(map_indices)}
+    # intensities are stored per file, feature IDs per map
+    files = list(dict.fromkeys(headers[m].filename for m in map_indices))
+    file_column = {m: files.index(headers[m].filename) for m in map_indices}
+
+    n = consensus_map.size()
+    ids = np.empty(n, dtype=np.uint64)
+    charge = np.empty(n, dtype=np.int32)
+    rt = np.empty(n, dtype=np.float64)
+    mz = np.empty(n, dtype=np.float64)
+    quality = np.empty(n, dtype=np.float32)
+    adducts = np.full(n, None, dtype=object)
+    labels = np.full(n, None, dtype=object)
+    intensities = np.zeros((n, len(files)), dtype=np.float32)
+    feature_ids = np.full((n, len(map_indices)), pd.NA, dtype=object)
+    for i, cf in enumerate(consensus_map):
+        ids[i] = cf.getUniqueId()
+        charge[i] = cf.getCharge()
+        rt[i] = cf.getRT()
+        mz[i] = cf.getMZ()
+        quality[i] = cf.getQuality()
+        if cf.metaValueExists("best ion"):
+            adducts[i] = cf.getMetaValue("best ion")
+        if cf.metaValueExists("label"):
+            labels[i] = cf.getMetaValue("label")
+        for f in cf.getFeatureList():
+            m = f.getMapIndex()
+            intensities[i, file_column[m]] = f.getIntensity()
+            feature_ids[i, map_column[m]] = str(f.getUniqueId())
+
+    df = pd.DataFrame(
+        {"charge": charge, "RT": rt, "mz": mz, "quality": quality},
+        index=pd.Index(ids, name="id"),
+    )
+    if any(a is not None for a in adducts):
+        df["adduct"] = adducts
+    for j, file in enumerate(files):
+        df[Path(file).name] = intensities[:, j]
+    if any(label is not None for label in labels):
+        df["name"] = labels
+    df.insert(
+        0,
+        "metabolite",
+        metabolite_labels(
+            df["mz"], df["RT"], df["adduct"] if "adduct" in df.columns else None
+        ),
+    )
+    # annotate original feature IDs
+    for j, m in enumerate(map_indices):
+        df[f"{Path(headers[m].filename).name}_IDs"] = feature_ids[:, j]
+    return df
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
     consensus_map = poms.ConsensusMap()
     poms.ConsensusXMLFile().load(params["in"][0], consensus_map)
-    df = consensus_map.get_df().drop(["sequence"], axis=1)
-    for cf in consensus_map:
-        if cf.metaValueExists("best ion"):
-            df.insert(
-                4, "adduct", [cf.getMetaValue(
-                    "best ion") for cf in consensus_map]
-            )
-            break
-    for cf in consensus_map:
-        if cf.metaValueExists("label"):
-            df["name"] = [cf.getMetaValue("label") for cf in consensus_map]
-            break
-    if "adduct" in df.columns:
-        df.insert(
-            0,
-            "metabolite",
-            [
-                f"{round(mz, 4)}@{round(rt, 2)}@{adduct}"
-                for mz, rt, adduct in zip(
-                    df["mz"].tolist(), df["RT"].tolist(), df["adduct"].tolist()
-                )
-            ],
-        )
-    else:
-        df.insert(
-            0,
-            "metabolite",
-            [
-                f"{round(mz, 4)}@{round(rt, 2)}"
-                for mz, rt in zip(df["mz"].tolist(), df["RT"].tolist())
-            ],
-        )
-    # annotate original feature IDs
-    fnames = [Path(value.filename).name for value in consensus_map.getColumnHeaders().values()]
-
-    ids = [[] for _ in fnames]
-
-    for cf in consensus_map:
-        fids = {f.getMapIndex(): f.getUniqueId() for f in cf.getFeatureList()}
-        for i, fname in enumerate(fnames):
-            if i in fids.keys():
-                ids[i].append(str(fids[i]))
-            else:
-                ids[i].append(pd.NA)
-
-    for i, f in enumerate(fnames):
-        df[f"{fnames[i]}_IDs"] = ids[i]
-
+    df = consensus_df(consensus_map)
     # set re-quantified
     if "ffmid" in params["out"][0]:
         df["re-quantified"] = True
     else:
         df["re-quantified"] = False
 
-    # Rename columns to not show full file path
-    df = df.rename(columns={col: Path(col).name for col in df.columns if Path(col).exists()})
-    
     df["consensus_feature_id"] = df.index
     df = df.set_index("metabolite")
 
@@ -1,8 +1,13 @@
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import pyopenms as poms
 from pathlib import Path
 import numpy as np
+import pyarrow.parquet as pq
+from chromatogram_columns import chromatogram_table
+from metabolite_labels import metabolite_labels
 
 ############################
 # default paramter values #
@@ -24,7 +29,10 @@ import numpy as np
 # advanced: whether or not the parameter is advanced (default: False)
 
 DEFAULTS = [
-    {"key": "in", "value": [], "help": "ffm featureXML dir", "hide": True},
+    {"key": "in", "value": [], "help": "ffm featureXML files", "hide": True},
+    {"key": "in_chrom", "value": [], "help": "ffm chromatogram mzML files", "hide": True},
+    {"key": "workers", "value": 0, "help": "number of files exported in parallel (0: number of CPU cores)", "hide": True},
+    {"key": "out", "value": [], "help": "ffm parquet files", "hide": True},
 ]
 
 def get_params():
@@ -34,56 +42,65 @@ def get_params():
     else:
         return {}
 
-if __name__ == "__main__":
-    params = get_params()
-    # Add code here:
-    out_path = Path(Path(params["in"][0]).parent.parent, "ffm-df")
-    if not out_path.exists():
-        out_path.mkdir(exist_ok=True)
-    for file in Path(params["in"][0]).parent.glob("*.featureXML"):
-        fm = poms.FeatureMap()
-        poms.FeatureXMLFile().load(str(file), fm)
-        # Get DataFrame with meta values
-        df = fm.get_df(export_peptide_identifications=False,
-                    meta_values=[b"num_of_masstraces", 
-                                    b"dc_charge_adducts",
-                                    b"FWHM"])
-        # Read in chromatogram values
-        chrom_path = Path(file.parent.parent, "ffm-chroms", file.stem + ".mzML")
-        exp = poms.MSExperiment()
-        poms.MzMLFile().load(str(chrom_path), exp)
-        chroms = exp.getChromatograms()
-        # Collect all chromatogram data in two arrays with dicts
-        rts = []
-        intys = []
-        # Get chrom data for each feature
-        for f in fm:
-            f_chroms = [c for c in chroms if int(c.getNativeID().split("_")[0]) == f.getUniqueId()]
-            tmp_rt = []
-            tmp_inty = []
-            for fc in f_chroms:
-                iso = int(fc.getNativeID().split("_")[1])
-                if iso == 0:
-                    chrom_rts, chrom_intys = fc.get_peaks()
-                    rts.append(chrom_rts)
-                    intys.append(chrom_intys)
+def export(file, chrom_path, out_file):
+    """Exports a FFM feature map with chromatograms of the monoisotopic mass traces to a parquet file."""
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    fm = poms.FeatureMap()
+    poms.FeatureXMLFile().load(str(file), fm)
+    # Get DataFrame with meta values
+    df = fm.get_df(export_peptide_identifications=False,
+                meta_values=[b"num_of_masstraces", 
+                                b"dc_charge_adducts",
+                                b"FWHM"])
+    # Read in chromatogram values
+    exp = poms.MSExperiment()
+    poms.MzMLFile().load(str(chrom_path), exp)
+    # Index chromatograms of the monoisotopic mass traces by feature id (native ID: <feature id>_<isotope>)
+    chroms = {}
+    for c in exp.getChromatograms():
+        feature_id, iso = c.getNativeID().split("_")[:2]
+        if int(iso) == 0:
+            chroms.setdefault(int(feature_id), c)
+    # Get chrom data for each feature
+    rts = []
+    intys = []
+    empty = np.array([])
+    for feature_id in df.index:
+        c = chroms.get(int(feature_id))
+        chrom_rts, chrom_intys = c.get_peaks() if c is not None else (empty, empty)
+        rts.append(chrom_rts)
+        intys.append(chrom_intys)
+
+    df = df.rename(columns={
+        "dc_charge_adducts": "adduct",
+    })
+
+    df["FWHM"] = df["FWHM"].astype(float)
 
-        df["chrom_RT"] = rts
-        df["chrom_intensity"] = [[int(i) for i in chrom_int] for chrom_int in intys]
-        
-        df = df.rename(columns={
-            "dc_charge_adducts": "adduct",
-        })
-        
-        df["FWHM"] = df["FWHM"].astype(float)
+    df.insert(12, "metabolite", metabolite_labels(df["mz"], df["RT"], df["adduct"]))
 
-        df.insert(12, "metabolite", df.apply(lambda x: f"{round(x['mz'], 4)}@{round(x['RT'], 2)}@{x['adduct']}", axis=1))
+    df["re-quantified"] = False
 
-        df["re-quantified"] = False
+    df["quality ranked"] = np.linspace(0, 1, len(df))  # Generate ranks
 
-        df["quality ranked"] = np.linspace(0, 1, len(df))  # Generate ranks
-        
-        df = df.sort_values("quality ranked", ascending=False)
+    # Sort by quality ranked, descending
+    order = np.argsort(-df["quality ranked"].to_numpy(), kind="stable")
+    df = df.iloc[order]
 
-        df.to_parquet(Path(out_path, file.stem + ".parquet"))
-        
\ No newline at end of file
+    # Chromatograms are stored as Arrow list columns
+    table = chromatogram_table(df, [rts[i] for i in order], [intys[i] for i in order])
+    pq.write_table(table, out_file)
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    # Files are independent, export them in parallel processes
+    files = list(zip(params["in"], params["in_chrom"], params["out"]))
+    workers = min(len(files), params.get("workers", 0) or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # consume results to raise errors from worker processes
+            list(pool.map(export, *zip(*files)))
+    else:
+        for args in files:
+            export(*args)
@@ -1,8 +1,12 @@
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import pyopenms as poms
 from pathlib import Path
 import numpy as np
+import pyarrow.parquet as pq
+from chromatogram_columns import chromatogram_table
 
 ############################
 # default paramter values #
@@ -24,7 +28,9 @@ import numpy as np
 # advanced: whether or not the parameter is advanced (default: False)
 
 DEFAULTS = [
-    {"key": "in", "value": [], "help": "ffmid featureXML dir", "hide": True},
+    {"key": "in", "value": [], "help": "ffmid featureXML files", "hide": True},
+    {"key": "workers", "value": 0, "help": "number of files exported in parallel (0: number of CPU cores)", "hide": True},
+    {"key": "out", "value": [], "help": "ffmid parquet files", "hide": True},
 ]
 
 def get_params():
@@ -34,43 +40,56 @@ def get_params():
     else:
         return {}
 
-if __name__ == "__main__":
-    params = get_params()
-    # Add code here:
-    out_path = Path(Path(params["in"][0]).parent.parent, "ffmid-df")
-    if not out_path.exists():
-        out_path.mkdir(exist_ok=True)
-    for file in Path(params["in"][0]).parent.glob("*.featureXML"):
-        fm = poms.FeatureMap()
-        poms.FeatureXMLFile().load(str(file), fm)
-        # Get DataFrame with meta values
-        df = fm.get_df(export_peptide_identifications=False,
-                    meta_values=[b"num_of_masstraces", 
-                                    b"dc_charge_adducts",
-                                    b"model_FWHM",
-                                    b"label"])
-        
-        rts = []
-        intys = []
+def export(file, out_file):
+    """Exports a FFMID feature map with chromatograms from the mass trace convex hulls to a parquet file."""
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    fm = poms.FeatureMap()
+    poms.FeatureXMLFile().load(str(file), fm)
+    # Get DataFrame with meta values
+    df = fm.get_df(export_peptide_identifications=False,
+                meta_values=[b"num_of_masstraces", 
+                                b"dc_charge_adducts",
+                                b"model_FWHM",
+                                b"label"])
+
+    rts = []
+    intys = []
+
+    for f in fm:
+        points = f.getSubordinates()[0].getConvexHulls()[0].getHullPoints()
+        rts.append(points[:, 0])
+        intys.append(points[:, 1])
+
+    df = df.rename(columns={
+        "model_FWHM": "FWHM",
+        "dc_charge_adducts": "adduct",
+        "label": "metabolite"
+    })
+
+    df["FWHM"] = df["FWHM"].astype(float)
 
-        for f in fm:
-            rts.append([float(x[0]) for x in f.getSubordinates()[0].getConvexHulls()[0].getHullPoints()])
-            intys.append([int(y[1]) for y in f.getSubordinates()[0].getConvexHulls()[0].getHullPoints()])
-        df["chrom_RT"] = rts
-        df["chrom_intensity"] = [[int(i) for i in chrom_int] for chrom_int in intys]
+    df["re-quantified"] = True
 
-        df = df.rename(columns={
-            "model_FWHM": "FWHM",
-            "dc_charge_adducts": "adduct",
-            "label": "metabolite"
-        })
-        
-        df["FWHM"] = df["FWHM"].astype(float)
-        
-        df["re-quantified"] = True
-        
-        df["quality ranked"] = np.linspace(0, 1, len(df))  # Generate ranks
-        
-        df = df.sort_values("quality ranked", ascending=False)
+    df["quality ranked"] = np.linspace(0, 1, len(df))  # Generate ranks
 
-        df.to_parquet(Path(out_path, file.stem + ".parquet"))
\ No newline at end of file
+    # Sort by quality ranked, descending
+    order = np.argsort(-df["quality ranked"].to_numpy(), kind="stable")
+    df = df.iloc[order]
+
+    # Chromatograms are stored as Arrow list columns
+    table = chromatogram_table(df, [rts[i] for i in order], [intys[i] for i in order])
+    pq.write_table(table, out_file)
+
+if __name__ == "__main__":
+    params = get_params()
+    # Add code here:
+    # Files are independent, export them in parallel processes
+    files = list(zip(params["in"], params["out"]))
+    workers = min(len(files), params.get("workers", 0) or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # consume results to raise errors from worker processes
+            list(pool.map(export, *zip(*files)))
+    else:
+        for args in files:
+            export(*args)
@@ -0,0 +1,63 @@
+"""
+Feature maps re-created from the feature DataFrames exported by the python-tools scripts.
+
+The merge_ffm_ffmid_df script stores the merged features of each file as featureXML
+with this module, the feature maps are identical to those re-created feature by
+feature with rectangular convex hulls added point by point (ConvexHull2D.addPoint).
+"""
+import numpy as np
+import pyopenms as poms
+
+
+def feature_map(df, mzML_name: str) -> poms.FeatureMap:
+    """
+    Creates a feature map from a feature DataFrame, with rectangular convex hulls from the RT and m/z ranges.
+
+    Args:
+        df (pd.DataFrame): Features with feature ids as index and the columns RT, mz, intensity, quality,
+                           charge, adduct, num_of_masstraces, RTstart, RTend, MZstart and MZend.
+        mzML_name (str): Name of the mzML file set as primary MS run path.
+
+    Returns:
+        poms.FeatureMap: The feature map.
+    """
+    fm = poms.FeatureMap()
+    fm.setPrimaryMSRunPath([mzML_name.encode()])
+    # Hull points are stored as float32, ordered like the hull computed from the four corners
+    rt_range = np.sort(df[["RTstart", "RTend"]].to_numpy(np.float32), axis=1)
+    mz_range = np.sort(df[["MZstart", "MZend"]].to_numpy(np.float32), axis=1)
+    hull_points = np.stack([rt_range[:, [0, 1, 1, 0]], mz_range[:, [0, 0, 1, 1]]], axis=2)
+    # Collapsed hulls have less than four points, these are computed point by point
+    collapsed = (rt_range[:, 0] == rt_range[:, 1]) | (mz_range[:, 0] == mz_range[:, 1])
+    columns = zip(
+        df.index.tolist(),
+        df["RT"].tolist(),
+        df["mz"].tolist(),
+        df["intensity"].tolist(),
+        df["quality"].tolist(),
+        df["charge"].tolist(),
+        df["adduct"].tolist(),
+        df["num_of_masstraces"].tolist(),
+        df[["RTstart", "MZstart", "RTend", "MZend"]].to_numpy().tolist(),
+    )
+    for i, (feature_id, rt, mz, intensity, quality, charge, adduct, n_traces, bounds) in enumerate(columns):
+        f = poms.Feature()
+        f.setRT(rt)
+        f.setMZ(mz)
+        f.setIntensity(intensity)
+        f.setOverallQuality(quality)
+        f.setCharge(charge)
+        if adduct != "nan":
+            f.setMetaValue("dc_charge_adducts", adduct)
+        f.setMetaValue("num_of_masstraces", n_traces)
+        f.setUniqueId(int(feature_id))
+        hull = poms.ConvexHull2D()
+        if collapsed[i]:
+            rt_start, mz_start, rt_end, mz_end = bounds
+            for point in ([rt_start, mz_start], [rt_end, mz_end], [rt_end, mz_start], [rt_start, mz_end]):
+                hull.addPoint(point)
+        else:
+            hull.setHullPoints(hull_points[i])
+        f.setConvexHulls([hull])
+        fm.push_back(f)
+    return fm
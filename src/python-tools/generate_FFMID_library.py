@@ -2,6 +2,7 @@ import json
 import sys
 from pathlib import Path
 import pandas as pd
+from metabolite_labels import neutral_mass
 
 ############################
 # default paramter values #
@@ -54,7 +55,7 @@ if __name__ == "__main__":
             "CompoundName": df.index,
             "SumFormula": "",
             # calculate neutral mass if charge is not zero, else assume charge = 1
-            "Mass": df.apply(lambda x: x["mz"] * x["charge"] - x["charge"] * 1.007825 if x["charge"] else x["mz"] - 1.007825, axis=1),
+            "Mass": neutral_mass(df["mz"], df["charge"]),
             "Charge": df["charge"],
             "RetentionTime": df["RT"],
             "RetentionTimeRange": 0,
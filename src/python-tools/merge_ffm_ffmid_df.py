@@ -1,8 +1,12 @@
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
 import pyarrow
+import pyopenms as poms
+from feature_maps import feature_map
 
 ############################
 # default paramter values #
@@ -25,6 +29,11 @@ import pyarrow
 
 DEFAULTS = [
     {"key": "in", "value": [], "help": "feature matrix parquet file", "hide": True},
+    {"key": "in_ffm", "value": [], "help": "ffm parquet files", "hide": True},
+    {"key": "in_ffmid", "value": [], "help": "ffmid parquet files", "hide": True},
+    {"key": "workers", "value": 0, "help": "number of files merged in parallel (0: number of CPU cores)", "hide": True},
+    {"key": "out", "value": [], "help": "merged feature parquet files (optional)", "hide": True},
+    {"key": "out_featureXML", "value": [], "help": "feature maps re-created directly from the merged features (optional)", "hide": True},
 ]
 
 def get_params():
@@ -34,44 +43,55 @@ def get_params():
     else:
         return {}
 
+def merge(file, ids, ffm_file, ffmid_file, out_file, out_featureXML):
+    """Merges the FFM features in the feature matrix with the FFMID features of a file and stores them as parquet and/or featureXML."""
+    # Open the ffm df
+    df_ffm = pd.read_parquet(ffm_file)
+    # Keep only rows in df_ffm where index is in the consensus feature IDs of this file
+    df_ffm = df_ffm.loc[df_ffm.index.isin(ids)]
+    # Open the ffmid df
+    df_ffmid = pd.read_parquet(ffmid_file)
+    # Concat both dataframes
+    df_merged = pd.concat([df_ffm, df_ffmid])
+
+    # Save dataframe
+    if out_file:
+        Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+        df_merged.to_parquet(out_file)
+    # Re-create the feature map without storing and reading the dataframe again
+    if out_featureXML:
+        Path(out_featureXML).parent.mkdir(parents=True, exist_ok=True)
+        poms.FeatureXMLFile().store(str(out_featureXML), feature_map(df_merged, file))
+
 if __name__ == "__main__":
     params = get_params()
     # Add code here:
     in_path = params["in"][0]
-    # output directory for merged dfs
-    out_dir = Path(Path(in_path).parent.parent, "feature-dfs")
-    if not out_dir.exists():
-        out_dir.mkdir(parents=True, exist_ok=True)
+    # input and output files per sample (file stem)
+    ffm_files = {Path(f).stem: f for f in params["in_ffm"]}
+    ffmid_files = {Path(f).stem: f for f in params["in_ffmid"]}
+    out_files = {Path(f).stem: f for f in params.get("out", [])}
+    out_featureXML = {Path(f).stem: f for f in params.get("out_featureXML", [])}
 
     df = pd.read_parquet(in_path)
 
-    # For each file in col which ends with mzML
-    for file in [col for col in df.columns if col.endswith(".mzML")]:
-        # Open the ffm df
-        df_ffm = pd.read_parquet(
-            Path(
-                Path(in_path).parent.parent,
-                "ffm-df",
-                Path(file).stem + ".parquet",
-            )
-        )
-        # Keep only rows in df_ffm where index is in df[file+"_IDs"]
-        df_ffm = df_ffm.loc[df_ffm.index.isin(df[file + "_IDs"])]
-        # Open the ffmid df
-        df_ffmid = pd.read_parquet(
-            Path(
-                Path(in_path).parent.parent,
-                "ffmid-df",
-                Path(file).stem + ".parquet",
-            )
-        )
-        # Concat both dataframes
-        df_merged = pd.concat([df_ffm, df_ffmid])
-
-        # Save dataframe
-        df_merged.to_parquet(
-            Path(
-                out_dir,
-                Path(file).stem + ".parquet",
-            )
+    # For each file in col which ends with mzML, files are merged in parallel processes
+    files = [
+        (
+            file,
+            df[file + "_IDs"].to_numpy(),
+            ffm_files[Path(file).stem],
+            ffmid_files[Path(file).stem],
+            out_files.get(Path(file).stem),
+            out_featureXML.get(Path(file).stem),
         )
+        for file in [col for col in df.columns if col.endswith(".mzML")]
+    ]
+    workers = min(len(files), params.get("workers", 0) or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # consume results to raise errors from worker processes
+            list(pool.map(merge, *zip(*files)))
+    else:
+        for args in files:
+            merge(*args)
@@ -0,0 +1,77 @@
+"""
+Vectorized construction of derived feature columns shared by the python-tools scripts.
+
+The metabolite label (e.g. "180.0634@95.24@[M+H]+") is used as the key to join the
+consensus and feature map DataFrames. The labels built here are identical to those
+formatted row by row with f"{round(mz, 4)}@{round(rt, 2)}@{adduct}".
+"""
+import numpy as np
+
+# Monoisotopic mass of hydrogen used for the neutral mass of a feature
+PROTON_MASS = 1.007825
+
+
+def round_values(values, decimals: int) -> np.ndarray:
+    """
+    Rounds values exactly like the built-in round() of Python.
+
+    NumPy scales the values by 10**decimals before rounding, which can move values
+    that lie (almost) exactly on a rounding boundary to the other side. These values
+    and values too large to be scaled exactly are rounded with round() instead.
+
+    Args:
+        values (array-like): Float values.
+        decimals (int): Number of decimals.
+
+    Returns:
+        np.ndarray: The rounded values.
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, decimals)
+    scaled = np.abs(values) * 10.0**decimals
+    with np.errstate(invalid="ignore"):
+        exact = (scaled < 2**52) & (np.abs(scaled - np.floor(scaled) - 0.5) > 1e-6)
+    for i in np.flatnonzero(~exact):
+        rounded[i] = round(float(values[i]), decimals)
+    return rounded
+
+
+def metabolite_labels(mz, rt, adduct=None) -> np.ndarray:
+    """
+    Builds the metabolite labels "mz@RT@adduct" (or "mz@RT" without adducts), with m/z
+    rounded to 4 and RT rounded to 2 decimals.
+
+    Args:
+        mz (array-like): m/z values.
+        rt (array-like): Retention times.
+        adduct (array-like, optional): Adducts, formatted with str(). Defaults to None.
+
+    Returns:
+        np.ndarray: The metabolite labels.
+    """
+    labels = (
+        round_values(mz, 4).astype(str).astype(object)
+        + "@"
+        + round_values(rt, 2).astype(str).astype(object)
+    )
+    if adduct is not None:
+        labels = labels + "@" + np.asarray(adduct, dtype=object).astype(str).astype(object)
+    return labels
+
+
+def neutral_mass(mz, charge) -> np.ndarray:
+    """
+    Calculates the neutral mass of features, assuming charge 1 for features without charge.
+
+    Args:
+        mz (array-like): m/z values.
+        charge (array-like): Charges.
+
+    Returns:
+        np.ndarray: The neutral masses.
+    """
+    mz = np.asarray(mz, dtype=float)
+    charge = np.asarray(charge)
+    return np.where(
+        charge != 0, mz * charge - charge * PROTON_MASS, mz - PROTON_MASS
+    )
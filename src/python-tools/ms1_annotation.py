@@ -0,0 +1,57 @@
+"""
+MS1 annotation of features with a library of compounds (name, m/z and RT), shared by the
+annotate-ms1 script and DataFrames.annotate_ms1 in src/dataframes.py.
+"""
+import numpy as np
+import pandas as pd
+
+
+def ms1_annotations(mz, rt, groups, library, mz_tolerance, rt_window):
+    """
+    Annotates features with the names of library compounds within an m/z tolerance (ppm)
+    and RT window. Library compounds are matched with a binary search over the sorted
+    feature m/z values. All features of the same group receive the names of all compounds
+    matching any of them, separated by ";" if the group has more than one feature.
+
+    Args:
+        mz (array-like): m/z values of the features.
+        rt (array-like): Retention times of the features.
+        groups (array-like): Group of each feature (e.g. metabolite).
+        library (pd.DataFrame): Library with "name", "mz" and "RT" columns.
+        mz_tolerance (float): m/z tolerance in ppm.
+        rt_window (float): RT window in seconds, centered around the library RT.
+
+    Returns:
+        np.ndarray: The MS1 annotation for each feature.
+    """
+    mz = np.asarray(mz, dtype=float)
+    rt = np.asarray(rt, dtype=float)
+    lib_mz = library["mz"].to_numpy(dtype=float)
+    lib_rt = library["RT"].to_numpy(dtype=float)
+    names = library["name"].astype(str).to_numpy(dtype=object)
+    delta_Da = np.abs(mz_tolerance * lib_mz / 1000000)
+    # range of features within the m/z window (exclusive bounds) for each library compound
+    order = np.argsort(mz, kind="stable")
+    start = np.searchsorted(mz[order], lib_mz - delta_Da, side="right")
+    end = np.searchsorted(mz[order], lib_mz + delta_Da, side="left")
+    counts = np.maximum(end - start, 0)
+    lib_idx = np.repeat(np.arange(len(lib_mz)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    feature_idx = order[np.repeat(start, counts) + offsets]
+    # keep features within the RT window
+    keep = (rt[feature_idx] > lib_rt[lib_idx] - rt_window / 2) & (
+        rt[feature_idx] < lib_rt[lib_idx] + rt_window / 2
+    )
+    lib_idx, feature_idx = lib_idx[keep], feature_idx[keep]
+    # join names per group, in order of the library and then of the features
+    codes, _ = pd.factorize(pd.Series(groups))
+    group_sizes = np.bincount(codes[codes >= 0], minlength=len(codes))
+    matches = np.lexsort((feature_idx, lib_idx))
+    lib_idx, match_codes = lib_idx[matches], codes[feature_idx[matches]]
+    lib_idx, match_codes = lib_idx[match_codes >= 0], match_codes[match_codes >= 0]
+    separators = np.where(group_sizes[match_codes] > 1, ";", "").astype(object)
+    annotations = pd.Series(separators + names[lib_idx]).groupby(match_codes, sort=False).agg("".join)
+    result = np.full(len(codes), "", dtype=object)
+    annotated = np.isin(codes, annotations.index)
+    result[annotated] = annotations.loc[codes[annotated]].to_numpy()
+    return result
@@ -12,10 +12,22 @@ from ms2query.ms2library import create_library_object_from_one_dir
 from ms2query.utils import SettingsRunMS2Query
 
 DEFAULTS = [
-    {"key": "in", "value": [], "help": "Feature Matrix tsv file", "hide": True},
+    {"key": "in", "value": [], "help": "Feature Matrix parquet file", "hide": True},
     {"key": "in_mgf", "value": [], "help": "GNPS mgf file", "hide": True},
     {
-        "key": "out_m2query_csv",
+        "key": "in_gnps",
+        "value": [],
+        "help": "GNPS Feature Matrix parquet file, maps MS2Query feature IDs to metabolites.",
+        "hide": True,
+    },
+    {
+        "key": "out",
+        "value": [],
+        "help": "Feature Matrix parquet file with MS2Query annotations.",
+        "hide": True,
+    },
+    {
+        "key": "out_ms2query_csv",
         "value": [],
         "help": "MS2Query output file.",
         "hide": True,
@@ -50,42 +62,72 @@ def download_ms2query_libraries(ms2query_library_files_directory, ion_mode, flag
     Path(flag_file).touch()
 
 
-def ms2query_annotations(feature_matrix, ms2query_csv):
-    df_gnps = pd.read_parquet(
-        Path(Path(feature_matrix).parent, "feature-matrix-gnps.parquet"))
+MS2QUERY_COLUMNS = [
+    "ms2query_model_prediction",
+    "precursor_mz_difference",
+    "inchikey",
+    "analog_compound_name",
+    "smiles",
+    "cf_kingdom",
+    "cf_superclass",
+    "cf_class",
+    "cf_subclass",
+    "cf_direct_parent",
+    "npc_class_results",
+    "npc_superclass_results",
+    "npc_pathway_results",
+]
+
+
+def merge_ms2query_results(df, df_gnps, df_ms2query):
+    """
+    Adds the MS2Query results to the feature matrix, joined on the consensus feature IDs of the GNPS feature matrix.
+
+    Consensus features with more than one MS2Query result get the first one, metabolites
+    with more than one consensus feature the result of the last one.
+
+    Args:
+        df (pd.DataFrame): Feature matrix with metabolites as index.
+        df_gnps (pd.DataFrame): GNPS feature matrix with metabolites as index and consensus feature IDs.
+        df_ms2query (pd.DataFrame): MS2Query results with consensus feature IDs (int) as index.
+
+    Returns:
+        pd.DataFrame: The feature matrix with a MS2Query_<column> column per MS2Query result column
+                      (string values, missing for features without result), unchanged without results.
+    """
+    df = df.copy()
+    # MS2Query results per metabolite, joined on the consensus feature ID
+    annotations = df_ms2query.loc[~df_ms2query.index.duplicated(), MS2QUERY_COLUMNS]
+    annotations = annotations.apply(lambda column: column.map(str))
+    annotations.index = annotations.index.astype(str)
+    gnps = pd.DataFrame(
+        {
+            "metabolite": df_gnps.index,
+            "consensus_feature_id": df_gnps["consensus_feature_id"].astype(str).to_numpy(),
+        }
+    ).drop_duplicates("consensus_feature_id")
+    annotations = gnps.merge(
+        annotations, left_on="consensus_feature_id", right_index=True
+    ).drop_duplicates("metabolite", keep="last").set_index("metabolite")
+
+    if not annotations.empty:
+        for col in MS2QUERY_COLUMNS:
+            df[f"MS2Query_{col}"] = df.index.map(annotations[col]).to_numpy()
+    return df
+
+
+def ms2query_annotations(feature_matrix, gnps_feature_matrix, ms2query_csv, out):
+    df_gnps = pd.read_parquet(gnps_feature_matrix)
 
     df_ms2query = pd.read_csv(ms2query_csv)
     df_ms2query["feature_id"] = df_ms2query["feature_id"].apply(lambda x: int(x[2:]))
     df_ms2query = df_ms2query.set_index("feature_id")
 
-    ms2query_columns = [
-        "ms2query_model_prediction",
-        "precursor_mz_difference",
-        "inchikey",
-        "analog_compound_name",
-        "smiles",
-        "cf_kingdom",
-        "cf_superclass",
-        "cf_class",
-        "cf_subclass",
-        "cf_direct_parent",
-        "npc_class_results",
-        "npc_superclass_results",
-        "npc_pathway_results",
-    ]
-
     df = pd.read_parquet(Path(feature_matrix).with_suffix(".parquet"))
+    df = merge_ms2query_results(df, df_gnps, df_ms2query)
 
-    for i in df_gnps["consensus_feature_id"]:
-        if i in df_ms2query.index:
-            for col in ms2query_columns:
-                df.loc[
-                    df_gnps.index[df_gnps["consensus_feature_id"] == i].tolist()[0],
-                    f"MS2Query_{col}",
-                ] = str(df_ms2query.loc[i, col])
-
-    df.to_parquet(feature_matrix)
-    df.to_csv(Path(feature_matrix).with_suffix(".tsv"), sep="\t")
+    df.to_parquet(out)
+    df.to_csv(Path(out).with_suffix(".tsv"), sep="\t")
 
 
 if __name__ == "__main__":
@@ -119,4 +161,4 @@ if __name__ == "__main__":
         settings=SettingsRunMS2Query(additional_metadata_columns=("FEATURE_ID",)),
     )
 
-    ms2query_annotations(consensus_file, results_file)
\ No newline at end of file
+    ms2query_annotations(consensus_file, params["in_gnps"][0], results_file, params["out"][0])
\ No newline at end of file
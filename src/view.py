@@ -1,21 +1,24 @@
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-import pyopenms as poms
 from src.common.common import show_fig, display_large_dataframe
+from src.mzml import read_spectra, remove_orphaned_caches
 from typing import Union
 
 
-def get_df(file: Union[str, Path]) -> pd.DataFrame:
+def get_df(file: Union[str, Path], cache_dir: Union[str, Path]) -> pd.DataFrame:
     """
     Load a Mass Spectrometry (MS) experiment from a given mzML file and return
-    a pandas dataframe representation of the experiment.
+    a pandas dataframe representation of the experiment. Spectra are read from the
+    peak cache of the workspace, the mzML file is only parsed if it is not cached yet.
 
     Args:
         file (Union[str, Path]): The path to the mzML file to load.
+        cache_dir (Union[str, Path]): The cache directory of the workspace (mzML-cache).
 
     Returns:
         pd.DataFrame: A pandas DataFrame with the following columns: "mslevel",
@@ -23,41 +26,34 @@ def get_df(file: Union[str, Path]) -> pd.DataFrame:
         columns contain NumPy arrays with the m/z and intensity values for each
         spectrum in the mzML file, respectively.
     """
-    exp = poms.MSExperiment()
-    poms.MzMLFile().load(str(file), exp)
-    df_spectra = exp.get_df()
-    df_spectra["MS level"] = [spec.getMSLevel() for spec in exp]
-    precs = []
-    for spec in exp:
-        p = spec.getPrecursors()
-        if p:
-            precs.append(p[0].getMZ())
-        else:
-            precs.append(np.nan)
-    df_spectra["precursor m/z"] = precs
-    df_spectra["max intensity m/z"] = df_spectra.apply(
-        lambda x: x["mzarray"][x["intarray"].argmax()], axis=1
-    )
+    remove_orphaned_caches(cache_dir)
+    spectra = read_spectra(file, cache_dir)
+    df_spectra = spectra.select(["RT", "mzarray", "intarray"]).to_pandas()
+    ms_levels = spectra["MS level"].to_numpy().astype(np.int64)
+    df_spectra["MS level"] = ms_levels
+    df_spectra["precursor m/z"] = spectra["precursor m/z"].to_numpy()
+    df_spectra["max intensity m/z"] = spectra["base peak m/z"].to_numpy()
     if not df_spectra.empty:
         st.session_state["view_spectra"] = df_spectra
     else:
         st.session_state["view_spectra"] = pd.DataFrame()
-    exp_ms2 = poms.MSExperiment()
-    exp_ms1 = poms.MSExperiment()
-    for spec in exp:
-        if spec.getMSLevel() == 1:
-            exp_ms1.addSpectrum(spec)
-        elif spec.getMSLevel() == 2:
-            exp_ms2.addSpectrum(spec)
-    if not exp_ms1.empty():
-        st.session_state["view_ms1"] = exp_ms1.get_df(long=True)
-    else:
-        st.session_state["view_ms1"] = pd.DataFrame()
-    if not exp_ms2.empty():
-        st.session_state["view_ms2"] = exp_ms2.get_df(long=True)
-    else:
-        st.session_state["view_ms2"] = pd.DataFrame()
-
+    for level, key in ((1, "view_ms1"), (2, "view_ms2")):
+        selected = spectra.filter(pa.array(ms_levels == level))
+        if selected.num_rows:
+            # one row per peak
+            mzarray = selected["mzarray"].combine_chunks()
+            st.session_state[key] = pd.DataFrame(
+                {
+                    "RT": np.repeat(
+                        selected["RT"].to_numpy().astype(np.float32),
+                        np.diff(mzarray.offsets.to_numpy()),
+                    ),
+                    "mz": mzarray.flatten().to_numpy().astype(np.float32),
+                    "inty": selected["intarray"].combine_chunks().flatten().to_numpy(),
+                }
+            )
+        else:
+            st.session_state[key] = pd.DataFrame()
 
 def plot_bpc_tic() -> go.Figure:
     """Plot the base peak and total ion chromatogram (TIC).
@@ -2,13 +2,23 @@ import time
 import os
 import shutil
 import subprocess
-import threading
 from pathlib import Path
 from .Logger import Logger
 from .ParameterManager import ParameterManager
+from .Scheduler import Scheduler
+from .MemoryModel import MemoryModel
+from .StepCache import StepCache
+from .StepJournal import StepJournal
+from .PythonWorker import PythonWorker
+from functools import partial
+from collections import deque
+import threading
 import sys
 import importlib.util
 import json
+import hashlib
+import tempfile
+import ast
 
 class CommandExecutor:
     """
@@ -19,66 +29,158 @@ class CommandExecutor:
     commands and batches of commands in parallel, leveraging Python's subprocess module
     for execution.
     """
+    # Tool output is written to the log in batches of max. lines / after max. seconds
+    LOG_BATCH_LINES = 100
+    LOG_BATCH_SECONDS = 1.0
+    # Number of stderr lines kept in memory for the error message of failed commands
+    STDERR_LINES = 200
+
     # Methods for running commands and logging
-    def __init__(self, workflow_dir: Path, logger: Logger, parameter_manager: ParameterManager):
+    def __init__(self, workflow_dir: Path, logger: Logger, parameter_manager: ParameterManager, scheduler: Scheduler = None, cache: StepCache = None, journal: StepJournal = None, python_worker: PythonWorker = None):
         self.pid_dir = Path(workflow_dir, "pids")
+        # Resource usage of each executed command (JSON lines)
+        self.metrics_file = Path(workflow_dir, "logs", "metrics.jsonl")
+        self._metrics_lock = threading.Lock()
         self.logger = logger
         self.parameter_manager = parameter_manager
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.memory_model = MemoryModel(
+            Path(workflow_dir, "memory-history.json"), self.scheduler.memory_budget
+        )
+        # Optional step cache, outputs of unchanged steps are restored instead of re-computed
+        self.cache = cache
+        # Optional journal of completed steps, to resume interrupted workflow runs
+        self.journal = journal
+        # Optional warm worker process, Python scripts are forked from it while it is running
+        self.python_worker = python_worker
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_metrics_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._metrics_lock = threading.Lock()
 
     def run_multiple_commands(
-        self, commands: list[str]
-    ) -> None:
+        self,
+        commands: list[str],
+        input_sizes: list[int] = None,
+        max_parallel: int = None,
+        threads_option: str = None,
+        max_threads: int = None,
+    ) -> list[bool]:
         """
-        Executes multiple shell commands concurrently in separate threads.
+        Executes multiple shell commands concurrently on the worker pool of the scheduler.
 
-        This method leverages threading to run each command in parallel, improving
-        efficiency for batch command execution. Execution time and command results are
-        logged if specified.
+        At most `scheduler.max_workers` commands run at the same time, the remaining
+        commands are started as soon as a running command finishes and the estimated
+        peak memory of all running commands fits into the scheduler memory budget.
+        Execution time and command results are logged if specified.
 
         Args:
             commands (list[str]): A list where each element is a list representing
                                         a command and its arguments.
+            input_sizes (list[int], optional): Total size of input files in bytes for each command,
+                                        used to estimate the peak memory. Defaults to None.
+            max_parallel (int, optional): Maximum number of these commands running at the same time,
+                                        in addition to the scheduler limits. Defaults to None.
+            threads_option (str, optional): Option for the number of threads of the tool (e.g. -threads), see run_command. Defaults to None.
+            max_threads (int, optional): Maximum number of threads per command. Defaults to None.
+
+        Returns:
+            list[bool]: For each command, whether it finished successfully.
         """
         # Log the start of command execution
-        self.logger.log(f"Running {len(commands)} commands in parallel...", 1)
+        self.logger.log(f"Running {len(commands)} commands in parallel (max. {self.scheduler.n_parallel(len(commands), max_parallel)} at a time)...", 1)
         start_time = time.time()
 
-        # Initialize a list to keep track of threads
-        threads = []
-
-        # Start a new thread for each command
-        for cmd in commands:
-            thread = threading.Thread(target=self.run_command, args=(cmd,))
-            thread.start()
-            threads.append(thread)
-
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
+        # Run commands on the worker pool and wait for all of them to complete
+        if input_sizes is None:
+            input_sizes = [0] * len(commands)
+        results = self.scheduler.run(
+            [
+                partial(self.run_command, cmd, size, threads_option, max_threads)
+                for cmd, size in zip(commands, input_sizes)
+            ],
+            [self.memory_model.estimate(self._tool_name(cmd), size) for cmd, size in zip(commands, input_sizes)],
+            max_parallel,
+        )
 
         # Calculate and log the total execution time
         end_time = time.time()
         self.logger.log(f"Total time to run {len(commands)} commands: {end_time - start_time:.2f} seconds", 1)
+        return results
+
+    def run_scheduled_command(
+        self,
+        command: list[str],
+        input_size: int = 0,
+        threads_option: str = None,
+        max_threads: int = None,
+    ) -> bool:
+        """
+        Executes a single shell command as soon as the scheduler admits it, i.e. when a
+        worker is free and its estimated peak memory fits into the memory budget next to
+        the commands of other workflow steps running at the same time.
+
+        Args:
+            command (list[str]): The shell command to execute, provided as a list of strings.
+            input_size (int, optional): Total size of the input files in bytes. Defaults to 0.
+            threads_option (str, optional): Option for the number of threads of the tool (e.g. -threads), see run_command. Defaults to None.
+            max_threads (int, optional): Maximum number of threads. Defaults to None.
+
+        Returns:
+            bool: True if the command finished successfully (exit code 0).
+        """
+        return self.scheduler.run(
+            [partial(self.run_command, command, input_size, threads_option, max_threads)],
+            [self.memory_model.estimate(self._tool_name(command), input_size)],
+        )[0]
 
-    def run_command(self, command: list[str]) -> None:
+    def run_command(
+        self,
+        command: list[str],
+        input_size: int = 0,
+        threads_option: str = None,
+        max_threads: int = None,
+    ) -> bool:
         """
         Executes a specified shell command and logs its execution details.
+        The peak memory of the process is recorded to refine future memory estimates.
 
         Args:
             command (list[str]): The shell command to execute, provided as a list of strings.
+            input_size (int, optional): Total size of the input files in bytes. Defaults to 0.
+            threads_option (str, optional): If given, the number of threads assigned to this job by the scheduler
+                                            is passed to the tool with this option after the executable. Defaults to None.
+            max_threads (int, optional): Maximum number of threads passed with threads_option. Defaults to None.
 
-        Raises:
-            Exception: If the command execution results in any errors.
+        Returns:
+            bool: True if the command finished successfully (exit code 0).
         """
         # Ensure all command parts are strings
         command = [str(c) for c in command]
+        if threads_option:
+            threads = self.scheduler.job_threads()
+            if max_threads:
+                threads = min(threads, int(max_threads))
+            command = [command[0], threads_option, str(threads)] + command[1:]
 
         # Log the execution start
         self.logger.log(f"Running command:\n"+' '.join(command)+"\nWaiting for command to finish...", 1)   
         start_time = time.time()
         
-        # Execute the command
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Execute the command, Python scripts in a process forked from the warm worker if available
+        process = None
+        if command[0] == "python" and self.python_worker is not None and self.python_worker.running:
+            try:
+                process = self.python_worker.run(command[1:])
+            except OSError as e:
+                self.logger.log(f"Python worker not available, starting a new interpreter: {e}", 2)
+        if process is None:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         child_pid = process.pid
         
         # Record the PID to keep track of running processes associated with this workspace/workflow
@@ -86,25 +188,180 @@ class CommandExecutor:
         pid_file_path = self.pid_dir / str(child_pid)
         pid_file_path.touch()
         
-        # Wait for command completion and capture output
-        stdout, stderr = process.communicate()
+        # Stream output to the log and wait for command completion
+        stderr, usage = self._wait(process)
         
         # Cleanup PID file
         pid_file_path.unlink()
 
+        # Learn memory usage of this tool for future estimates
+        if process.returncode == 0:
+            self.memory_model.record(self._tool_name(command), input_size, usage["peak_rss"])
+
         end_time = time.time()
         execution_time = end_time - start_time
+        self._record_metrics(
+            {
+                "tool": self._tool_name(command),
+                "command": " ".join(command),
+                "start": start_time,
+                "wall": execution_time,
+                **usage,
+                "input_size": input_size,
+                "returncode": process.returncode,
+            }
+        )
         # Format the logging prefix
         self.logger.log(f"Process finished:\n"+' '.join(command)+f"\nTotal time to run command: {execution_time:.2f} seconds", 1)
         
-        # Log stdout if present
-        if stdout:
-            self.logger.log(stdout.decode(), 2)
-        
-        # Log stderr and raise an exception if errors occurred
+        # Log stderr if errors occurred
         if stderr or process.returncode != 0:
-            error_message = stderr.decode().strip()
-            self.logger.log(f"ERRORS OCCURRED:\n{error_message}", 2)
+            self.logger.log(f"ERRORS OCCURRED:\n{stderr.strip()}", 2)
+
+        return process.returncode == 0
+
+    def _peak_memory(self, pid: int) -> int:
+        """
+        Reads the peak memory of a running process from /proc (Linux only).
+
+        Processes which start child processes (e.g. a process pool) are measured together
+        with them: the result is the higher value of the peak memory (VmHWM) of the process
+        and the current memory (VmRSS) of the process and all its descendants.
+
+        Args:
+            pid (int): The process id.
+
+        Returns:
+            int: Peak memory (RSS) in bytes, 0 if not available.
+        """
+        peak = self._memory_status(pid, "VmHWM")
+        descendants = self._descendants(pid)
+        if descendants:
+            peak = max(peak, sum(self._memory_status(p, "VmRSS") for p in [pid] + descendants))
+        return peak
+
+    def _memory_status(self, pid: int, field: str) -> int:
+        # Memory value (bytes) of a process from /proc/<pid>/status, 0 if not available
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith(f"{field}:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return 0
+
+    def _descendants(self, pid: int) -> list[int]:
+        # Process ids of all descendants of a process from the parent ids in /proc/<pid>/stat
+        children = {}
+        for stat in Path("/proc").glob("[0-9]*/stat"):
+            try:
+                # the command name in brackets may contain spaces, the parent id follows the state
+                ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(stat.parent.name))
+        descendants = children.get(pid, [])[:]
+        for child in descendants:
+            descendants += [c for c in children.get(child, []) if c not in descendants]
+        return descendants
+
+    def _record_metrics(self, record: dict) -> None:
+        """
+        Appends the resource usage of a command to the metrics file of the workflow run.
+
+        Args:
+            record (dict): Tool, command, wall time, CPU times, peak memory and I/O of the command.
+        """
+        with self._metrics_lock:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.metrics_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def _wait(self, process: subprocess.Popen) -> tuple[str, dict]:
+        """
+        Waits for a process to finish while streaming its output line by line.
+
+        Lines written to stdout are passed to the log (level 2) in batches while the process
+        is running, only the last lines written to stderr are kept in memory. The memory
+        high water mark is sampled from /proc while the process is running, CPU times,
+        maximum RSS and block device I/O are taken from the resource usage of the
+        terminated process (where available). Block device I/O does not include reads
+        served from the page cache.
+
+        Args:
+            process (subprocess.Popen): The running process with stdout and stderr pipes. Processes which are
+                                        not children of this process (e.g. forked by the Python worker)
+                                        provide their resource usage with a wait4 method.
+
+        Returns:
+            tuple[str, dict]: The tail of stderr and the resource usage of the process with keys
+                              user, sys (CPU seconds), peak_rss, block_read_bytes and block_write_bytes (bytes).
+                              Values not available on this platform are None (peak_rss 0).
+        """
+        lock = threading.Lock()
+        stdout_lines = []
+        stderr_lines = deque(maxlen=self.STDERR_LINES)
+
+        def flush():
+            with lock:
+                lines = stdout_lines[:]
+                stdout_lines.clear()
+            if lines:
+                self.logger.log("\n".join(lines), 2)
+
+        def read_stdout():
+            for line in iter(process.stdout.readline, b""):
+                with lock:
+                    stdout_lines.append(line.decode(errors="replace").rstrip())
+                    full = len(stdout_lines) >= self.LOG_BATCH_LINES
+                if full:
+                    flush()
+
+        def read_stderr():
+            for line in iter(process.stderr.readline, b""):
+                stderr_lines.append(line.decode(errors="replace").rstrip())
+
+        # Read both pipes in background threads until they are closed
+        readers = [threading.Thread(target=read_stdout), threading.Thread(target=read_stderr)]
+        for reader in readers:
+            reader.start()
+        peak_memory = 0
+        last_flush = time.time()
+        # Sample often at the beginning to catch short running processes, then every 0.5 seconds
+        interval = 0.01
+        for reader in readers:
+            while reader.is_alive():
+                peak_memory = max(peak_memory, self._peak_memory(process.pid))
+                if time.time() - last_flush >= self.LOG_BATCH_SECONDS:
+                    flush()
+                    last_flush = time.time()
+                reader.join(timeout=interval)
+                interval = min(0.5, interval * 2)
+        flush()
+        process.stdout.close()
+        process.stderr.close()
+        usage = {"user": None, "sys": None, "peak_rss": peak_memory, "block_read_bytes": None, "block_write_bytes": None}
+        wait4 = getattr(process, "wait4", None)
+        if wait4 is None and hasattr(os, "wait4"):
+            # Reap the process ourselves to get its resource usage
+            wait4 = partial(os.wait4, process.pid, 0)
+        if wait4 is not None:
+            _, status, rusage = wait4()
+            process.returncode = os.waitstatus_to_exitcode(status)
+            if rusage.ru_utime is not None:
+                usage["user"] = rusage.ru_utime
+                usage["sys"] = rusage.ru_stime
+                # Sampling misses peaks of short running processes, ru_maxrss is in kilobytes (bytes on macOS)
+                usage["peak_rss"] = max(
+                    peak_memory, rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+                )
+                # Block I/O is counted in units of 512 bytes
+                usage["block_read_bytes"] = rusage.ru_inblock * 512
+                usage["block_write_bytes"] = rusage.ru_oublock * 512
+        else:
+            process.wait()
+        return "\n".join(stderr_lines), usage
 
     def run_topp(self, tool: str, input_output: dict, custom_params: dict = {}) -> None:
         """
@@ -142,12 +399,17 @@ class CommandExecutor:
             n_processes = max(io_lengths)
 
         commands = []
+        input_sizes = []
+        # input and output files for each command (step cache)
+        step_files = []
 
         # Load parameters for non-defaults
         params = self.parameter_manager.get_parameters_from_json()
         # Construct commands for each process
         for i in range(n_processes):
             command = [tool]
+            input_size = 0
+            inputs, outputs = [], []
             # Add input/output files
             for k in input_output.keys():
                 # add key as parameter name
@@ -155,17 +417,26 @@ class CommandExecutor:
                 # get value from input_output dictionary
                 value = input_output[k]
                 # when multiple input/output files exist (e.g., multiple mzMLs and featureXMLs), but only one additional input file (e.g., one input database file)
-                if len(value) == 1:
-                    i = 0
+                j = 0 if len(value) == 1 else i
                 # when the entry is a list of collected files to be passed as one [["sample1", "sample2"]]
-                if isinstance(value[i], list):
-                    command += value[i]
+                if isinstance(value[j], list):
+                    files = value[j]
                 # standard case, files was a list of strings, take the file name at index
                 else:
-                    command += [value[i]]
+                    files = [value[j]]
+                command += files
+                if "out" in k:
+                    outputs += files
+                else:
+                    inputs += files
+                    # sum up input file sizes to estimate memory usage
+                    input_size += sum(Path(f).stat().st_size for f in files if Path(f).is_file())
             # Add non-default TOPP tool parameters
             if tool in params.keys():
                 for k, v in params[tool].items():
+                    # threads are set per process by the scheduler, the user defined value is the maximum
+                    if k == "threads":
+                        continue
                     command += [f"-{k}"]
                     if v:
                         if isinstance(v, str) and "\n" in v:
@@ -181,20 +452,129 @@ class CommandExecutor:
                     else:
                         command += [str(v)]
             commands.append(command)
+            input_sizes.append(input_size)
 
             # check if a ini file has been written, if yes use it (contains custom defaults)
             ini_path = Path(self.parameter_manager.ini_dir, tool + ".ini")
             if ini_path.exists():
                 command += ["-ini", str(ini_path)]
+                inputs.append(str(ini_path))
+            step_files.append((inputs, outputs))
 
-        # Run command(s)
-        if len(commands) == 1:
-            self.run_command(commands[0])
-        elif len(commands) > 1:
-            self.run_multiple_commands(commands)
-        else:
+        if not commands:
             raise Exception("No commands to execute.")
 
+        # Skip the step if it completed in a previous run which is resumed
+        all_outputs = [f for _, outputs in step_files for f in outputs]
+        all_inputs = [f for inputs, _ in step_files for f in inputs if f not in all_outputs]
+        step = self._step_key(
+            tool, [self._strip_threads(c) for c in commands], [str(ini_path)], list(dict.fromkeys(all_inputs))
+        )
+        if self.journal is not None and self.journal.skip(step, all_outputs):
+            self.logger.log(f"Skipping {tool}, completed in previous run.", 1)
+            return
+
+        # Restore outputs of unchanged commands from the step cache, run the others
+        keys = [None] * len(commands)
+        pending = []
+        for i, (command, (inputs, outputs)) in enumerate(zip(commands, step_files)):
+            if self.cache is not None and outputs:
+                keys[i] = self._topp_cache_key(command, inputs)
+                if self.cache.restore(keys[i]):
+                    self.logger.log("Restored from cache: " + " ".join(command), 1)
+                    continue
+            pending.append(i)
+
+        # Run command(s), the number of threads is assigned when the scheduler starts a command,
+        # unless specified as custom parameter
+        threads_option = None if "threads" in custom_params else "-threads"
+        max_threads = params.get(tool, {}).get("threads", None)
+        if len(pending) == 1:
+            # single commands are subject to the memory budget as well
+            i = pending[0]
+            success = [
+                self.run_scheduled_command(commands[i], input_sizes[i], threads_option, max_threads)
+            ]
+        elif len(pending) > 1:
+            success = self.run_multiple_commands(
+                [commands[i] for i in pending],
+                [input_sizes[i] for i in pending],
+                threads_option=threads_option,
+                max_threads=max_threads,
+            )
+        else:
+            success = []
+
+        # Store outputs of successful commands in the step cache
+        for i, ok in zip(pending, success):
+            if ok and keys[i] is not None:
+                self.cache.store(keys[i], step_files[i][1])
+
+        if self.journal is not None and all(success):
+            self.journal.record(step, tool, all_outputs)
+
+    def _strip_threads(self, command: list[str]) -> list[str]:
+        """
+        Removes the number of threads from a command, it does not change the results.
+
+        Args:
+            command (list[str]): The command.
+
+        Returns:
+            list[str]: The command without the -threads parameter.
+        """
+        args = list(command)
+        if "-threads" in args:
+            i = args.index("-threads")
+            del args[i : i + 2]
+        return args
+
+    def _step_key(self, name: str, definition, files: list[str] = [], inputs: list[str] = []) -> str:
+        """
+        Computes a key for the definition of a step (tool, parameters and file paths) for the step journal.
+
+        Input files are part of the key with their size and modification time, so steps are
+        executed again when an input has been re-created. Files which the step updates in
+        place are checked as outputs by the journal and left out here.
+
+        Args:
+            name (str): Name of the tool or script.
+            definition: JSON serializable step definition, e.g. the commands.
+            files (list[str], optional): Files whose content is part of the definition (e.g. ini files). Defaults to [].
+            inputs (list[str], optional): Input files of the step. Defaults to [].
+
+        Returns:
+            str: The step key.
+        """
+        h = hashlib.sha256(json.dumps([name, definition], sort_keys=True, default=str).encode())
+        for f in files:
+            if Path(f).is_file():
+                h.update(Path(f).read_bytes())
+        h.update(json.dumps(StepJournal.digests(inputs), sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _topp_cache_key(self, command: list[str], inputs: list[str]) -> str:
+        """
+        Computes the step cache key of a TOPP tool command.
+
+        The key depends on the tool executable, the command line (without the number of
+        threads, which does not change the results) and the content of the input files.
+
+        Args:
+            command (list[str]): The command to execute.
+            inputs (list[str]): Input files of the command (including the ini file).
+
+        Returns:
+            str: The cache key.
+        """
+        args = self._strip_threads(command)
+        executable = shutil.which(command[0])
+        stamp = None
+        if executable:
+            stat = Path(executable).stat()
+            stamp = [executable, stat.st_size, stat.st_mtime_ns]
+        return self.cache.key(command[0], {"command": args, "executable": stamp}, inputs)
+
     def stop(self) -> None:
         """
         Terminates all processes initiated by this executor by killing them based on stored PIDs.
@@ -211,6 +591,21 @@ class CommandExecutor:
         shutil.rmtree(self.pid_dir, ignore_errors=True)
         self.logger.log("WORKFLOW FINISHED - STOPPED MANUALLY")
 
+    def clear_stale_pids(self) -> None:
+        """
+        Removes the pid directory if none of the recorded processes is alive anymore,
+        e.g. after the server running the workflow has been restarted.
+        """
+        if not self.pid_dir.exists():
+            return
+        for f in self.pid_dir.iterdir():
+            try:
+                os.kill(int(f.stem), 0)
+                return
+            except (OSError, ValueError):
+                continue
+        shutil.rmtree(self.pid_dir, ignore_errors=True)
+
     def run_python(self, script_file: str, input_output: dict = {}) -> None:
         """
         Executes a specified Python script with dynamic input and output parameters,
@@ -240,16 +635,11 @@ class CommandExecutor:
                 self.logger.log(f"Script file not found: {script_file}")
                 
         # load DEFAULTS
-        if path.parent not in sys.path:
-            sys.path.append(str(path.parent))
-        spec = importlib.util.spec_from_file_location(path.stem, path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        defaults = getattr(module, "DEFAULTS", None)
+        defaults = self._load_defaults(path)
         if defaults is None:
             self.logger.log(f"WARNING: No DEFAULTS found in {path.name}")
             # run command without params
-            self.run_command(["python", str(path)])
+            self.run_scheduled_command(["python", str(path)])
         elif isinstance(defaults, list):
             defaults = {entry["key"]: entry["value"] for entry in defaults}
             # load paramters from JSON file
@@ -259,11 +649,140 @@ class CommandExecutor:
                 defaults[k.replace(f"{path.name}:", "")] = v
             for k, v in input_output.items():
                 defaults[k] = v
-            # save parameters to temporary JSON file
-            tmp_params_file = Path(self.pid_dir.parent, f"{path.stem}.json")
-            with open(tmp_params_file, "w", encoding="utf-8") as f:
-                json.dump(defaults, f, indent=4)
-            # run command
-            self.run_command(["python", str(path), str(tmp_params_file)])
-            # remove tmp params file
-            tmp_params_file.unlink()
\ No newline at end of file
+            outputs = self._flatten([v for k, v in input_output.items() if k.startswith("out")])
+            # Scripts which process files in a process pool get the number of threads assigned by
+            # the scheduler as "workers" when they start, it does not change the results
+            key_params = {k: v for k, v in defaults.items() if k != "workers"}
+            # Skip the step if it completed in a previous run which is resumed
+            step_inputs = [f for k, v in input_output.items() if not k.startswith("out") for f in self._flatten([v])]
+            step = self._step_key(path.name, key_params, [str(path)], [f for f in step_inputs if f not in outputs])
+            if self.journal is not None and self.journal.skip(step, outputs):
+                self.logger.log(f"Skipping {path.name}, completed in previous run.", 1)
+                return
+            # Restore declared outputs of unchanged script runs from the step cache
+            key = None
+            if self.cache is not None and outputs:
+                # the script and the modules it can import from its directory are inputs as well,
+                # existing output files too, since scripts can update files in place
+                # (scripts must write results to declared outputs, files modified in place are not restored)
+                inputs = self._flatten(list(input_output.values()))
+                inputs += [str(p) for p in path.parent.glob("*.py")]
+                key = self.cache.key(path.name, key_params, [p for p in inputs if Path(p).exists()])
+                if self.cache.restore(key):
+                    self.logger.log(f"Restored from cache: python {path.name}", 1)
+                    if self.journal is not None:
+                        self.journal.record(step, path.name, outputs)
+                    return
+            # parameters are passed in a temporary JSON file, unique for each run of the script
+            # (not in the pid directory, which contains only the pids of running processes)
+            with tempfile.NamedTemporaryFile(
+                dir=self.pid_dir.parent, prefix=f"{path.stem}-", suffix=".json", delete=False
+            ) as f:
+                tmp_params_file = Path(f.name)
+            command = ["python", str(path), str(tmp_params_file)]
+            # input sizes are used to estimate the peak memory of the script
+            input_size = sum(
+                Path(f).stat().st_size
+                for k, v in input_output.items()
+                if not k.startswith("out")
+                for f in self._flatten([v])
+                if Path(f).is_file()
+            )
+
+            def run_script() -> bool:
+                # the process pool of the script is limited to the threads admitted for this job
+                if "workers" in defaults:
+                    defaults["workers"] = self.scheduler.job_threads()
+                # save parameters to temporary JSON file
+                with open(tmp_params_file, "w", encoding="utf-8") as f:
+                    json.dump(defaults, f, indent=4)
+                return self.run_command(command, input_size)
+
+            # run command as soon as the scheduler admits it
+            try:
+                success = self.scheduler.run(
+                    [run_script], [self.memory_model.estimate(self._tool_name(command), input_size)]
+                )[0]
+            finally:
+                # remove tmp params file
+                tmp_params_file.unlink(missing_ok=True)
+            if success:
+                if key is not None:
+                    # scripts export each parquet table as tsv as well, which is restored with it
+                    self.cache.store(
+                        key,
+                        outputs
+                        + [str(Path(o).with_suffix(".tsv")) for o in outputs if Path(o).suffix == ".parquet"],
+                    )
+                if self.journal is not None:
+                    self.journal.record(step, path.name, outputs)
+
+    @staticmethod
+    def _tool_name(command: list[str]) -> str:
+        """
+        Returns the name of the tool executed by a command, Python scripts are identified by script name.
+
+        Args:
+            command (list[str]): The command and its arguments.
+
+        Returns:
+            str: The tool name (e.g. FeatureFinderMetabo or export_consensus_df).
+        """
+        tool = Path(str(command[0])).stem
+        if tool.startswith("python") and len(command) > 1:
+            tool = Path(str(command[1])).stem
+        return tool
+
+    def _load_defaults(self, path: Path) -> list:
+        """
+        Loads the DEFAULTS of a Python script. Literal DEFAULTS are read from the source
+        without executing the script, which would import all its dependencies.
+
+        Args:
+            path (Path): Path to the Python script.
+
+        Returns:
+            list: The DEFAULTS of the script, None if it has none.
+        """
+        try:
+            tree = ast.parse(path.read_text(encoding="utf-8"))
+        except (OSError, SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            assignments = [
+                node.value
+                for node in tree.body
+                if isinstance(node, ast.Assign)
+                and any(isinstance(t, ast.Name) and t.id == "DEFAULTS" for t in node.targets)
+            ]
+            if not assignments:
+                return None
+            try:
+                return ast.literal_eval(assignments[-1])
+            except ValueError:
+                pass
+        # DEFAULTS are computed, import the script
+        if path.parent not in sys.path:
+            sys.path.append(str(path.parent))
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return getattr(module, "DEFAULTS", None)
+
+    def _flatten(self, values: list) -> list[str]:
+        """
+        Flattens (nested) lists of file paths from an input/output dictionary.
+
+        Args:
+            values (list): File paths, lists of file paths or single strings.
+
+        Returns:
+            list[str]: All file paths as strings.
+        """
+        files = []
+        for v in values:
+            if isinstance(v, (list, tuple)):
+                files += self._flatten(v)
+            elif isinstance(v, (str, Path)) and str(v):
+                files.append(str(v))
+        return files
@@ -1,42 +1,161 @@
+import json
+import os
+import threading
+import time
+import weakref
 from pathlib import Path
 
 class Logger:
     """
-    A simple logging class for writing messages to a log file. input_widgetThis class is designed
+    A simple logging class for writing messages to a log file. This class is designed
     to append messages to a log file in the current workflow directory, facilitating
     easy tracking of events, errors, or other significant occurrences in processes called
     during workflow execution.
 
+    Messages are stored with their level in a single JSON lines file. They are buffered
+    in memory and written in batches, so messages logged concurrently by multiple threads
+    do not interleave. A single writer thread per process flushes the buffers of all
+    loggers, it is started with the first buffered message. The text views for each log level ("minimal",
+    "commands and run times" and "all") are derived from this file when reading.
+
     Attributes:
         log_file (Path): The file path of the log file where messages will be written.
     """
+    # Names of the log levels (index is the level), each view contains all messages up to its level
+    LEVELS = ["minimal", "commands and run times", "all"]
+    # Buffered messages are written at least every FLUSH_INTERVAL seconds
+    FLUSH_INTERVAL = 0.5
+    # Loggers flushed by the writer thread of this process (see _register)
+    _registry_lock = threading.Lock()
+    _registry_pid = None
+    _registry = None
+
     def __init__(self, workflow_dir: Path) -> None:
         self.workflow_dir = workflow_dir
+        self.log_file = Path(workflow_dir, "logs", "log.jsonl")
+        self._pid = None
+
+    def __getstate__(self) -> dict:
+        # Buffer, locks and writer thread are created again in the process which logs
+        return {"workflow_dir": self.workflow_dir, "log_file": self.log_file, "_pid": None}
+
+    def _init_process(self) -> None:
+        # Buffer, locks and writer thread belong to the process which logs (the workflow runs in a forked process)
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._buffer = []
+            self._lock = threading.Lock()
+            self._write_lock = threading.Lock()
+            self._registered = False
+
+    @staticmethod
+    def _register(logger: "Logger") -> None:
+        # The writer thread is started once per process (forked processes start their own)
+        with Logger._registry_lock:
+            if Logger._registry_pid != os.getpid():
+                Logger._registry_pid = os.getpid()
+                Logger._registry = weakref.WeakSet()
+                threading.Thread(target=Logger._write_periodically, name="Logger writer", daemon=True).start()
+            Logger._registry.add(logger)
+
+    @staticmethod
+    def _reset_registry() -> None:
+        # The lock might be held by the writer thread of the parent when a process is forked
+        Logger._registry_lock = threading.Lock()
+        Logger._registry_pid = None
+        Logger._registry = None
+
+    @staticmethod
+    def _write_periodically() -> None:
+        while True:
+            time.sleep(Logger.FLUSH_INTERVAL)
+            with Logger._registry_lock:
+                loggers = list(Logger._registry or [])
+            for logger in loggers:
+                logger.flush()
 
     def log(self, message: str, level: int = 0) -> None:
         """
-        Appends a given message to the log file, followed by two newline characters
-        for readability. This method ensures that each logged message is separated
-        for clear distinction in the log file.
+        Adds a given message to the log. Messages with level 0 are written immediately,
+        all others are buffered and written in the next batch.
 
         Args:
             message (str): The message to be logged to the file.
             level (int, optional): The level of importance of the message. Defaults to 0.
         """
-        log_dir = Path(self.workflow_dir, "logs")
-        if not log_dir.exists():
-            log_dir.mkdir()
-        # Write the message to the log file.
+        self._init_process()
+        entry = json.dumps({"time": time.time(), "level": level, "message": message})
+        with self._lock:
+            self._buffer.append(entry)
+        if not self._registered:
+            Logger._register(self)
+            self._registered = True
         if level == 0:
-            with open(Path(log_dir, "minimal.log"), "a", encoding="utf-8") as f:
-                f.write(f"{message}\n\n")
-        if level <= 1:
-            with open(Path(log_dir, "commands-and-run-times.log"), "a", encoding="utf-8") as f:
-                f.write(f"{message}\n\n")
-        if level <= 2:
-            with open(Path(log_dir, "all.log"), "a", encoding="utf-8") as f:
-                f.write(f"{message}\n\n")
-        # log_types = ["minimal", "commands and run times", "tool outputs", "all"]
-        # for i, log_type in enumerate(log_types):
-        #     with open(Path(log_dir, f"{log_type.replace(" ", "-")}.log"), "a", encoding="utf-8") as f:
-        #         f.write(f"{message}\n\n")
\ No newline at end of file
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all buffered messages to the log file.
+        """
+        self._init_process()
+        with self._write_lock:
+            with self._lock:
+                entries = self._buffer
+                self._buffer = []
+            if entries:
+                self.log_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_file, "a", encoding="utf-8") as f:
+                    f.write("\n".join(entries) + "\n")
+
+    def run_id(self) -> str:
+        """
+        Returns an identifier of the current log, which changes when a new workflow run starts a new log.
+
+        Returns:
+            str: The first entry of the log file, empty string if there is no log.
+        """
+        try:
+            with open(self.log_file, "r", encoding="utf-8") as f:
+                return f.readline().strip()
+        except OSError:
+            return ""
+
+    def tail(self, offset: int = 0, level: int = 2) -> tuple[str, int]:
+        """
+        Returns the text view of the messages which have been written after a given position
+        in the log file. Only the newly appended bytes are read.
+
+        Args:
+            offset (int, optional): Position in the log file (bytes) returned by the previous call. Defaults to 0.
+            level (int, optional): The log level, the view contains all messages up to this level. Defaults to 2.
+
+        Returns:
+            tuple[str, int]: The new messages and the position to continue from.
+        """
+        if not self.log_file.exists():
+            return "", 0
+        with open(self.log_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if offset > f.tell():
+                # log file has been replaced
+                offset = 0
+            f.seek(offset)
+            data = f.read()
+        # only complete lines, the last one might currently be written
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].decode("utf-8").split("\n")
+        return "".join(self._format(line, level) for line in lines if line), offset + end
+
+    def _format(self, line: str, level: int) -> str:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # incomplete line, currently being written
+            return ""
+        if entry["level"] > level:
+            return ""
+        return f"{entry['message']}\n\n"
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Logger._reset_registry)
@@ -0,0 +1,114 @@
+import json
+import threading
+from pathlib import Path
+
+
+class MemoryModel:
+    """
+    Estimates the peak memory (RSS) of tool processes from the size of their input files.
+
+    Estimates start from conservative per-tool defaults and are refined with the peak
+    memory which has been measured for previous runs of the same tool. Measurements
+    are stored in a JSON file in the workflow directory and persist between runs.
+
+    The memory per input byte is a high percentile of the measured ratios, so a single
+    outlier does not dominate the estimates. Runs on small inputs are not used for the
+    ratio, their peak memory is mostly the base memory of the process.
+
+    Attributes:
+        history_file (Path): JSON file with recorded input sizes and peak memory per tool.
+        memory_limit (int): Upper limit for estimates in bytes (e.g. the scheduler memory budget), None for no limit.
+    """
+
+    # Base memory of a tool process without any input data (bytes)
+    BASE_MEMORY = 200 * 1024**2
+    # Peak memory per byte of input for tools without recorded history
+    DEFAULT_FACTOR = 2.0
+    TOOL_FACTORS = {
+        "FeatureFinderMetabo": 4.0,
+        "FeatureFinderMetaboIdent": 6.0,
+    }
+    # Number of measurements kept per tool
+    MAX_HISTORY = 50
+    # Measurements with smaller inputs (bytes) are not used to estimate the memory per input byte
+    MIN_INPUT_SIZE = 1024**2
+    # Percentile of the measured memory per input byte used for estimates
+    PERCENTILE = 90
+
+    def __init__(self, history_file: Path, memory_limit: int = None) -> None:
+        self.history_file = Path(history_file)
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._history = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._history is None:
+            self._history = {}
+            if self.history_file.exists():
+                try:
+                    with open(self.history_file, "r", encoding="utf-8") as f:
+                        self._history = json.load(f)
+                except (OSError, ValueError):
+                    self._history = {}
+        return self._history
+
+    def estimate(self, tool: str, input_size: int) -> int:
+        """
+        Estimates the peak memory of a tool for a given input size.
+
+        Args:
+            tool (str): The name of the tool (e.g. FeatureFinderMetabo) or Python script.
+            input_size (int): Total size of the input files in bytes.
+
+        Returns:
+            int: Estimated peak memory in bytes, at most the memory limit.
+        """
+        tool = Path(tool).stem
+        with self._lock:
+            history = self._load().get(tool, [])
+        # Base memory can not be higher than the smallest peak memory observed for this tool
+        base = min([self.BASE_MEMORY] + [rss for _, rss in history])
+        ratios = sorted(
+            (rss - base) / size for size, rss in history if size >= self.MIN_INPUT_SIZE
+        )
+        if ratios:
+            # nearest-rank percentile
+            factor = ratios[max(0, -(-len(ratios) * self.PERCENTILE // 100) - 1)]
+        else:
+            factor = self.TOOL_FACTORS.get(tool, self.DEFAULT_FACTOR)
+        estimate = int(base + factor * input_size)
+        if self.memory_limit:
+            estimate = min(estimate, int(self.memory_limit))
+        return estimate
+
+    def record(self, tool: str, input_size: int, peak_memory: int) -> None:
+        """
+        Records the measured peak memory of a tool run and saves it to the history file.
+
+        Args:
+            tool (str): The name of the tool (e.g. FeatureFinderMetabo) or Python script.
+            input_size (int): Total size of the input files in bytes.
+            peak_memory (int): Measured peak memory in bytes.
+        """
+        if not peak_memory:
+            return
+        tool = Path(tool).stem
+        with self._lock:
+            history = self._load()
+            history[tool] = (history.get(tool, []) + [[int(input_size), int(peak_memory)]])[
+                -self.MAX_HISTORY :
+            ]
+            try:
+                with open(self.history_file, "w", encoding="utf-8") as f:
+                    json.dump(history, f)
+            except OSError:
+                pass
@@ -0,0 +1,271 @@
+import json
+import os
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+
+class PythonWorker:
+    """
+    Warm worker process for running Python scripts (e.g. from src/python-tools) without
+    starting a new Python interpreter for each script.
+
+    The worker is a separate process which imports the heavy libraries used by the
+    scripts (pyOpenMS, pandas, pyarrow) once. Each script runs in a fresh process forked
+    from the worker, so scripts are isolated from each other and from the workflow as
+    with `python script.py`: a crashing script does not affect the worker, the process
+    can be killed via its pid and its own resource usage (CPU times, I/O) is reported.
+    stdout and stderr of the script are passed back to the caller through pipes.
+
+    For each script the worker forks a monitor process, which forks the script process,
+    waits for it to finish and reports its exit status and resource usage. The worker
+    exits as soon as the process which started it closes the connection.
+
+    Attributes:
+        pid_dir (Path): Directory where the pid of the worker process is recorded.
+    """
+    # Modules imported by the worker before it accepts scripts
+    PRELOAD = ["numpy", "pandas", "pyarrow", "pyarrow.parquet", "pyopenms"]
+
+    def __init__(self, pid_dir: Path) -> None:
+        self.pid_dir = Path(pid_dir)
+        self._process = None
+        self._control = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # A running worker belongs to the process which started it, only the configuration is copied
+        return {"pid_dir": self.pid_dir}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["pid_dir"])
+
+    @staticmethod
+    def supported() -> bool:
+        """
+        Checks if the worker can run on this platform. It needs fork and passing file
+        descriptors over Unix sockets, which are not available on Windows.
+
+        Returns:
+            bool: True if the worker can be used.
+        """
+        return os.name == "posix" and hasattr(socket, "send_fds") and hasattr(os, "fork")
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """
+        Starts the worker process. Libraries are imported in the background, scripts
+        submitted in the meantime start as soon as the worker is ready.
+
+        Raises:
+            OSError: If the worker process can not be started.
+        """
+        if self.running:
+            return
+        if not self.supported():
+            raise OSError("Python worker is not supported on this platform.")
+        control, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self._process = subprocess.Popen(
+                ["python", str(Path(__file__)), str(worker_end.fileno())],
+                pass_fds=[worker_end.fileno()],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+            )
+        except OSError:
+            control.close()
+            raise
+        finally:
+            worker_end.close()
+        self._control = control
+        # Record the pid, so that the worker is killed with all other processes of the workflow
+        self.pid_dir.mkdir(parents=True, exist_ok=True)
+        Path(self.pid_dir, str(self._process.pid)).touch()
+
+    def stop(self) -> None:
+        """
+        Stops the worker process. Scripts which are still running are not affected.
+        """
+        if self._process is None:
+            return
+        self._control.close()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        Path(self.pid_dir, str(self._process.pid)).unlink(missing_ok=True)
+        self._process = None
+
+    def run(self, args: List[str]) -> "_ScriptProcess":
+        """
+        Runs a Python script in a process forked from the worker.
+
+        Args:
+            args (List[str]): The script path followed by its command line arguments.
+
+        Returns:
+            _ScriptProcess: The running script with pid, stdout and stderr like a subprocess.Popen object.
+
+        Raises:
+            OSError: If the worker is not running.
+        """
+        if not self.running:
+            raise OSError("Python worker is not running.")
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        reply, reply_worker = socket.socketpair()
+        request = json.dumps({"args": [str(a) for a in args], "cwd": os.getcwd()}).encode()
+        try:
+            with self._lock:
+                socket.send_fds(self._control, [request], [stdout_w, stderr_w, reply_worker.fileno()])
+        except OSError:
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            reply.close()
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+            reply_worker.close()
+        replies = reply.makefile("rb")
+        started = replies.readline()
+        if not started:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            replies.close()
+            reply.close()
+            raise OSError("Python worker did not start the script.")
+        return _ScriptProcess(
+            json.loads(started)["pid"], os.fdopen(stdout_r, "rb"), os.fdopen(stderr_r, "rb"), reply, replies
+        )
+
+    @staticmethod
+    def serve(control_fd: int) -> None:
+        """
+        Main loop of the worker process: imports the libraries and forks a process for each
+        script request until the connection is closed.
+
+        Args:
+            control_fd (int): File descriptor of the connection to the process which started the worker.
+        """
+        control = socket.socket(fileno=control_fd)
+        for module in PythonWorker.PRELOAD:
+            try:
+                __import__(module)
+            except Exception:
+                # scripts report the error if they actually need the module
+                pass
+        # Monitor processes are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        while True:
+            message, fds, _, _ = socket.recv_fds(control, 65536, 3)
+            if not message:
+                break
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork() == 0:
+                control.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                PythonWorker._monitor(json.loads(message), *fds)
+            for fd in fds:
+                os.close(fd)
+
+    @staticmethod
+    def _monitor(request: dict, stdout_fd: int, stderr_fd: int, reply_fd: int) -> None:
+        reply = socket.socket(fileno=reply_fd)
+        pid = os.fork()
+        if pid == 0:
+            reply.close()
+            PythonWorker._execute(request, stdout_fd, stderr_fd)
+        # only the script writes to the pipes, so they are closed when it exits
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        try:
+            reply.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+            _, status, rusage = os.wait4(pid, 0)
+            result = {
+                "status": status,
+                "ru_utime": rusage.ru_utime,
+                "ru_stime": rusage.ru_stime,
+                "ru_maxrss": rusage.ru_maxrss,
+                "ru_inblock": rusage.ru_inblock,
+                "ru_oublock": rusage.ru_oublock,
+            }
+            reply.sendall(json.dumps(result).encode() + b"\n")
+        finally:
+            os._exit(0)
+
+    @staticmethod
+    def _execute(request: dict, stdout_fd: int, stderr_fd: int) -> None:
+        # Same environment as "python script.py args": output, working directory, argv and script directory on sys.path
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        exit_code = 0
+        try:
+            os.chdir(request["cwd"])
+            script = request["args"][0]
+            sys.argv = list(request["args"])
+            sys.path.insert(0, str(Path(script).resolve().parent))
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                exit_code = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exit_code)
+
+
+class _ScriptProcess:
+    """A script running in a process forked from the Python worker, with the attributes of subprocess.Popen used by the CommandExecutor."""
+
+    def __init__(self, pid, stdout, stderr, reply, replies) -> None:
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self._reply = reply
+        self._replies = replies
+
+    def wait4(self) -> tuple:
+        """
+        Waits for the script to finish.
+
+        Returns:
+            tuple: pid, wait status and resource usage of the script process, like os.wait4.
+        """
+        line = self._replies.readline()
+        self._replies.close()
+        self._reply.close()
+        if not line:
+            # monitor process has been killed, report the script as killed
+            return self.pid, signal.SIGKILL, SimpleNamespace(
+                ru_utime=None, ru_stime=None, ru_maxrss=None, ru_inblock=None, ru_oublock=None
+            )
+        result = json.loads(line)
+        return self.pid, result.pop("status"), SimpleNamespace(**result)
+
+
+if __name__ == "__main__":
+    PythonWorker.serve(int(sys.argv[1]))
@@ -0,0 +1,181 @@
+import os
+import threading
+from typing import Any, Callable, List
+
+
+def available_memory() -> int:
+    """
+    Returns the memory available for new processes in bytes.
+
+    Uses MemAvailable from /proc/meminfo (Linux), falls back to the total physical memory.
+
+    Returns:
+        int: Available memory in bytes, None if it can not be determined.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class Scheduler:
+    """
+    Runs batches of jobs (e.g. TOPP tool commands) on a bounded pool of worker threads.
+
+    The scheduler limits how many jobs run at the same time and splits a thread budget
+    across the jobs running concurrently, so that a batch of commands fully uses the
+    machine without oversubscribing the CPU cores. Each job is assigned a share of the
+    threads which are not used by other running jobs (see `job_threads`) when it starts,
+    including jobs of other batches running at the same time. Jobs can come with an estimate of
+    their peak memory: new jobs are only admitted while the memory reserved by all
+    running jobs stays within the memory budget. A single job is always admitted if
+    nothing else is running. Limits are shared by all batches running at the same time.
+    Subclass and override `run` to plug in a different scheduling strategy.
+
+    Attributes:
+        max_workers (int): Maximum number of jobs running in parallel. Defaults to the number of CPU cores.
+        threads (int): Total number of threads shared by all jobs running in parallel. Defaults to the number of CPU cores.
+        memory_budget (int): Maximum memory in bytes reserved by running jobs. Defaults to the available memory.
+    """
+
+    def __init__(
+        self, max_workers: int = None, threads: int = None, memory_budget: int = None
+    ) -> None:
+        cpu_count = os.cpu_count() or 1
+        self.max_workers = max(1, int(max_workers)) if max_workers else cpu_count
+        self.threads = max(1, int(threads)) if threads else cpu_count
+        self.memory_budget = int(memory_budget) if memory_budget else available_memory()
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self._running = 0
+        self._reserved_memory = 0
+        self._reserved_threads = 0
+
+    def __getstate__(self) -> dict:
+        # Conditions can not be pickled (e.g. workflow processes started with "spawn"), jobs are not copied
+        state = self.__dict__.copy()
+        del state["_condition"]
+        del state["_local"]
+        state["_running"] = 0
+        state["_reserved_memory"] = 0
+        state["_reserved_threads"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+    def n_parallel(self, n_jobs: int, max_parallel: int = None) -> int:
+        """
+        Returns the number of jobs which will run at the same time for a batch of jobs.
+
+        Args:
+            n_jobs (int): The number of jobs in the batch.
+            max_parallel (int, optional): Additional limit of parallel jobs for this batch. Defaults to None.
+
+        Returns:
+            int: Number of concurrently running jobs.
+        """
+        n = min(n_jobs, self.max_workers)
+        if max_parallel:
+            n = min(n, int(max_parallel))
+        return max(1, n)
+
+    def job_threads(self) -> int:
+        """
+        Returns the number of threads assigned to the job running in the calling thread.
+
+        Returns:
+            int: Number of threads for the job (at least 1), the whole thread budget if called outside of a job.
+        """
+        return getattr(self._local, "threads", self.threads)
+
+    def _assign_threads(self, n_jobs: int, batch: dict) -> int:
+        # Split the free threads across the jobs of this batch which can start now
+        slots = self.max_workers - self._running
+        if batch["max_parallel"]:
+            slots = min(slots, batch["max_parallel"] - batch["running"])
+        slots = max(1, min(slots, n_jobs))
+        return max(1, (self.threads - self._reserved_threads) // slots)
+
+    def _can_admit(self, memory: int, batch: dict) -> bool:
+        if self._running >= self.max_workers:
+            return False
+        if batch["max_parallel"] and batch["running"] >= batch["max_parallel"]:
+            return False
+        if self._running == 0 or not self.memory_budget:
+            return True
+        return self._reserved_memory + memory <= self.memory_budget
+
+    def _execute(
+        self, job: Callable[[], Any], memory: int, threads: int, batch: dict, results: list, i: int
+    ) -> None:
+        self._local.threads = threads
+        try:
+            results[i] = (job(), None)
+        except BaseException as e:
+            results[i] = (None, e)
+        finally:
+            with self._condition:
+                self._running -= 1
+                batch["running"] -= 1
+                self._reserved_memory -= memory
+                self._reserved_threads -= threads
+                self._condition.notify_all()
+
+    def run(
+        self,
+        jobs: List[Callable[[], Any]],
+        memory: List[int] = None,
+        max_parallel: int = None,
+    ) -> List[Any]:
+        """
+        Runs all jobs within the worker and memory limits and waits for them to finish.
+
+        Jobs are started in order, each one as soon as it fits into the limits. The
+        number of threads a job may use is available in the job via `job_threads`.
+
+        Args:
+            jobs (List[Callable[[], Any]]): Functions without arguments, one per job.
+            memory (List[int], optional): Estimated peak memory in bytes for each job. Defaults to no memory requirements.
+            max_parallel (int, optional): Maximum number of jobs of this batch running at the same time,
+                                          in addition to the scheduler limits. Defaults to None.
+
+        Returns:
+            List[Any]: The return values of the jobs, in the same order as the jobs.
+
+        Raises:
+            Exception: The first exception raised by any of the jobs, after all jobs have finished.
+        """
+        if memory is None:
+            memory = [0] * len(jobs)
+        results = [None] * len(jobs)
+        batch = {"running": 0, "max_parallel": max_parallel}
+        threads = []
+        for i, (job, mem) in enumerate(zip(jobs, memory)):
+            with self._condition:
+                self._condition.wait_for(lambda: self._can_admit(mem, batch))
+                n_threads = self._assign_threads(len(jobs) - i, batch)
+                self._running += 1
+                batch["running"] += 1
+                self._reserved_memory += mem
+                self._reserved_threads += n_threads
+            thread = threading.Thread(
+                target=self._execute, args=(job, mem, n_threads, batch, results, i)
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        for _, error in results:
+            if error is not None:
+                raise error
+        return [result for result, _ in results]
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Union
+
+
+class StepCache:
+    """
+    Content-addressed cache for the outputs of workflow steps (TOPP tools and Python scripts).
+
+    Each step is identified by a key, which is a hash of the tool name, the effective
+    parameters and the content of all input files. After a step ran successfully, its
+    output files are copied into the cache. If a step with the same key is executed
+    again, the outputs are restored from the cache instead of re-computing them.
+
+    File digests are remembered by path, size and modification time, so unchanged files
+    are hashed only once.
+
+    The total size of the cached outputs can be limited, the least recently used
+    entries are removed when a new entry exceeds the limit.
+
+    Attributes:
+        cache_dir (Path): Directory where cached outputs and file digests are stored.
+        max_size (int): Maximum total size of the cached outputs in bytes, None for no limit.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = None) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self._digests_file = Path(self.cache_dir, "digests.json")
+        self._digests = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _file_digest(self, path: Path) -> str:
+        stat = path.stat()
+        with self._lock:
+            if self._digests is None:
+                try:
+                    with open(self._digests_file, "r", encoding="utf-8") as f:
+                        self._digests = json.load(f)
+                except (OSError, ValueError):
+                    self._digests = {}
+            entry = self._digests.get(str(path.resolve()))
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[str(path.resolve())] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._digests_file, "w", encoding="utf-8") as f:
+                json.dump(self._digests, f)
+        return digest
+
+    def digest(self, path: Union[str, Path]) -> str:
+        """
+        Returns the SHA-256 digest of a file or of all files within a directory.
+
+        Args:
+            path (Union[str, Path]): Path to a file or directory.
+
+        Returns:
+            str: The hex digest, empty string if the path does not exist.
+        """
+        path = Path(path)
+        if path.is_file():
+            return self._file_digest(path)
+        if path.is_dir():
+            h = hashlib.sha256()
+            for f in sorted(p for p in path.rglob("*") if p.is_file()):
+                h.update(f"{f.relative_to(path).as_posix()}:{self._file_digest(f)}\n".encode())
+            return h.hexdigest()
+        return ""
+
+    def key(self, name: str, params: Any, inputs: List[Union[str, Path]]) -> str:
+        """
+        Computes the cache key for a step.
+
+        Args:
+            name (str): The name of the tool or script.
+            params (Any): The effective parameters (JSON serializable), e.g. the command line.
+            inputs (List[Union[str, Path]]): Input files and directories, identified by their content.
+
+        Returns:
+            str: The cache key.
+        """
+        content = {
+            "name": name,
+            "params": params,
+            "inputs": {str(p): self.digest(p) for p in sorted(set(str(p) for p in inputs))},
+        }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def restore(self, key: str) -> bool:
+        """
+        Restores the outputs of a step from the cache.
+
+        Args:
+            key (str): The cache key of the step.
+
+        Returns:
+            bool: True if the outputs were restored, False if the step is not cached.
+        """
+        entry_dir = Path(self.cache_dir, key)
+        try:
+            with open(Path(entry_dir, "manifest.json"), "r", encoding="utf-8") as f:
+                outputs = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not all(Path(entry_dir, stored).is_file() for stored in outputs.values()):
+            return False
+        for path, stored in outputs.items():
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(Path(entry_dir, stored), path)
+        self._touch(entry_dir)
+        return True
+
+    def store(self, key: str, outputs: List[Union[str, Path]]) -> None:
+        """
+        Copies the outputs of a step into the cache.
+
+        Args:
+            key (str): The cache key of the step.
+            outputs (List[Union[str, Path]]): Output files and directories of the step.
+        """
+        entry_dir = Path(self.cache_dir, key)
+        if entry_dir.exists():
+            return
+        files = []
+        for path in [Path(p) for p in outputs]:
+            if path.is_dir():
+                files += sorted(p for p in path.rglob("*") if p.is_file())
+            elif path.is_file():
+                files.append(path)
+        files = list(dict.fromkeys(files))
+        if self.max_size and sum(f.stat().st_size for f in files) > self.max_size:
+            # would evict everything else and still not fit
+            return
+        # Write to a temporary directory first, an entry is only valid once complete
+        tmp_dir = Path(self.cache_dir, f"{key}.tmp-{threading.get_ident()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        manifest = {}
+        for i, f in enumerate(files):
+            shutil.copy2(f, Path(tmp_dir, str(i)))
+            manifest[str(f)] = str(i)
+        with open(Path(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        self._touch(tmp_dir)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # Another process stored the same step in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if self.max_size:
+            self._evict(key)
+
+    def _touch(self, entry_dir: Path) -> None:
+        # The modification time of the manifest is the last use of an entry (with the precise clock,
+        # file timestamps set by the file system are coarse)
+        now = time.time_ns()
+        os.utime(Path(entry_dir, "manifest.json"), ns=(now, now))
+
+    def _evict(self, keep: str) -> None:
+        """
+        Removes the least recently used entries until the cache fits into the size limit.
+
+        Args:
+            keep (str): Key of the entry which has just been stored, it is not removed.
+        """
+        with self._lock:
+            entries = []
+            for entry_dir in self.cache_dir.iterdir():
+                manifest = Path(entry_dir, "manifest.json")
+                if not entry_dir.is_dir() or not manifest.is_file():
+                    # files of the cache itself or entries currently being written
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                    entries.append((manifest.stat().st_mtime_ns, size, entry_dir))
+                except OSError:
+                    # removed in the meantime
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry_dir in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_size:
+                    break
+                if entry_dir.name == keep:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
@@ -0,0 +1,85 @@
+import threading
+from typing import Callable, List
+
+
+class StepGraph:
+    """
+    Runs workflow steps according to their dependencies.
+
+    Steps are functions without arguments (e.g. a branch of TOPP tool and Python script
+    calls) which are added with the names of the steps they depend on. A step is started
+    as soon as all its dependencies finished successfully, so independent branches of a
+    workflow run at the same time. Each step runs in its own thread; the commands executed
+    within the steps still share the worker and memory limits of the scheduler. If a step
+    fails, the steps depending on it are not executed.
+    """
+
+    def __init__(self) -> None:
+        self._steps = {}
+        self._condition = threading.Condition()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._steps
+
+    def add(self, name: str, function: Callable[[], None], depends_on: List[str] = []) -> None:
+        """
+        Adds a step to the graph.
+
+        Args:
+            name (str): Unique name of the step.
+            function (Callable[[], None]): The function executing the step.
+            depends_on (List[str], optional): Names of the steps which need to finish before this step starts. Defaults to [].
+
+        Raises:
+            ValueError: If the name is already taken or a dependency is not part of the graph.
+        """
+        if name in self._steps:
+            raise ValueError(f"Step {name} has already been added.")
+        for dependency in depends_on:
+            if dependency not in self._steps:
+                raise ValueError(f"Step {name} depends on unknown step {dependency}.")
+        self._steps[name] = (function, list(depends_on))
+
+    def _execute(self, name: str, function: Callable[[], None], state: dict, errors: list) -> None:
+        try:
+            function()
+            result = "done"
+        except BaseException as e:
+            errors.append(e)
+            result = "failed"
+        with self._condition:
+            state[name] = result
+            self._condition.notify_all()
+
+    def run(self) -> None:
+        """
+        Runs all steps and waits for them to finish.
+
+        Raises:
+            Exception: The first exception raised by any of the steps, after all remaining steps have finished.
+        """
+        # state of each step: "waiting", "running", "done", "failed" or "skipped"
+        state = {name: "waiting" for name in self._steps}
+        errors = []
+        threads = []
+        with self._condition:
+            while True:
+                for name, (function, depends_on) in self._steps.items():
+                    if state[name] != "waiting":
+                        continue
+                    if any(state[d] in ("failed", "skipped") for d in depends_on):
+                        state[name] = "skipped"
+                    elif all(state[d] == "done" for d in depends_on):
+                        state[name] = "running"
+                        thread = threading.Thread(
+                            target=self._execute, args=(name, function, state, errors)
+                        )
+                        thread.start()
+                        threads.append(thread)
+                if not any(s in ("waiting", "running") for s in state.values()):
+                    break
+                self._condition.wait()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Union
+
+
+class StepJournal:
+    """
+    Persistent record of the workflow steps which completed successfully.
+
+    Every completed step (a TOPP tool or Python script call) is appended as one JSON line
+    to the journal file in the workflow directory, together with its output files and their
+    size and modification time. Since each line is written as soon as the step finished,
+    the journal survives stopped workflows and server restarts. When a workflow is resumed,
+    steps are skipped as long as they are recorded in the journal with identical definition
+    (including the size and modification time of their inputs, see `digests`) and their
+    outputs have not changed since. From the first incomplete step of a branch on, all
+    remaining steps of this branch are executed again. Branches running in other threads
+    (e.g. steps of a StepGraph) are not affected, steps depending on re-created files are
+    executed again since their inputs changed.
+
+    Attributes:
+        journal_file (Path): JSON lines file with one entry per completed step.
+        resuming (bool): Whether completed steps of the current run can be skipped.
+    """
+
+    def __init__(self, journal_file: Path) -> None:
+        self.journal_file = Path(journal_file)
+        self.resuming = False
+        self._steps = {}
+        self._lock = threading.Lock()
+        # Branches (threads) which stopped skipping steps
+        self._branch = threading.local()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        del state["_branch"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._branch = threading.local()
+
+    @staticmethod
+    def digests(files: List[Union[str, Path]]) -> dict:
+        """
+        Returns the size and modification time of files, which change when a file is re-created.
+
+        Args:
+            files (List[Union[str, Path]]): The files.
+
+        Returns:
+            dict: [size, modification time (ns)] for each file path, None for files which do not exist.
+        """
+        result = {}
+        for f in files:
+            try:
+                stat = os.stat(str(f))
+                result[str(f)] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                result[str(f)] = None
+        return result
+
+    def _load(self) -> dict:
+        steps = {}
+        if self.journal_file.exists():
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # incomplete last line of an interrupted write
+                        continue
+                    steps[entry["step"]] = entry
+        return steps
+
+    def exists(self) -> bool:
+        """
+        Checks if there are completed steps which a workflow run could resume from.
+
+        Returns:
+            bool: True if the journal contains at least one completed step.
+        """
+        return self.journal_file.exists() and self.journal_file.stat().st_size > 0
+
+    def start(self, resume: bool = False) -> None:
+        """
+        Prepares the journal for a new workflow run.
+
+        Args:
+            resume (bool, optional): Skip steps completed in the previous run. If False, the journal is cleared. Defaults to False.
+        """
+        with self._lock:
+            if resume:
+                self._steps = self._load()
+            else:
+                self._steps = {}
+                self.journal_file.unlink(missing_ok=True)
+            self.resuming = resume
+            self._branch = threading.local()
+
+    def skip(self, step: str, outputs: List[Union[str, Path]]) -> bool:
+        """
+        Checks if a step can be skipped, because it completed in the run which is resumed.
+
+        The first step which can not be skipped ends the resume phase of the branch
+        (thread) it belongs to, all following steps of this branch will be executed.
+
+        Args:
+            step (str): Unique key for the step definition (tool, parameters and input digests).
+            outputs (List[Union[str, Path]]): Output files of the step.
+
+        Returns:
+            bool: True if the step completed before and all its outputs exist unchanged.
+        """
+        if getattr(self._branch, "stopped", False):
+            return False
+        with self._lock:
+            if not self.resuming:
+                return False
+            entry = self._steps.get(step)
+        if entry is not None:
+            recorded = entry.get("digests", {})
+            files = list(dict.fromkeys([str(p) for p in outputs] + entry["outputs"]))
+            current = self.digests(files)
+            if all(current[p] is not None and recorded.get(p, current[p]) == current[p] for p in files):
+                return True
+        self._branch.stopped = True
+        return False
+
+    def record(self, step: str, name: str, outputs: List[Union[str, Path]]) -> None:
+        """
+        Records a successfully completed step.
+
+        Args:
+            step (str): Unique key for the step definition (tool and parameters).
+            name (str): Name of the tool or script.
+            outputs (List[Union[str, Path]]): Output files of the step.
+        """
+        entry = {
+            "step": step,
+            "name": name,
+            "outputs": [str(p) for p in outputs],
+            "digests": self.digests(outputs),
+            "time": time.time(),
+        }
+        with self._lock:
+            self._steps[step] = entry
+            self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
@@ -6,12 +6,13 @@ import subprocess
 from typing import Any, Union, List, Literal
 import json
 import os
+import pandas as pd
 import sys
 import importlib.util
-import time
 from io import BytesIO
 import zipfile
 from datetime import datetime
+from collections import deque
 from streamlit_js_eval import streamlit_js_eval
 
 
@@ -993,46 +994,117 @@ class StreamlitUI:
         c1, c2 = st.columns(2)
         # Select log level, this can be changed at run time or later without re-running the workflow
         log_level = c1.selectbox(
-            "log details", ["minimal", "commands and run times", "all"], key="log_level"
+            "log details", self.logger.LEVELS, key="log_level"
         )
+        # Processes of a workflow can be gone without notice (e.g. server restart)
+        self.executor.clear_stale_pids()
         if self.executor.pid_dir.exists():
             if c1.button("Stop Workflow", type="primary", use_container_width=True):
                 self.executor.stop()
                 st.rerun()
-        elif c1.button("Start Workflow", type="primary", use_container_width=True):
-            start_workflow_function()
-            st.rerun()
-        log_path = Path(self.workflow_dir, "logs", log_level.replace(" ", "-") + ".log")
+        else:
+            if c1.button("Start Workflow", type="primary", use_container_width=True):
+                start_workflow_function()
+                st.rerun()
+            # Continue a stopped or interrupted run from the first incomplete step
+            if self.executor.journal is not None and self.executor.journal.exists():
+                if c1.button(
+                    "Resume Workflow",
+                    use_container_width=True,
+                    help="Continue the previous run from the first incomplete step, keeping existing results.",
+                ):
+                    start_workflow_function(resume=True)
+                    st.rerun()
+        self.resource_usage()
+        log_path = self.logger.log_file
         if log_path.exists():
             if self.executor.pid_dir.exists():
-                with st.spinner("**Workflow running...**"):
-                    with open(log_path, "r", encoding="utf-8") as f:
-                        content = f.readlines()
-                        if len(content) > 500:
-                            content = "".join(content[-500:])
-                        else:
-                            content = "".join(content)
-                        st.code(
-                            content,
-                            language="neon",
-                            line_numbers=False,
-                        )
-                    time.sleep(2)
-                st.rerun()
+                self.running_log(self.logger.LEVELS.index(log_level))
             else:
                 st.markdown(
                     f"**Workflow log file: {datetime.fromtimestamp(log_path.stat().st_ctime).strftime('%Y-%m-%d %H:%M')} CET**"
                 )
-                with open(log_path, "r", encoding="utf-8") as f:
-                    content = f.readlines()
-                    if len(content) > 500:
-                        content = "".join(content[-500:])
-                    else:
-                        content = "".join(content)
-                    # Check if workflow finished successfully
-                    if not "WORKFLOW FINISHED" in content:
-                        st.error("**Errors occurred, check log file.**")
-                    st.code(content, language="neon", line_numbers=False)
+                content = self.log_tail(self.logger.LEVELS.index(log_level))
+                # Check if workflow finished successfully
+                if not "WORKFLOW FINISHED" in content:
+                    st.error("**Errors occurred, check log file.**")
+                st.code(content, language="neon", line_numbers=False)
+
+    @st.fragment(run_every=2)
+    def running_log(self, level: int) -> None:
+        """
+        Shows the log of the running workflow, updated every 2 seconds without re-running the whole page.
+
+        Args:
+            level (int): The log level to show.
+        """
+        if not self.executor.pid_dir.exists():
+            # Workflow finished, show results and controls
+            st.rerun()
+        st.markdown("**Workflow running...**")
+        st.code(self.log_tail(level), language="neon", line_numbers=False)
+
+    def log_tail(self, level: int, max_lines: int = 500) -> str:
+        """
+        Returns the last lines of the workflow log. Only messages appended since the
+        previous call in this session are read from the log file.
+
+        Args:
+            level (int): The log level.
+            max_lines (int, optional): Maximum number of lines to return. Defaults to 500.
+
+        Returns:
+            str: The last lines of the log.
+        """
+        key = f"log-tail-{self.workflow_dir}-{level}"
+        run_id = self.logger.run_id()
+        state = st.session_state.get(key)
+        # Start over if a new workflow run created a new log
+        if state is None or state["run"] != run_id:
+            state = {"run": run_id, "offset": 0, "lines": deque(maxlen=max_lines)}
+            st.session_state[key] = state
+        text, state["offset"] = self.logger.tail(state["offset"], level)
+        state["lines"].extend(text.splitlines(keepends=True))
+        return "".join(state["lines"])
+
+    def resource_usage(self) -> None:
+        """
+        Shows wall time, CPU time, peak memory and I/O of the executed commands, summarised per tool.
+        """
+        metrics_file = self.executor.metrics_file
+        if not metrics_file.exists():
+            return
+        with open(metrics_file, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.endswith("\n")]
+        if not records:
+            return
+        df = pd.DataFrame(records)
+        df["cpu"] = df["user"].fillna(0) + df["sys"].fillna(0)
+        MB = 1024**2
+        summary = df.groupby("tool", sort=False).agg(
+            runs=("tool", "size"),
+            failed=("returncode", lambda x: int((x != 0).sum())),
+            wall=("wall", "sum"),
+            cpu=("cpu", "sum"),
+            peak_rss=("peak_rss", "max"),
+            read=("block_read_bytes", "sum"),
+            written=("block_write_bytes", "sum"),
+        )
+        summary["peak_rss"] = summary["peak_rss"] / MB
+        summary["read"] = summary["read"] / MB
+        summary["written"] = summary["written"] / MB
+        with st.expander("**Resource usage**"):
+            st.dataframe(
+                summary,
+                use_container_width=True,
+                column_config={
+                    "wall": st.column_config.NumberColumn("wall time (s)", format="%.1f"),
+                    "cpu": st.column_config.NumberColumn("CPU time (s)", format="%.1f", help="user + system CPU time of all runs"),
+                    "peak_rss": st.column_config.NumberColumn("peak memory (MB)", format="%.0f", help="highest peak memory (RSS) of a single run"),
+                    "read": st.column_config.NumberColumn("block device read (MB)", format="%.1f", help="read from disk, files in the page cache are not counted"),
+                    "written": st.column_config.NumberColumn("block device written (MB)", format="%.1f", help="written to disk, files in the page cache are not counted"),
+                },
+            )
 
     def results_section(self, custom_results_function) -> None:
         custom_results_function()
@@ -2,6 +2,10 @@ from pathlib import Path
 from .Logger import Logger
 from .ParameterManager import ParameterManager
 from .CommandExecutor import CommandExecutor
+from .Scheduler import Scheduler
+from .StepCache import StepCache
+from .StepJournal import StepJournal
+from .PythonWorker import PythonWorker
 from .StreamlitUI import StreamlitUI
 from .FileManager import FileManager
 import multiprocessing
@@ -17,39 +21,84 @@ class WorkflowManager:
         self.file_manager = FileManager(self.workflow_dir)
         self.logger = Logger(self.workflow_dir)
         self.parameter_manager = ParameterManager(self.workflow_dir)
-        self.executor = CommandExecutor(self.workflow_dir, self.logger, self.parameter_manager)
+        # Max. number of parallel processes and memory budget (GB) can be set in settings.json
+        # (defaults to number of CPU cores and available memory)
+        settings = st.session_state.get("settings", {})
+        memory_budget = settings.get("memory-budget-gb", None)
+        self.scheduler = Scheduler(
+            max_workers=settings.get("max-parallel-jobs", None),
+            memory_budget=int(memory_budget * 1024**3) if memory_budget else None,
+        )
+        # Outputs of workflow steps are cached per workspace and restored if inputs and parameters did not change
+        # (the least recently used outputs are removed above step-cache-size-gb)
+        cache_size = settings.get("step-cache-size-gb", 20)
+        self.cache = (
+            StepCache(Path(workspace, "step-cache"), int(cache_size * 1024**3) if cache_size else None)
+            if settings.get("step-cache", True)
+            else None
+        )
+        # Completed steps are recorded, so interrupted workflow runs can be resumed
+        self.journal = StepJournal(Path(self.workflow_dir, "step-journal.jsonl"))
+        # Python scripts are forked from a warm worker process instead of starting a new interpreter each time (POSIX only)
+        self.python_worker = (
+            PythonWorker(Path(self.workflow_dir, "pids"))
+            if settings.get("python-worker", True) and PythonWorker.supported()
+            else None
+        )
+        self.executor = CommandExecutor(self.workflow_dir, self.logger, self.parameter_manager, self.scheduler, self.cache, self.journal, self.python_worker)
         self.ui = StreamlitUI(self.workflow_dir, self.logger, self.executor, self.parameter_manager)
         self.params = self.parameter_manager.get_parameters_from_json()
 
-    def start_workflow(self) -> None:
+    def start_workflow(self, resume: bool = False) -> None:
         """
         Starts the workflow process and adds its process id to the pid directory.
         The workflow itself needs to be a process, otherwise streamlit will wait for everything to finish before updating the UI again.
+
+        Args:
+            resume (bool, optional): Continue the previous run from the first incomplete step, keeping results and logs. Defaults to False.
         """
         # Delete the log file if it already exists
-        shutil.rmtree(Path(self.workflow_dir, "logs"), ignore_errors=True)
+        if not resume:
+            shutil.rmtree(Path(self.workflow_dir, "logs"), ignore_errors=True)
         # Start workflow process
-        workflow_process = multiprocessing.Process(target=self.workflow_process)
+        workflow_process = multiprocessing.Process(target=self.workflow_process, args=(resume,))
         workflow_process.start()
         # Add workflow process id to pid dir
-        self.executor.pid_dir.mkdir()
+        self.executor.pid_dir.mkdir(parents=True, exist_ok=True)
         Path(self.executor.pid_dir, str(workflow_process.pid)).touch()
         st.rerun()
 
-    def workflow_process(self) -> None:
+    def workflow_process(self, resume: bool = False) -> None:
         """
         Workflow process. Logs start and end of the workflow and calls the execution method where all steps are defined.
+
+        Args:
+            resume (bool, optional): Skip steps completed in the previous run and keep its results. Defaults to False.
         """
         try:
-            self.logger.log("STARTING WORKFLOW")
+            if self.python_worker is not None:
+                try:
+                    self.python_worker.start()
+                except Exception as e:
+                    # scripts are run in new interpreters instead
+                    self.logger.log(f"WARNING: Python worker could not be started: {e}")
+            self.journal.start(resume)
             results_dir = Path(self.workflow_dir, "results")
-            if results_dir.exists():
-                shutil.rmtree(results_dir)
-            results_dir.mkdir(parents=True)
+            if resume:
+                self.logger.log("RESUMING WORKFLOW")
+            else:
+                self.logger.log("STARTING WORKFLOW")
+                if results_dir.exists():
+                    shutil.rmtree(results_dir)
+            results_dir.mkdir(parents=True, exist_ok=True)
             self.execution()
             self.logger.log("WORKFLOW FINISHED")
         except Exception as e:
             self.logger.log(f"ERROR: {e}")
+        if self.python_worker is not None:
+            self.python_worker.stop()
+        # Write remaining log messages before the workflow is shown as done
+        self.logger.flush()
         # Delete pid dir path to indicate workflow is done
         shutil.rmtree(self.executor.pid_dir, ignore_errors=True)
 
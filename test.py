@@ -1,8 +1,1161 @@
+import csv
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import textwrap
+import threading
+import time
 import unittest
+from pathlib import Path
+
+import numpy as np
+
+
+def load_python_tool(name):
+    # scripts import shared modules from their directory, like when they are executed
+    tools_dir = str(Path(Path(__file__).parent, "src", "python-tools"))
+    if tools_dir not in sys.path:
+        sys.path.insert(0, tools_dir)
+    spec = importlib.util.spec_from_file_location(name, Path(tools_dir, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
 
 class TestDummy(unittest.TestCase):
     def test_dummy(self):
         self.assertEqual(1, 1)
 
+
+class TestMetaboliteLabels(unittest.TestCase):
+    def setUp(self):
+        self.labels = load_python_tool("metabolite_labels")
+        rng = np.random.default_rng(42)
+        n = 20000
+        edge_cases = [0.0, -0.0, 2.675, 1.00005, 0.125, -12.34565, 1e-7, 1e17, np.nan, np.inf]
+        self.mz = np.concatenate(
+            [
+                rng.uniform(50, 2000, n),
+                # values on the rounding boundaries of 4 decimals
+                np.round(rng.uniform(50, 2000, n), 4) + 5e-5,
+                edge_cases,
+            ]
+        )
+        self.rt = np.concatenate(
+            [
+                rng.uniform(0, 1500, n),
+                # values on the rounding boundaries of 2 decimals
+                np.round(rng.uniform(0, 1500, n), 2) + 0.005,
+                edge_cases[::-1],
+            ]
+        )
+        self.adduct = np.array(["[M+H]+", "[M+Na]+", "[M-H2O+H]+", None, np.nan] * (len(self.mz) // 5), dtype=object)
+
+    def test_labels_with_adduct(self):
+        expected = [
+            f"{round(mz, 4)}@{round(rt, 2)}@{adduct}"
+            for mz, rt, adduct in zip(self.mz.tolist(), self.rt.tolist(), self.adduct.tolist())
+        ]
+        self.assertEqual(list(self.labels.metabolite_labels(self.mz, self.rt, self.adduct)), expected)
+
+    def test_labels_without_adduct(self):
+        expected = [f"{round(mz, 4)}@{round(rt, 2)}" for mz, rt in zip(self.mz.tolist(), self.rt.tolist())]
+        self.assertEqual(list(self.labels.metabolite_labels(self.mz, self.rt)), expected)
+
+    def test_labels_empty(self):
+        self.assertEqual(len(self.labels.metabolite_labels([], [], [])), 0)
+
+    def test_neutral_mass(self):
+        charge = np.random.default_rng(42).integers(-3, 4, len(self.mz))
+        expected = [
+            mz * c - c * 1.007825 if c else mz - 1.007825
+            for mz, c in zip(self.mz.tolist(), charge.tolist())
+        ]
+        np.testing.assert_array_equal(self.labels.neutral_mass(self.mz, charge), expected)
+
+
+class TestMS1Annotation(unittest.TestCase):
+    def test_matches_row_by_row_annotation(self):
+        import pandas as pd
+
+        annotation = load_python_tool("ms1_annotation")
+        rng = np.random.default_rng(42)
+        n = 300
+        df = pd.DataFrame(
+            {
+                "mz": np.round(rng.uniform(100, 110, n), 3),
+                "RT": rng.uniform(0, 600, n),
+                # some metabolites with more than one feature (e.g. adducts)
+                "metabolite": [f"m{i}" for i in rng.integers(0, 250, n)],
+            }
+        )
+        library = pd.DataFrame(
+            {
+                "name": [f"compound{i}" for i in range(100)],
+                "mz": np.concatenate([df["mz"].to_numpy()[:60], rng.uniform(100, 110, 40)]),
+                "RT": rng.uniform(0, 600, 100),
+            }
+        )
+        mz_tolerance, rt_window = 10, 120
+        # reference: one query per library compound, as originally implemented in annotate-ms1
+        expected = df.copy()
+        expected["MS1 annotation"] = ""
+        for _, std in library.iterrows():
+            delta_Da = abs(mz_tolerance * std["mz"] / 1000000)
+            match = expected[
+                (expected["mz"] > std["mz"] - delta_Da)
+                & (expected["mz"] < std["mz"] + delta_Da)
+                & (expected["RT"] > std["RT"] - rt_window / 2)
+                & (expected["RT"] < std["RT"] + rt_window / 2)
+            ]
+            for _, row in match.iterrows():
+                group = expected["metabolite"] == row["metabolite"]
+                if group.sum() > 1:
+                    expected.loc[group, "MS1 annotation"] += ";" + std["name"]
+                else:
+                    expected.loc[group, "MS1 annotation"] += std["name"]
+        result = annotation.ms1_annotations(
+            df["mz"], df["RT"], df["metabolite"], library, mz_tolerance, rt_window
+        )
+        self.assertGreater((expected["MS1 annotation"] != "").sum(), 0)
+        self.assertEqual(list(result), expected["MS1 annotation"].tolist())
+
+
+class TestConsensusDf(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.export = load_python_tool("export_consensus_df")
+
+    def consensus_map(self, meta_values=True):
+        import pyopenms as poms
+
+        rng = np.random.default_rng(42)
+        consensus_map = poms.ConsensusMap()
+        headers = {}
+        for i in range(3):
+            header = poms.ColumnHeader()
+            header.filename = str(Path(self.dir.name, f"sample{i}.mzML"))
+            Path(header.filename).touch()
+            header.size = 10
+            headers[i] = header
+        consensus_map.setColumnHeaders(headers)
+        for i in range(10):
+            cf = poms.ConsensusFeature()
+            cf.setUniqueId(int(rng.integers(0, 2**63)))
+            cf.setRT(rng.uniform(0, 600))
+            cf.setMZ(rng.uniform(100, 1000))
+            cf.setCharge(int(rng.integers(0, 3)))
+            cf.setQuality(rng.uniform(0, 1))
+            # some consensus features without adduct, name or feature of a map
+            if meta_values and i % 3:
+                cf.setMetaValue("best ion", "[M+H]+")
+            if meta_values and i % 4:
+                cf.setMetaValue("label", f"compound{i}")
+            for m in range(3):
+                if (i + m) % 4:
+                    f = poms.BaseFeature()
+                    f.setRT(cf.getRT())
+                    f.setMZ(cf.getMZ())
+                    f.setIntensity(rng.uniform(1e3, 1e7))
+                    f.setUniqueId(int(rng.integers(0, 2**63)))
+                    cf.insert(m, f)
+            consensus_map.push_back(cf)
+        return consensus_map
+
+    def reference_df(self, consensus_map):
+        import pandas as pd
+
+        # reference: get_df and one loop per column, as originally implemented in export_consensus_df
+        df = consensus_map.get_df().drop(["sequence"], axis=1)
+        for cf in consensus_map:
+            if cf.metaValueExists("best ion"):
+                df.insert(4, "adduct", [cf.getMetaValue("best ion") for cf in consensus_map])
+                break
+        for cf in consensus_map:
+            if cf.metaValueExists("label"):
+                df["name"] = [cf.getMetaValue("label") for cf in consensus_map]
+                break
+        if "adduct" in df.columns:
+            df.insert(
+                0,
+                "metabolite",
+                [
+                    f"{round(mz, 4)}@{round(rt, 2)}@{adduct}"
+                    for mz, rt, adduct in zip(df["mz"].tolist(), df["RT"].tolist(), df["adduct"].tolist())
+                ],
+            )
+        else:
+            df.insert(
+                0, "metabolite", [f"{round(mz, 4)}@{round(rt, 2)}" for mz, rt in zip(df["mz"].tolist(), df["RT"].tolist())]
+            )
+        fnames = [Path(value.filename).name for value in consensus_map.getColumnHeaders().values()]
+        ids = [[] for _ in fnames]
+        for cf in consensus_map:
+            fids = {f.getMapIndex(): f.getUniqueId() for f in cf.getFeatureList()}
+            for i, fname in enumerate(fnames):
+                if i in fids.keys():
+                    ids[i].append(str(fids[i]))
+                else:
+                    ids[i].append(pd.NA)
+        for i, f in enumerate(fnames):
+            df[f"{fnames[i]}_IDs"] = ids[i]
+        return df.rename(columns={col: Path(col).name for col in df.columns if Path(col).exists()})
+
+    def assert_matches_reference(self, consensus_map):
+        import pandas as pd
+
+        result = self.export.consensus_df(consensus_map)
+        expected = self.reference_df(consensus_map)
+        # get_df orders the intensity columns by set order, they are ordered by map index now
+        intensities = ["sample0.mzML", "sample1.mzML", "sample2.mzML"]
+        self.assertEqual([c for c in result.columns if c in intensities], intensities)
+        self.assertEqual(
+            [c for c in result.columns if c not in intensities], [c for c in expected.columns if c not in intensities]
+        )
+        self.assertEqual(sorted(result.columns), sorted(expected.columns))
+        expected = expected[result.columns]
+        self.assertEqual(list(result.dtypes), list(expected.dtypes))
+        pd.testing.assert_frame_equal(result, expected)
+        return result
+
+    def test_matches_get_df(self):
+        result = self.assert_matches_reference(self.consensus_map())
+        self.assertIn("adduct", result.columns)
+        self.assertIn("name", result.columns)
+        self.assertTrue(result["sample0.mzML_IDs"].isna().any())
+
+    def test_without_adducts_and_names(self):
+        result = self.assert_matches_reference(self.consensus_map(meta_values=False))
+        self.assertNotIn("adduct", result.columns)
+        self.assertNotIn("name", result.columns)
+
+
+class TestFeatureMaps(unittest.TestCase):
+    def test_matches_feature_by_feature_map(self):
+        import pandas as pd
+        import pyopenms as poms
+
+        feature_maps = load_python_tool("feature_maps")
+        rng = np.random.default_rng(42)
+        n = 50
+        rt_start = rng.uniform(0, 600, n)
+        mz_start = rng.uniform(100, 1000, n)
+        df = pd.DataFrame(
+            {
+                "charge": rng.integers(0, 3, n),
+                "RT": rt_start + 5,
+                "mz": mz_start + 0.005,
+                "RTstart": rt_start,
+                "RTend": rt_start + rng.uniform(0, 20, n),
+                "MZstart": mz_start,
+                "MZend": mz_start + rng.uniform(0, 0.01, n),
+                "quality": rng.uniform(0, 1, n),
+                "intensity": rng.uniform(1e3, 1e7, n),
+                "num_of_masstraces": rng.integers(1, 4, n),
+                "adduct": rng.choice(["[M+H]+", "[M+Na]+", "nan"], n),
+            },
+            index=rng.integers(0, 2**63, n, dtype=np.uint64),
+        )
+        # hulls collapsed to a line or a point and ranges in reverse order
+        df.loc[df.index[:5], "RTend"] = df["RTstart"].iloc[:5]
+        df.loc[df.index[3:8], "MZend"] = df["MZstart"].iloc[3:8]
+        df.loc[df.index[8:12], ["RTstart", "RTend"]] = df[["RTend", "RTstart"]].iloc[8:12].to_numpy()
+        # reference: one feature with a hull added point by point per row, as originally implemented
+        expected = poms.FeatureMap()
+        expected.setPrimaryMSRunPath(["sample.mzML".encode()])
+        for i, row in df.iterrows():
+            f = poms.Feature()
+            f.setRT(row["RT"])
+            f.setMZ(row["mz"])
+            f.setIntensity(row["intensity"])
+            f.setOverallQuality(row["quality"])
+            f.setCharge(row["charge"])
+            if row["adduct"] != "nan":
+                f.setMetaValue("dc_charge_adducts", row["adduct"])
+            f.setMetaValue("num_of_masstraces", row["num_of_masstraces"])
+            f.setUniqueId(int(i))
+            hull = poms.ConvexHull2D()
+            hull.addPoint([row["RTstart"], row["MZstart"]])
+            hull.addPoint([row["RTend"], row["MZend"]])
+            hull.addPoint([row["RTend"], row["MZstart"]])
+            hull.addPoint([row["RTstart"], row["MZend"]])
+            f.setConvexHulls([hull])
+            expected.push_back(f)
+        result = feature_maps.feature_map(df, "sample.mzML")
+        paths, expected_paths = [], []
+        result.getPrimaryMSRunPath(paths)
+        expected.getPrimaryMSRunPath(expected_paths)
+        self.assertEqual(paths, expected_paths)
+        self.assertEqual(result.size(), expected.size())
+        for f, g in zip(result, expected):
+            self.assertEqual(
+                (f.getRT(), f.getMZ(), f.getIntensity(), f.getOverallQuality(), f.getCharge(), f.getUniqueId()),
+                (g.getRT(), g.getMZ(), g.getIntensity(), g.getOverallQuality(), g.getCharge(), g.getUniqueId()),
+            )
+            keys, expected_keys = [], []
+            f.getKeys(keys)
+            g.getKeys(expected_keys)
+            self.assertEqual(keys, expected_keys)
+            for key in keys:
+                self.assertEqual(f.getMetaValue(key), g.getMetaValue(key))
+            points, expected_points = f.getConvexHulls()[0].getHullPoints(), g.getConvexHulls()[0].getHullPoints()
+            self.assertTrue(np.array_equal(points, expected_points), (points, expected_points))
+
+
+class TestMS2Annotation(unittest.TestCase):
+    def test_matches_loop_annotation(self):
+        import pandas as pd
+
+        annotate = load_python_tool("annotate-ms2")
+        # native ID 1 has a duplicate scan and two scans, native ID 9 has no spectrum
+        spectra = pd.DataFrame(
+            {"index": ["0", "1", "1", "1", "2"], "SCANS": ["4", "5", "5", "6", "7"]}
+        )
+        spectral_matches = pd.DataFrame(
+            {
+                "opt_spec_native_id": ["0", "2", "2", "1", "9"],
+                "description": ["a", "b", "c", "d", "e"],
+                "smiles": ["CO", "CCO", None, "CCCO", "C"],
+                "opt_ppm_error": [0.5, 1.5, 2.5, 3.5, 4.5],
+                "opt_match_score": [0.9, 0.8, 0.7, 0.6, 0.5],
+            }
+        )
+        # feature 11 has two MGF entries, feature 13 none
+        mgf_params = pd.DataFrame({"feature_id": ["10", "11", "11", "12"], "scans": ["4", "4", "7", "6"]})
+        # m1 and m4 have two consensus features, m5 is not in the GNPS feature matrix
+        gnps_features = pd.DataFrame(
+            {"consensus_feature_id": [10, 11, 13, 13, 12, 10]}, index=["m1", "m2", "m3", "m1", "m4", "m4"]
+        )
+        features = pd.DataFrame({"intensity": range(6)}, index=["m1", "m2", "m3", "m4", "m5", "m2"])
+
+        # reference: nested loops, as originally implemented in annotate-ms2
+        spectralmatch_DF = spectral_matches.copy()
+        spectralmatch_DF["SCANS"] = ""
+        for i, idx in zip(spectralmatch_DF.index, spectralmatch_DF["opt_spec_native_id"]):
+            hits = []
+            for index, scan_number in zip(spectra["index"], spectra["SCANS"]):
+                if idx == index:
+                    hit = f"{scan_number}"
+                    if hit not in hits:
+                        hits.append(hit)
+            spectralmatch_DF.loc[i, "SCANS"] = " ## ".join(hits)
+        scan_map = {}
+        for metabolite, consensus_id in zip(gnps_features.index, gnps_features["consensus_feature_id"].astype(str)):
+            for scan, mgf_id in zip(mgf_params["scans"], mgf_params["feature_id"]):
+                if consensus_id == mgf_id:
+                    scan_map[metabolite] = [scan]
+        expected = features.copy()
+        expected["SCANS"] = [scan_map.get(metabolite, []) for metabolite in expected.index]
+        expected["SpectralMatch"] = ""
+        expected["SpectralMatch_smiles"] = ""
+        for i, scans in zip(expected.index, expected["SCANS"]):
+            hits = [[], [], [], []]
+            for name, smiles, scan_number, ppm_error, score in zip(
+                spectralmatch_DF["description"],
+                spectralmatch_DF["smiles"],
+                spectralmatch_DF["SCANS"],
+                spectralmatch_DF["opt_ppm_error"],
+                spectralmatch_DF["opt_match_score"],
+            ):
+                if scan_number in scans:
+                    for hit, value in zip(hits, [name, smiles, ppm_error, score]):
+                        hit.append(str(value))
+            expected.loc[i, "SpectralMatch"] = " ## ".join(hits[0])
+            expected.loc[i, "SpectralMatch_smiles"] = " ## ".join(hits[1])
+            expected.loc[i, "SpectralMatch_ppm_error"] = " ## ".join(hits[2])
+            expected.loc[i, "SpectralMatch_score"] = " ## ".join(hits[3])
+        expected = expected.drop(columns=["SCANS"])
+
+        result = annotate.ms2_annotations(features, gnps_features, mgf_params, spectra, spectral_matches)
+        pd.testing.assert_frame_equal(result, expected)
+        # the last matching scan wins: scan 7 of feature 11 for m2, scan 4 of feature 10 for m4
+        self.assertEqual(result.loc["m2", "SpectralMatch"].tolist(), ["b ## c", "b ## c"])
+        self.assertEqual(result.loc["m4", "SpectralMatch"], "a")
+        # matches of more than one scan (native ID 1) are not assigned
+        self.assertNotIn("d", result["SpectralMatch"].tolist())
+
+
+class TestMS2QueryResults(unittest.TestCase):
+    def setUp(self):
+        import pandas as pd
+
+        self.ms2query = load_python_tool("run_ms2query")
+        # m1 has two consensus features, consensus feature 2 belongs to m2 and m5
+        self.df_gnps = pd.DataFrame(
+            {"consensus_feature_id": [1, 2, 3, 4, 5, 2]}, index=["m1", "m2", "m3", "m1", "m4", "m5"]
+        )
+        # no results for consensus feature 3, result 6 is not in the GNPS feature matrix
+        ids = [1, 4, 2, 6, 5]
+        self.df_ms2query = pd.DataFrame(
+            {col: [f"{col}-{i}" for i in ids] for col in self.ms2query.MS2QUERY_COLUMNS},
+            index=pd.Index(ids, name="feature_id"),
+        )
+        self.df_ms2query["ms2query_model_prediction"] = [0.9, 0.8, np.nan, 0.6, 0.5]
+        self.df = pd.DataFrame({"intensity": range(7)}, index=["m1", "m2", "m3", "m4", "m5", "m6", "m2"])
+
+    def test_matches_loop_merge(self):
+        import pandas as pd
+
+        # reference: one loop over the consensus features, as originally implemented in run_ms2query
+        expected = self.df.copy()
+        for i in self.df_gnps["consensus_feature_id"]:
+            if i in self.df_ms2query.index:
+                for col in self.ms2query.MS2QUERY_COLUMNS:
+                    expected.loc[
+                        self.df_gnps.index[self.df_gnps["consensus_feature_id"] == i].tolist()[0],
+                        f"MS2Query_{col}",
+                    ] = str(self.df_ms2query.loc[i, col])
+        result = self.ms2query.merge_ms2query_results(self.df, self.df_gnps, self.df_ms2query)
+        pd.testing.assert_frame_equal(result, expected)
+        # the result of the last consensus feature of a metabolite wins
+        self.assertEqual(result.loc["m1", "MS2Query_inchikey"], "inchikey-4")
+        # consensus feature 2 is assigned to its first metabolite only
+        self.assertEqual(result.loc["m2", "MS2Query_inchikey"].tolist(), ["inchikey-2", "inchikey-2"])
+        self.assertTrue(pd.isna(result.loc["m5", "MS2Query_inchikey"]))
+
+    def test_duplicate_results(self):
+        import pandas as pd
+
+        # the original loop wrote the string of all rows, the first result is used instead
+        df_ms2query = pd.concat([self.df_ms2query, self.df_ms2query.loc[[4]].replace("inchikey-4", "other")])
+        result = self.ms2query.merge_ms2query_results(self.df, self.df_gnps, df_ms2query)
+        self.assertEqual(result.loc["m1", "MS2Query_inchikey"], "inchikey-4")
+
+    def test_without_results(self):
+        result = self.ms2query.merge_ms2query_results(self.df, self.df_gnps, self.df_ms2query.loc[[6]])
+        self.assertEqual(list(result.columns), ["intensity"])
+
+
+class TestSiriusAnnotation(unittest.TestCase):
+    def setUp(self):
+        import pandas as pd
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.projects_dir = Path(self.dir.name, "sirius-projects")
+        # feature 2 has two entries, feature 3 is not in the feature matrix
+        self.write_summary(
+            "sample1",
+            "compound_identifications.tsv",
+            {
+                "id": ["1_sample1_0_1-x", "2_sample1_0_2-x", "3_sample1_0_2-x", "4_sample1_0_3-x"],
+                "molecularFormula": ["C6H12O6", "C2H6O", "CH4O", "C3H8O"],
+                "name": ["glucose", "ethanol", "methanol", None],
+                "InChI": ["a", "b", "c", "d"],
+                "smiles": ["OCC1OC(O)", "CCO", "CO", "CCCO"],
+            },
+        )
+        self.write_summary("sample1", "formula_identifications.tsv", {"id": ["1_sample1_0_1-x"], "molecularFormula": ["C6H12O6"]})
+        self.write_summary(
+            "sample2",
+            "canopus_compound_summary.tsv",
+            {
+                "id": ["1_sample2_0_5-x"],
+                "NPC#pathway": ["Carbohydrates"],
+                "NPC#superclass": ["Saccharides"],
+                "NPC#class": ["Monosaccharides"],
+                "ClassyFire#most specific class": ["Hexoses"],
+            },
+        )
+        # project without summary files
+        Path(self.projects_dir, "sample3").mkdir()
+        self.df = pd.DataFrame(
+            {
+                "intensity": [1.0, 2.0, 3.0, 4.0],
+                "sample1.mzML_IDs": ["1", "2", None, "4"],
+                "sample2.mzML_IDs": ["5", None, "6", "5"],
+                "sample3.mzML_IDs": ["7", "8", "9", "10"],
+            },
+            index=["m1", "m2", "m3", "m1"],
+        )
+
+    def write_summary(self, project, name, columns):
+        import pandas as pd
+
+        Path(self.projects_dir, project).mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(columns).to_csv(Path(self.projects_dir, project, name), sep="\t", index=False)
+
+    def reference_df(self, df):
+        import pandas as pd
+
+        # reference: one column at a time, as originally implemented in annotate-sirius
+        df = df.copy()
+        for result_directory in sorted(self.projects_dir.iterdir()):
+            for tool, annotation_file, cols in zip(
+                ["CSI:FingerID", "SIRIUS", "CANOPUS"],
+                ["compound_identifications.tsv", "formula_identifications.tsv", "canopus_compound_summary.tsv"],
+                [
+                    ["molecularFormula", "name", "InChI", "smiles"],
+                    ["molecularFormula"],
+                    ["NPC#pathway", "NPC#superclass", "NPC#class", "ClassyFire#most specific class"],
+                ],
+            ):
+                file = Path(result_directory, annotation_file)
+                if file.exists():
+                    df_tmp = pd.read_csv(file, sep="\t")
+                    df_tmp["id"] = df_tmp["id"].apply(lambda x: x.split("_0_")[1].split("-")[0])
+                    for col in cols:
+                        df[
+                            f"{tool}_{result_directory.name}_{col.replace('NPC#', '').replace('ClassyFire#', '')}"
+                        ] = df[f"{result_directory.name}.mzML_IDs"].map(df_tmp.set_index("id")[col].to_dict())
+        return df
+
+    def test_matches_column_by_column(self):
+        import pandas as pd
+
+        annotate = load_python_tool("annotate-sirius")
+        result = annotate.sirius_annotations(self.df, self.projects_dir)
+        expected = self.reference_df(self.df)
+        self.assertEqual(list(result.dtypes), list(expected.dtypes))
+        pd.testing.assert_frame_equal(result, expected)
+        # the last entry of feature 2 wins
+        self.assertEqual(result["CSI:FingerID_sample1_name"].iloc[1], "methanol")
+        # annotating again updates the columns in place
+        pd.testing.assert_frame_equal(annotate.sirius_annotations(result, self.projects_dir), expected)
+
+
+class TestCombineVariants(unittest.TestCase):
+    def test_matches_loop_combination(self):
+        import pandas as pd
+        from src.dataframes import combine_variants
+
+        # variants and plain names of the same metabolite, a prefix of another name and a missing value
+        df_auc = pd.DataFrame(
+            {
+                "sample1.mzML": [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0],
+                "sample2.mzML": [1.0, np.nan, 3.0, 5.0, 7.0, 9.0, 11.0],
+            },
+            index=["a#[M+H]+", "a#[M+Na]+", "a", "ab#[M+H]+", "b", "c#1", "c#2"],
+        )
+        # reference: nested loops over the metabolite names, as originally implemented in extract_chromatograms
+        combined = {}
+        metabolite_names = list(set([c.split("#")[0] for c in df_auc.index]))
+        for filename in df_auc.columns:
+            aucs = []
+            for a in metabolite_names:
+                auc = 0
+                for b in [b for b in df_auc.index if ((a + "#" in b and b.startswith(a)) or a == b)]:
+                    auc += df_auc.loc[b, filename]
+                aucs.append(auc)
+            combined[filename] = aucs
+        expected = pd.DataFrame(combined)
+        expected.set_index(pd.Index(metabolite_names), inplace=True)
+
+        result = combine_variants(df_auc)
+        # metabolites are in order of their first variant instead of set order
+        self.assertEqual(list(result.index), ["a", "ab", "b", "c"])
+        pd.testing.assert_frame_equal(result, expected.loc[result.index])
+        self.assertTrue(np.isnan(result.loc["a", "sample2.mzML"]))
+
+
+class TestEIC(unittest.TestCase):
+    def test_highest_in_windows(self):
+        from src.eic import highest_in_windows
+
+        rng = np.random.default_rng(42)
+        mz = np.sort(np.round(rng.uniform(100, 200, 500), 2))
+        intensity = rng.uniform(0, 1000, 500).astype(np.float32)
+        center = np.concatenate([rng.uniform(95, 205, 300), mz[:50]])
+        width = np.concatenate([rng.uniform(0, 0.5, 300), np.zeros(50)])
+        # windows with bounds on peaks (inclusive), without peaks and outside of the spectrum
+        mz_min, mz_max = center - width, center + width
+        for baseline in [0, 500]:
+            expected = []
+            for lower, upper in zip(mz_min, mz_max):
+                highest = 0
+                for peak_mz, peak_intensity in zip(mz, intensity):
+                    if lower <= peak_mz <= upper:
+                        highest = max(highest, int(peak_intensity))
+                expected.append(highest if highest > baseline else 0)
+            self.assertEqual(highest_in_windows(mz, intensity, mz_min, mz_max, baseline).tolist(), expected)
+        self.assertEqual(highest_in_windows(mz[:0], intensity[:0], mz_min, mz_max, 0).tolist(), [0] * len(mz_min))
+
+
+class TestPeakCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.mzML = Path(self.dir.name, "mzML-files", "sample.mzML")
+        self.mzML.parent.mkdir()
+        self.cache_dir = Path(self.dir.name, "mzML-cache")
+
+    def write_mzML(self, rts):
+        import pyopenms as poms
+
+        exp = poms.MSExperiment()
+        for rt in rts:
+            spec = poms.MSSpectrum()
+            spec.setRT(rt)
+            spec.setMSLevel(1)
+            spec.set_peaks(([100.0, 200.0], [10.0, 20.0]))
+            exp.addSpectrum(spec)
+        poms.MzMLFile().store(str(self.mzML), exp)
+
+    def test_changed_source_rebuilds_cache(self):
+        from src.mzml import read_spectra
+
+        self.write_mzML([1.0, 2.0])
+        self.assertEqual(read_spectra(self.mzML, self.cache_dir, ["RT"])["RT"].to_pylist(), [1.0, 2.0])
+        # same cache as long as the mzML file is unchanged
+        mtime = Path(self.cache_dir, "sample.parquet").stat().st_mtime_ns
+        read_spectra(self.mzML, self.cache_dir, ["RT"])
+        self.assertEqual(Path(self.cache_dir, "sample.parquet").stat().st_mtime_ns, mtime)
+        self.write_mzML([1.0, 2.0, 3.0])
+        table = read_spectra(self.mzML, self.cache_dir)
+        self.assertEqual(table["RT"].to_pylist(), [1.0, 2.0, 3.0])
+        self.assertEqual(table["base peak m/z"].to_pylist(), [200.0] * 3)
+
+    def test_orphaned_caches_removed(self):
+        from src.mzml import cache_peaks, remove_orphaned_caches
+
+        self.write_mzML([1.0])
+        cache = cache_peaks(self.mzML, self.cache_dir)
+        # caches which can not be read are removed as well
+        broken = Path(self.cache_dir, "broken.parquet")
+        broken.write_text("not parquet")
+        remove_orphaned_caches(self.cache_dir)
+        self.assertTrue(cache.exists())
+        self.assertFalse(broken.exists())
+        self.mzML.unlink()
+        remove_orphaned_caches(self.cache_dir)
+        self.assertFalse(cache.exists())
+
+
+class TestStepCache(unittest.TestCase):
+    def setUp(self):
+        from src.workflow.StepCache import StepCache
+
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache = StepCache(Path(self.dir, "cache"))
+        self.input = Path(self.dir, "sample.mzML")
+        self.input.write_text("spectra")
+
+    def test_key_changes_with_input(self):
+        key = self.cache.key("FeatureFinderMetabo", ["-in", str(self.input)], [self.input])
+        self.assertEqual(key, self.cache.key("FeatureFinderMetabo", ["-in", str(self.input)], [self.input]))
+        self.assertNotEqual(key, self.cache.key("FeatureFinderMetabo", ["-in", str(self.input), "-x"], [self.input]))
+        self.input.write_text("other spectra")
+        changed = self.cache.key("FeatureFinderMetabo", ["-in", str(self.input)], [self.input])
+        self.assertNotEqual(key, changed)
+        # digests are remembered, also by a new cache instance
+        self.assertEqual(
+            changed,
+            type(self.cache)(self.cache.cache_dir).key("FeatureFinderMetabo", ["-in", str(self.input)], [self.input]),
+        )
+
+    def test_restore_after_store(self):
+        output = Path(self.dir, "results", "sample.featureXML")
+        output_dir = Path(self.dir, "results", "sirius-project")
+        output.parent.mkdir()
+        output.write_text("features")
+        Path(output_dir, "compound").mkdir(parents=True)
+        Path(output_dir, "compound", "formula.tsv").write_text("formulas")
+        key = self.cache.key("tool", [], [self.input])
+        self.assertFalse(self.cache.restore(key))
+        self.cache.store(key, [output, output_dir, Path(self.dir, "missing.tsv")])
+        shutil.rmtree(output.parent)
+        self.assertTrue(self.cache.restore(key))
+        self.assertEqual(output.read_text(), "features")
+        self.assertEqual(Path(output_dir, "compound", "formula.tsv").read_text(), "formulas")
+
+    def test_least_recently_used_entries_evicted(self):
+        from src.workflow.StepCache import StepCache
+
+        cache = StepCache(Path(self.dir, "limited-cache"), max_size=400)
+        outputs = {}
+        for name in ["a", "b", "c", "d"]:
+            outputs[name] = Path(self.dir, f"{name}.featureXML")
+            outputs[name].write_text(name * 100)
+        cache.store("a", [outputs["a"]])
+        cache.store("b", [outputs["b"]])
+        self.assertTrue(cache.restore("a"))
+        # space for two entries (with manifest), "b" is the least recently used one
+        cache.store("c", [outputs["c"]])
+        self.assertTrue(cache.restore("a"))
+        self.assertFalse(cache.restore("b"))
+        self.assertTrue(cache.restore("c"))
+        # outputs larger than the limit are not cached
+        outputs["d"].write_text("d" * 500)
+        cache.store("d", [outputs["d"]])
+        self.assertFalse(cache.restore("d"))
+        self.assertTrue(cache.restore("c"))
+
+
+
+class TestStepJournal(unittest.TestCase):
+    def setUp(self):
+        from src.workflow.StepJournal import StepJournal
+
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.journal_file = Path(self.dir, "step-journal.jsonl")
+        self.outputs = {}
+        journal = StepJournal(self.journal_file)
+        journal.start()
+        for step in ["a", "b", "c"]:
+            self.outputs[step] = [str(Path(self.dir, f"{step}.featureXML"))]
+            Path(self.outputs[step][0]).write_text(step)
+            journal.record(step, step, self.outputs[step])
+        self.journal = StepJournal(self.journal_file)
+
+    def test_resume_skips_completed_steps(self):
+        self.journal.start(resume=True)
+        self.assertTrue(all(self.journal.skip(step, self.outputs[step]) for step in ["a", "b", "c"]))
+
+    def test_resume_stops_at_first_changed_step(self):
+        self.journal.start(resume=True)
+        self.assertTrue(self.journal.skip("a", self.outputs["a"]))
+        self.assertFalse(self.journal.skip("b-changed", self.outputs["b"]))
+        # all following steps of this branch are executed again
+        self.assertFalse(self.journal.skip("c", self.outputs["c"]))
+
+    def test_other_branches_keep_resuming(self):
+        self.journal.start(resume=True)
+        self.assertFalse(self.journal.skip("b-changed", self.outputs["b"]))
+        skipped = []
+        branch = threading.Thread(target=lambda: skipped.append(self.journal.skip("c", self.outputs["c"])))
+        branch.start()
+        branch.join()
+        self.assertEqual(skipped, [True])
+
+    def test_resume_stops_at_modified_output(self):
+        Path(self.outputs["b"][0]).write_text("modified b")
+        self.journal.start(resume=True)
+        self.assertTrue(self.journal.skip("a", self.outputs["a"]))
+        self.assertFalse(self.journal.skip("b", self.outputs["b"]))
+
+    def test_resume_stops_at_missing_output(self):
+        Path(self.outputs["b"][0]).unlink()
+        self.journal.start(resume=True)
+        self.assertTrue(self.journal.skip("a", self.outputs["a"]))
+        self.assertFalse(self.journal.skip("b", self.outputs["b"]))
+        self.assertFalse(self.journal.skip("c", self.outputs["c"]))
+
+    def test_new_run_clears_journal(self):
+        self.journal.start()
+        self.assertFalse(self.journal.exists())
+        self.assertFalse(self.journal.skip("a", self.outputs["a"]))
+
+
+class TestPythonStepCache(unittest.TestCase):
+    # Annotates the feature matrix like run_ms2query, the number of runs is counted in runs.txt
+    SCRIPT = textwrap.dedent(
+        """
+        import csv
+        import json
+        import sys
+        from pathlib import Path
+
+        DEFAULTS = [
+            {"key": "in", "value": []},
+            {"key": "out", "value": []},
+            {"key": "out_ms2query_csv", "value": []},
+            {"key": "workers", "value": 0},
+        ]
+
+        if __name__ == "__main__":
+            with open(sys.argv[1]) as f:
+                params = json.load(f)
+            with open(Path(Path(__file__).parent, "runs.txt"), "a") as f:
+                f.write(f"run {params['workers']}\\n")
+            with open(params["in"][0], newline="") as f:
+                rows = list(csv.DictReader(f, delimiter="\\t"))
+            with open(params["out_ms2query_csv"][0], "w") as f:
+                f.write("feature_id,analog_compound_name\\n")
+                f.writelines(f"{row['metabolite']},analog\\n" for row in rows)
+            with open(params["out"][0], "w", newline="") as f:
+                writer = csv.DictWriter(
+                    f, fieldnames=list(rows[0]) + ["MS2Query_analog_compound_name"], delimiter="\\t"
+                )
+                writer.writeheader()
+                writer.writerows({**row, "MS2Query_analog_compound_name": "analog"} for row in rows)
+        """
+    )
+
+    def setUp(self):
+        from src.workflow.CommandExecutor import CommandExecutor
+        from src.workflow.Logger import Logger
+        from src.workflow.ParameterManager import ParameterManager
+        from src.workflow.Scheduler import Scheduler
+        from src.workflow.StepCache import StepCache
+
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        workflow_dir = Path(self.dir, "workflow")
+        Path(workflow_dir, "pids").mkdir(parents=True)
+        self.executor = CommandExecutor(
+            workflow_dir,
+            Logger(workflow_dir),
+            ParameterManager(workflow_dir),
+            scheduler=Scheduler(max_workers=2, threads=3),
+            cache=StepCache(Path(self.dir, "cache")),
+        )
+        self.script = Path(self.dir, "annotate.py")
+        self.script.write_text(self.SCRIPT)
+        self.consensus_df = Path(self.dir, "results", "feature-matrix.tsv")
+        self.ms2query_csv = Path(self.dir, "results", "MS2.csv")
+
+    def run_workflow(self):
+        # Results are re-created by each run, the feature matrix is exported before the annotation step
+        shutil.rmtree(self.consensus_df.parent, ignore_errors=True)
+        self.consensus_df.parent.mkdir()
+        self.consensus_df.write_text("metabolite\tsample.mzML\nm1\t100.0\nm2\t200.0\n")
+        self.executor.run_python(
+            str(self.script),
+            {
+                "in": [str(self.consensus_df)],
+                "out": [str(self.consensus_df)],
+                "out_ms2query_csv": [str(self.ms2query_csv)],
+            },
+        )
+        with open(self.consensus_df, newline="") as f:
+            return list(csv.DictReader(f, delimiter="\t"))
+
+    def test_annotations_restored(self):
+        for _ in range(2):
+            rows = self.run_workflow()
+            self.assertEqual([row["MS2Query_analog_compound_name"] for row in rows], ["analog", "analog"])
+            self.assertTrue(self.ms2query_csv.is_file())
+        # the second run was restored from the cache
+        self.assertEqual(Path(self.dir, "runs.txt").read_text().count("run"), 1)
+
+    def test_resume_runs_steps_with_changed_inputs(self):
+        from src.workflow.StepJournal import StepJournal
+
+        self.executor.cache = None
+        self.executor.journal = StepJournal(Path(self.dir, "step-journal.jsonl"))
+        gnps_df = Path(self.dir, "results", "feature-matrix-gnps.tsv")
+        gnps_df.parent.mkdir()
+
+        def annotate(resume, source):
+            self.executor.journal.start(resume)
+            self.executor.run_python(
+                str(self.script),
+                {"in": [str(source)], "out": [str(self.consensus_df)], "out_ms2query_csv": [str(self.ms2query_csv)]},
+            )
+            return Path(self.dir, "runs.txt").read_text().count("run")
+
+        # feature matrix annotated in place, unchanged since the previous run
+        self.consensus_df.write_text("metabolite\tsample.mzML\nm1\t100.0\n")
+        self.assertEqual(annotate(False, self.consensus_df), 1)
+        self.assertEqual(annotate(True, self.consensus_df), 1)
+        # separate input, re-created after the previous run
+        gnps_df.write_text("metabolite\tsample.mzML\nm1\t100.0\n")
+        self.assertEqual(annotate(False, gnps_df), 2)
+        self.assertEqual(annotate(True, gnps_df), 2)
+        time.sleep(0.01)
+        gnps_df.write_text("metabolite\tsample.mzML\nm2\t200.0\n")
+        self.assertEqual(annotate(True, gnps_df), 3)
+
+    def test_concurrent_runs_of_a_script(self):
+        # each run gets its own parameter file, which is removed afterwards
+        self.consensus_df.parent.mkdir()
+        runs = []
+        for i in range(2):
+            source = Path(self.dir, "results", f"features{i}.tsv")
+            source.write_text(f"metabolite\tsample.mzML\nm{i}\t100.0\n")
+            io = {
+                "in": [str(source)],
+                "out": [str(Path(self.dir, "results", f"annotated{i}.tsv"))],
+                "out_ms2query_csv": [str(Path(self.dir, "results", f"MS2-{i}.csv"))],
+            }
+            runs.append(threading.Thread(target=self.executor.run_python, args=(str(self.script), io)))
+        for run in runs:
+            run.start()
+        for run in runs:
+            run.join()
+        for i in range(2):
+            self.assertIn(f"m{i}\t", Path(self.dir, "results", f"annotated{i}.tsv").read_text())
+        self.assertEqual(list(Path(self.dir, "workflow").glob("annotate*.json")), [])
+
+    def test_workers_from_scheduler(self):
+        self.run_workflow()
+        # the process pool of the script gets the threads assigned to its job
+        self.assertEqual(Path(self.dir, "runs.txt").read_text(), "run 3\n")
+        # the number of workers does not change the results and is not part of the cache key
+        self.executor.scheduler.threads = 1
+        self.run_workflow()
+        self.assertEqual(Path(self.dir, "runs.txt").read_text(), "run 3\n")
+
+
+class TestMemoryModel(unittest.TestCase):
+    MB = 1024**2
+
+    def setUp(self):
+        from src.workflow.MemoryModel import MemoryModel
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.history_file = Path(self.dir.name, "memory-history.json")
+        self.model = MemoryModel(self.history_file)
+
+    def test_default_factor(self):
+        self.assertEqual(
+            self.model.estimate("FeatureFinderMetabo", 100 * self.MB),
+            self.model.BASE_MEMORY + 400 * self.MB,
+        )
+
+    def test_small_inputs_ignored(self):
+        # the peak memory of tiny inputs is the base memory, not memory per input byte
+        self.model.record("FileFilter", 1000, 150 * self.MB)
+        self.model.record("FileFilter", 100 * self.MB, 450 * self.MB)
+        self.assertEqual(self.model.estimate("FileFilter", 200 * self.MB), 750 * self.MB)
+
+    def test_outlier_ignored(self):
+        for _ in range(19):
+            self.model.record("FileFilter", 100 * self.MB, 300 * self.MB)
+        self.model.record("FileFilter", 100 * self.MB, 5000 * self.MB)
+        self.assertEqual(self.model.estimate("FileFilter", 100 * self.MB), 300 * self.MB)
+
+    def test_high_percentile(self):
+        for rss in range(310, 510, 10):
+            self.model.record("FileFilter", 100 * self.MB, rss * self.MB)
+        # 90th percentile of the memory per input byte (18th of 20 measurements)
+        self.assertEqual(self.model.estimate("FileFilter", 100 * self.MB), 480 * self.MB)
+
+    def test_memory_limit(self):
+        from src.workflow.MemoryModel import MemoryModel
+
+        model = MemoryModel(self.history_file, memory_limit=1024 * self.MB)
+        self.assertEqual(model.estimate("FileFilter", 10000 * self.MB), 1024 * self.MB)
+        self.assertEqual(model.estimate("FileFilter", 0), model.BASE_MEMORY)
+
+    def test_persistent_per_script(self):
+        from src.workflow.CommandExecutor import CommandExecutor
+        from src.workflow.MemoryModel import MemoryModel
+
+        script = CommandExecutor._tool_name(["python", "src/python-tools/export_consensus_df.py", "params.json"])
+        self.assertEqual(script, "export_consensus_df")
+        self.model.record(script, 100 * self.MB, 1200 * self.MB)
+        model = MemoryModel(self.history_file)
+        self.assertEqual(model.estimate(script, 100 * self.MB), 1200 * self.MB)
+        self.assertEqual(model.estimate("annotate-ms2", 100 * self.MB), model.BASE_MEMORY + 200 * self.MB)
+
+
+class TestScheduler(unittest.TestCase):
+    def job(self, scheduler, seconds=0.05):
+        def run():
+            time.sleep(seconds)
+            return scheduler.job_threads()
+
+        return run
+
+    def test_memory_budget(self):
+        from src.workflow.Scheduler import Scheduler
+
+        scheduler = Scheduler(max_workers=4, threads=4, memory_budget=100)
+        lock = threading.Lock()
+        running = []
+        reserved = []
+
+        def job(memory):
+            def run():
+                with lock:
+                    running.append(memory)
+                    reserved.append(sum(running))
+                time.sleep(0.02)
+                with lock:
+                    running.remove(memory)
+                return memory
+
+            return run
+
+        memory = [60, 30, 50, 20, 90, 10, 40, 70, 5, 35]
+        self.assertEqual(scheduler.run([job(m) for m in memory], memory), memory)
+        self.assertLessEqual(max(reserved), 100)
+        self.assertGreaterEqual(max(reserved), 90)
+        # a job above the budget runs, but only on its own
+        reserved.clear()
+        self.assertEqual(scheduler.run([job(150), job(10)], [150, 10]), [150, 10])
+        self.assertEqual(reserved, [150, 10])
+
+    def test_threads_split_across_running_jobs(self):
+        from src.workflow.Scheduler import Scheduler
+
+        scheduler = Scheduler(max_workers=4, threads=8)
+        self.assertEqual(scheduler.run([self.job(scheduler)] * 4), [2] * 4)
+        self.assertEqual(scheduler.run([self.job(scheduler)] * 4, max_parallel=2), [4] * 4)
+        self.assertEqual(scheduler.job_threads(), 8)
+
+    def test_threads_of_concurrent_steps(self):
+        from src.workflow.Scheduler import Scheduler
+
+        scheduler = Scheduler(max_workers=4, threads=8)
+        results = {}
+        step = threading.Thread(
+            target=lambda: results.update(a=scheduler.run([self.job(scheduler, 0.3)] * 2, max_parallel=2))
+        )
+        step.start()
+        time.sleep(0.1)
+        # a job of another step only gets the threads which are not used by running jobs
+        results["b"] = scheduler.run([self.job(scheduler)])
+        step.join()
+        self.assertEqual(results, {"a": [4, 4], "b": [1]})
+        # after all jobs finished, the whole budget is available again
+        self.assertEqual(scheduler.run([self.job(scheduler)]), [8])
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_single_writer_thread(self):
+        from src.workflow.Logger import Logger
+
+        loggers = [Logger(Path(self.dir.name, f"workflow{i}")) for i in range(3)]
+        for i, logger in enumerate(loggers):
+            logger.log(f"message {i}", 2)
+        writers = [t for t in threading.enumerate() if t.name == "Logger writer"]
+        self.assertEqual(len(writers), 1)
+        # buffered messages of all loggers are written by the writer thread
+        deadline = time.time() + 10 * Logger.FLUSH_INTERVAL
+        while not all(logger.log_file.exists() for logger in loggers) and time.time() < deadline:
+            time.sleep(0.05)
+        for i, logger in enumerate(loggers):
+            self.assertIn(f"message {i}", logger.log_file.read_text())
+
+    def test_tail(self):
+        from src.workflow.Logger import Logger
+
+        logger = Logger(Path(self.dir.name, "workflow"))
+        self.assertEqual(logger.tail(), ("", 0))
+        logger.log("started")
+        logger.log("command", 1)
+        logger.log("output", 2)
+        logger.flush()
+        text, offset = logger.tail(0, 2)
+        self.assertEqual(text, "started\n\ncommand\n\noutput\n\n")
+        self.assertEqual(logger.tail(0, 0)[0], "started\n\n")
+        self.assertEqual(logger.tail(0, 1)[0], "started\n\ncommand\n\n")
+        # only messages written after the offset
+        self.assertEqual(logger.tail(offset, 2), ("", offset))
+        logger.log("finished")
+        text, new_offset = logger.tail(offset, 2)
+        self.assertEqual(text, "finished\n\n")
+        self.assertEqual(new_offset, logger.log_file.stat().st_size)
+        # incomplete last lines are returned by the next call
+        with open(logger.log_file, "a", encoding="utf-8") as f:
+            f.write('{"time": 0, "level": 0, "mess')
+        self.assertEqual(logger.tail(new_offset, 2), ("", new_offset))
+
+    def test_run_id(self):
+        from src.workflow.Logger import Logger
+
+        logger = Logger(Path(self.dir.name, "workflow"))
+        self.assertEqual(logger.run_id(), "")
+        logger.log("first run")
+        run_id = logger.run_id()
+        logger.log("more messages")
+        self.assertEqual(logger.run_id(), run_id)
+        # a new run starts a new log, a longer offset from the previous log starts from the beginning
+        _, offset = logger.tail()
+        logger.log_file.unlink()
+        time.sleep(0.01)
+        logger.log("second run")
+        self.assertNotEqual(logger.run_id(), run_id)
+        self.assertEqual(logger.tail(offset, 2)[0], "second run\n\n")
+
+
+class TestPythonWorker(unittest.TestCase):
+    SCRIPT = textwrap.dedent(
+        """
+        import os
+        import sys
+        from pathlib import Path
+
+        Path(sys.argv[1]).write_text(str(os.getppid()))
+        print("output line")
+        data = b"x" * (50 * 1024**2)
+        print("something went wrong", file=sys.stderr)
+        sys.exit(int(sys.argv[2]))
+        """
+    )
+
+    def setUp(self):
+        from src.workflow.CommandExecutor import CommandExecutor
+        from src.workflow.Logger import Logger
+        from src.workflow.ParameterManager import ParameterManager
+        from src.workflow.PythonWorker import PythonWorker
+
+        if not PythonWorker.supported():
+            self.skipTest("Python worker is not supported on this platform.")
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        workflow_dir = Path(self.dir.name, "workflow")
+        Path(workflow_dir, "pids").mkdir(parents=True)
+        worker = PythonWorker(Path(workflow_dir, "pids"))
+        worker.start()
+        self.addCleanup(worker.stop)
+        self.executor = CommandExecutor(workflow_dir, Logger(workflow_dir), ParameterManager(workflow_dir), python_worker=worker)
+        self.script = Path(self.dir.name, "script.py")
+        self.script.write_text(self.SCRIPT)
+
+    def run_script(self, exit_code):
+        ppid_file = Path(self.dir.name, "ppid.txt")
+        success = self.executor.run_command(["python", str(self.script), str(ppid_file), str(exit_code)])
+        self.executor.logger.flush()
+        # the script runs in a process forked from the worker, not as a child of this process
+        self.assertNotEqual(int(ppid_file.read_text()), os.getpid())
+        with open(self.executor.metrics_file, encoding="utf-8") as f:
+            metrics = [json.loads(line) for line in f]
+        return success, self.executor.logger.tail()[0], metrics[-1]
+
+    def test_failed_script(self):
+        success, log, metrics = self.run_script(3)
+        self.assertFalse(success)
+        self.assertEqual(metrics["returncode"], 3)
+        self.assertIn("output line", log)
+        self.assertIn("ERRORS OCCURRED:\nsomething went wrong", log)
+
+    def test_metrics(self):
+        success, log, metrics = self.run_script(0)
+        self.assertTrue(success)
+        self.assertEqual(metrics["returncode"], 0)
+        self.assertEqual(metrics["tool"], "script")
+        self.assertIsNotNone(metrics["user"])
+        self.assertIsNotNone(metrics["sys"])
+        self.assertGreaterEqual(metrics["peak_rss"], 50 * 1024**2)
+        # stderr is logged as an error even if the script succeeds
+        self.assertIn("something went wrong", log)
+
+
+class TestWorkflowPickle(unittest.TestCase):
+    def test_executor_pickle(self):
+        # the workflow process is started with the spawn method on Windows and macOS
+        from src.workflow.CommandExecutor import CommandExecutor
+        from src.workflow.Logger import Logger
+        from src.workflow.ParameterManager import ParameterManager
+        from src.workflow.PythonWorker import PythonWorker
+        from src.workflow.Scheduler import Scheduler
+        from src.workflow.StepCache import StepCache
+        from src.workflow.StepJournal import StepJournal
+
+        with tempfile.TemporaryDirectory() as tmp:
+            workflow_dir = Path(tmp, "workflow")
+            logger = Logger(workflow_dir)
+            logger.log("started")
+            executor = CommandExecutor(
+                workflow_dir,
+                logger,
+                ParameterManager(workflow_dir),
+                Scheduler(max_workers=2),
+                StepCache(Path(tmp, "cache")),
+                StepJournal(Path(workflow_dir, "step-journal.jsonl")),
+                PythonWorker(Path(workflow_dir, "pids")),
+            )
+            copy = pickle.loads(pickle.dumps(executor))
+            self.assertEqual(copy.scheduler.run([lambda: 1, lambda: 2]), [1, 2])
+            self.assertFalse(copy.python_worker.running)
+            copy.logger.log("continued")
+            self.assertEqual(logger.log_file.read_text().count("continued"), 1)
+
+
 if __name__ == '__main__':
     unittest.main()